@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+"""
+This module benchmarks B3 core components without the need of a game server.
+
+Event dispatcher: N synthetic events are pushed through the real Parser.queueEvent
+and Parser.handleEvents methods and handled by M plugins:
+
+    python -m b3.benchmark dispatch -n 20000 -m 8
+    python -m b3.benchmark dispatch -n 2000 -m 4 -w 0.5 -k 1
+
+Log line parsing: lines of a recorded games_mp.log are matched by the parser getLineParts method and
+by the former linear scan over _lineFormats (a synthetic log is used when no file is given):
+
+    python -m b3.benchmark lines -p cod4 games_mp.log
+
+Client objects: memory used by connected clients (Client) and by storage lookup results (ClientRecord):
+
+    python -m b3.benchmark clients -n 64
+"""
+
+__version__ = '1.2'
+
+import argparse
+import importlib
+import logging
+import re
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import thread
+except ImportError:
+    import _thread as thread
+
+import b3.clients
+import b3.dispatch
+import b3.events
+import b3.output
+import b3.parser
+import b3.plugin
+
+from collections import OrderedDict
+
+
+def percentile(samples, pct):
+    """
+    Return the given percentile of an already sorted list of samples.
+    :param samples: The sorted samples list
+    :param pct: The percentile to compute (0-100)
+    """
+    if not samples:
+        return 0.0
+    index = int(round((len(samples) - 1) * pct / 100.0))
+    return samples[index]
+
+
+class BenchmarkConsole(b3.parser.Parser):
+    """
+    Console implementation exposing the real event dispatcher without
+    any game server, storage layer or configuration file.
+    """
+    gameName = 'benchmark'
+
+    def __init__(self, queuesize=50, workers=0):
+        """
+        Object constructor.
+        :param queuesize: The size of the event queue
+        :param workers: The number of workers per plugin (0 to dispatch events serially)
+        """
+        self._timeStart = self.time()
+        self.log = logging.getLogger('benchmark')
+        self.log.addHandler(logging.NullHandler())
+        self.log.setLevel(logging.WARNING)
+        self.log.propagate = False
+        self.Events = b3.events.eventManager
+        self._eventsStats = b3.events.EventsStats(self)
+        self._handlers = {}
+        self._plugins = OrderedDict()
+        self.queue = b3.events.EventQueue(self, queuesize)
+        self.exiting = thread.allocate_lock()
+        self.exitcode = None
+        self.working = True
+        if workers:
+            self._dispatcher = b3.dispatch.EventDispatcher(self, workers=workers, queuesize=queuesize)
+
+    def shutdown(self):
+        pass
+
+
+class BenchmarkPlugin(b3.plugin.Plugin):
+    """
+    Plugin handling EVT_CLIENT_SAY events with a configurable cost.
+    """
+    requiresConfigFile = False
+
+    def __init__(self, console, cost=0.0, recorder=None):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param cost: The amount of milliseconds spent blocking on each event
+        :param recorder: The DispatchRecorder collecting latencies (only for the last plugin in the chain)
+        """
+        b3.plugin.Plugin.__init__(self, console)
+        self._cost = cost / 1000.0
+        self._recorder = recorder
+        self.registerEvent('EVT_CLIENT_SAY', self.onSay)
+
+    def onSay(self, event):
+        """
+        Handle EVT_CLIENT_SAY.
+        """
+        if self._cost:
+            # simulate a blocking call (storage query, rcon command...)
+            time.sleep(self._cost)
+        if self._recorder:
+            self._recorder.record(event)
+
+
+class DispatchRecorder(object):
+    """
+    Collect the queue-to-handled latency of every dispatched event.
+    """
+    def __init__(self, expected):
+        """
+        Object constructor.
+        :param expected: The number of events we are expecting
+        """
+        self.expected = expected
+        self.latencies = []
+        self.last = None
+        self.ordered = True
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        """
+        Record the latency of the given event.
+        :param event: The event whose data is (sequence number, queue timestamp)
+        """
+        sequence, stamp = event.data
+        with self._lock:
+            self.latencies.append((time.perf_counter() - stamp) * 1000)
+            if self.last is not None and sequence != self.last + 1:
+                self.ordered = False
+            self.last = sequence
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+
+
+def benchmark_dispatch(events=10000, plugins=5, cost=0.0, queuesize=50, workers=0):
+    """
+    Push synthetic events through the real event dispatcher.
+    :param events: The number of events to dispatch
+    :param plugins: The number of plugins handling every event
+    :param cost: The amount of milliseconds each plugin spends blocking on each event
+    :param queuesize: The size of the event queue
+    :param workers: The number of workers per plugin (0 to dispatch events serially)
+    :return: A dict with the benchmark results
+    """
+    console = BenchmarkConsole(queuesize, workers)
+    recorder = DispatchRecorder(events)
+    for i in range(plugins):
+        plugin = BenchmarkPlugin(console, cost, recorder if i == plugins - 1 else None)
+        console._plugins['benchmark%s' % i] = plugin
+
+    thread.start_new_thread(console.handleEvents, ())
+
+    event_id = console.getEventID('EVT_CLIENT_SAY')
+    start = time.perf_counter()
+    for sequence in range(events):
+        console.queueEvent(b3.events.Event(event_id, (sequence, time.perf_counter())))
+    recorder.done.wait()
+    elapsed = time.perf_counter() - start
+
+    console.queueEvent(console.getEvent('EVT_STOP'))
+    if console._dispatcher:
+        stats = console._eventsStats._queue_depths
+        depth = max([max(x) for x in stats.values() if x] or [0])
+    else:
+        depth = console.queue.maxsize
+
+    latencies = sorted(recorder.latencies)
+    return {
+        'events': events,
+        'plugins': plugins,
+        'elapsed': elapsed,
+        'rate': events / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'ordered': recorder.ordered,
+        'workers': workers,
+        'depth': depth,
+    }
+
+
+########################################################################################################################
+#                                                                                                                      #
+#   LOG LINE PARSING                                                                                                   #
+#                                                                                                                      #
+########################################################################################################################
+
+LINE_PARSERS = {
+    'cod': 'b3.parsers.cod.CodParser',
+    'cod4': 'b3.parsers.cod4.Cod4Parser',
+    'q3': 'b3.parsers.q3.Q3Parser',
+}
+
+# synthetic log content used when no recorded game log is provided (kills and damage are the bulk of the traffic)
+SAMPLE_LINES = {
+    'cod': [
+        ' 12:01 D;1aaaaaaaaaaaaaaaaaaaaaaaaaaaaaab;3;axis;Player1;1cccccccccccccccccccccccccccccc;5;allies;Player2;'
+        'mp44_mp;35;MOD_RIFLE_BULLET;torso_upper',
+        ' 12:01 K;1aaaaaaaaaaaaaaaaaaaaaaaaaaaaaab;3;axis;Player1;1cccccccccccccccccccccccccccccc;5;allies;Player2;'
+        'mp44_mp;100;MOD_HEAD_SHOT;head',
+        ' 12:02 D;1aaaaaaaaaaaaaaaaaaaaaaaaaaaaaab;3;axis;Player1;;-1;world;;none;20;MOD_FALLING;none',
+        ' 12:03 say;1cccccccccccccccccccccccccccccc;5;Player2;nice shot',
+        ' 12:03 tell;1cccccccccccccccccccccccccccccc;5;Player2;1aaaaaaaaaaaaaaaaaaaaaaaaaaaaaab;3;Player1;gg',
+        ' 12:04 J;1dddddddddddddddddddddddddddddd;7;Player3',
+        ' 12:04 Q;1dddddddddddddddddddddddddddddd;7;Player3',
+        ' 12:05 Weapon;1aaaaaaaaaaaaaaaaaaaaaaaaaaaaaab;3;Player1;m1garand_mp',
+        ' 12:06 ExitLevel: executed',
+        ' 12:06 InitGame: \\g_gametype\\tdm\\mapname\\mp_carentan',
+    ],
+    'q3': [
+        '12:01 Kill: 2 4 11: Sarge killed ^6Jondah by MOD_LIGHTNING',
+        '12:01 Item: 2 weapon_plasmagun',
+        '12:02 Kill: 4 2 7: ^6Jondah killed Sarge by MOD_ROCKET_SPLASH',
+        '12:02 say: Sarge: nice shot',
+        '12:03 tell: Sarge to Jondah: gg',
+        '12:03 CTF: 1 2 2: Sarge returned the BLUE flag!',
+        '12:04 Award: 2 4: Sarge gained the CAPTURE award!',
+        '12:05 ClientConnect: 3',
+        '12:05 ClientUserinfoChanged: 3 n\\Player3\\t\\1\\model\\sarge\\hmodel\\sarge',
+        '12:06 ClientDisconnect: 3',
+    ],
+}
+SAMPLE_LINES['cod4'] = SAMPLE_LINES['cod']
+
+
+def getLineParser(name):
+    """
+    Return a parser instance suitable to parse log lines only (no configuration, storage or game server).
+    :param name: The parser name (cod, cod4, q3)
+    """
+    module_name, class_name = LINE_PARSERS[name].rsplit('.', 1)
+    cls = getattr(importlib.import_module(module_name), class_name)
+    parser = cls.__new__(cls)
+    parser.log = logging.getLogger('benchmark')
+    parser.log.addHandler(logging.NullHandler())
+    parser.log.setLevel(logging.WARNING)
+    parser.log.propagate = False
+    return parser
+
+
+def legacy_getLineParts(parser, line):
+    """
+    Match a log line the way getLineParts did before the line classifier: strip the timestamp
+    with re.sub and try every line format in order.
+    :return: The matching line format or None
+    """
+    line = re.sub(parser._lineClear, '', line, 1)
+    for f in parser._lineFormats:
+        if re.match(f, line):
+            return f
+    return None
+
+
+def benchmark_lines(name, lines, rounds=3):
+    """
+    Parse the given log lines with the legacy linear scan and with the line classifier.
+    :param name: The parser name (cod, cod4, q3)
+    :param lines: The log lines
+    :param rounds: How many times the lines are parsed (the best round is reported)
+    :return: A dict with the benchmark results
+    """
+    parser = getLineParser(name)
+    classifier = parser.getLineClassifier()
+    lines = [x.strip() for x in lines if x.strip()]
+
+    mismatches = 0
+    for line in lines:
+        if legacy_getLineParts(parser, line) is not classifier.match(line)[1]:
+            mismatches += 1
+
+    def best(func):
+        elapsed = None
+        for i in range(rounds):
+            start = time.perf_counter()
+            for line in lines:
+                func(line)
+            took = time.perf_counter() - start
+            elapsed = took if elapsed is None else min(elapsed, took)
+        return len(lines) / elapsed if elapsed else 0.0
+
+    return {
+        'parser': name,
+        'lines': len(lines),
+        'before': best(lambda line: legacy_getLineParts(parser, line)),
+        'after': best(parser.getLineParts),
+        'mismatches': mismatches,
+    }
+
+
+def benchmark_reader(name, path):
+    """
+    Scan a whole game log file with readlines (every line decoded and matched) and with the memory-mapped
+    bulk reader (only the lines accepted by the parser line filter decoded and matched).
+    :param name: The parser name (cod, cod4, q3)
+    :param path: The path of the game log file
+    :return: A dict with the benchmark results
+    """
+    parser = getLineParser(name)
+    parser.encoding = 'latin-1'
+
+    def matched(lines):
+        count = 0
+        for line in lines:
+            line = line.strip()
+            if line and parser.getLineParts(line):
+                count += 1
+        return count
+
+    start = time.perf_counter()
+    with open(path, 'r', encoding='latin-1') as f:
+        before = matched(f)
+    before_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with parser.getLogReader(path) as reader:
+        after = matched(reader)
+    after_elapsed = time.perf_counter() - start
+
+    return {
+        'parser': name,
+        'lines': reader.scanned,
+        'decoded': reader.decoded,
+        'before': before_elapsed,
+        'after': after_elapsed,
+        'mismatches': abs(before - after),
+    }
+
+
+def benchmark_clients(clients=64, records=1000):
+    """
+    Measure the memory used by connected clients (with a plugin variable, as most servers run plugins storing some)
+    and by client records built from storage rows, and the time needed to build a lookup result (5 rows).
+    :param clients: The number of connected clients to create
+    :param records: The number of client records to create
+    :return: A dict with the benchmark results
+    """
+    row = {'id': 1, 'ip': '10.0.0.1', 'connections': 12, 'guid': 'A' * 32, 'pbid': '', 'name': 'Player',
+           'auto_login': 1, 'mask_level': 0, 'group_bits': 2, 'greeting': '', 'login': '', 'password': '',
+           'time_add': 1400000000, 'time_edit': 1400000000}
+    fields = dict((re.sub(r'_(.)', lambda m: m.group(1).upper(), k), v) for k, v in row.items())
+    plugin = object()
+
+    def measure(factory, count):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [factory(i) for i in range(count)]
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del objects
+        return (after - before) / float(count)
+
+    def connected(i):
+        client = b3.clients.Client(cid=str(i), name='Player%s' % i, guid='%032X' % i, ip='10.0.0.%s' % (i % 250),
+                                   authed=True)
+        client.setvar(plugin, 'points', 0)
+        return client
+
+    def record(i):
+        return b3.clients.ClientRecord(None, **fields)
+
+    start = time.perf_counter()
+    for i in range(records):
+        [record(x) for x in range(5)]
+    lookup = (time.perf_counter() - start) / records
+
+    return {
+        'clients': clients,
+        'records': records,
+        'client': measure(connected, clients),
+        'record': measure(record, records),
+        'lookup': lookup * 1000,
+    }
+
+
+def main(args=None):
+    """
+    Run the benchmarks from the command line.
+    """
+    p = argparse.ArgumentParser(description='Benchmark B3 core components')
+    sub = p.add_subparsers(dest='benchmark')
+    d = sub.add_parser('dispatch', help='benchmark the event dispatcher (Parser.handleEvents)')
+    d.add_argument('-n', '--events', dest='events', type=int, default=10000, help='number of events to dispatch')
+    d.add_argument('-m', '--plugins', dest='plugins', type=int, default=5, help='number of plugins handling events')
+    d.add_argument('-w', '--cost', dest='cost', type=float, default=0.0,
+                   help='milliseconds each plugin spends blocking on each event')
+    d.add_argument('-q', '--queue', dest='queuesize', type=int, default=50, help='event queue size')
+    d.add_argument('-k', '--workers', dest='workers', type=int, default=0,
+                   help='number of dispatch workers per plugin (default: serial dispatch)')
+    l = sub.add_parser('lines', help='benchmark log line parsing (getLineParts)')
+    l.add_argument('logfile', nargs='?', default=None, help='recorded game log (default: synthetic log)')
+    l.add_argument('-p', '--parser', dest='parsers', action='append', choices=sorted(LINE_PARSERS),
+                   help='parser to benchmark (can be repeated, default: all)')
+    l.add_argument('-n', '--lines', dest='lines', type=int, default=100000,
+                   help='number of synthetic lines to generate when no log file is given')
+    r = sub.add_parser('reader', help='benchmark bulk log reading (memory-mapped reader and line filter)')
+    r.add_argument('logfile', help='recorded game log')
+    r.add_argument('-p', '--parser', dest='parsers', action='append', choices=sorted(LINE_PARSERS),
+                   help='parser to benchmark (can be repeated, default: all)')
+    c = sub.add_parser('clients', help='benchmark the memory used by client objects')
+    c.add_argument('-n', '--clients', dest='clients', type=int, default=64, help='number of connected clients')
+    c.add_argument('-r', '--records', dest='records', type=int, default=1000, help='number of client records')
+    options = p.parse_args(args)
+
+    if options.benchmark == 'dispatch':
+        r = benchmark_dispatch(options.events, options.plugins, options.cost, options.queuesize, options.workers)
+        print('dispatched %(events)s events to %(plugins)s plugins in %(elapsed)0.3f sec' % r)
+        if r['workers']:
+            print('  workers    : %(workers)s per plugin, max dispatch queue depth %(depth)s' % r)
+        print('  throughput : %(rate)0.1f events/sec' % r)
+        print('  latency    : p50 %(p50)0.3f ms, p99 %(p99)0.3f ms' % r)
+        print('  ordering   : %s' % ('OK' if r['ordered'] else 'BROKEN'))
+    elif options.benchmark == 'lines':
+        recorded = None
+        if options.logfile:
+            with open(options.logfile, 'r', errors='replace') as f:
+                recorded = f.readlines()
+        for name in options.parsers or sorted(LINE_PARSERS):
+            lines = recorded
+            if lines is None:
+                sample = SAMPLE_LINES[name]
+                lines = (sample * (options.lines // len(sample) + 1))[:options.lines]
+            r = benchmark_lines(name, lines)
+            print('%(parser)-5s %(lines)s lines: before %(before)0.0f lines/sec, after %(after)0.0f lines/sec '
+                  '(%(mismatches)s mismatches)' % r)
+    elif options.benchmark == 'reader':
+        for name in options.parsers or sorted(LINE_PARSERS):
+            r = benchmark_reader(name, options.logfile)
+            print('%(parser)-5s %(lines)s lines (%(decoded)s decoded): readlines %(before)0.3f sec, '
+                  'mmap %(after)0.3f sec (%(mismatches)s mismatches)' % r)
+    elif options.benchmark == 'clients':
+        r = benchmark_clients(options.clients, options.records)
+        print('connected client : %(client)0.0f bytes per client (%(clients)s clients, with a plugin variable)' % r)
+        print('client record    : %(record)0.0f bytes per record (%(records)s records)' % r)
+        print('lookup result    : %(lookup)0.3f ms to build 5 records' % r)
+    else:
+        p.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
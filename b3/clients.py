@@ -77,58 +77,78 @@ class ClientVar(object):
         return len(self.value)
 
 class Client(object):
+    """
+    A client (player) of the game server.
 
-    ## PVT
-    _autoLogin = 1
-    _data = None
-    _exactName = ''
-    _greeting = ''
-    _groupBits = 0
-    _groups = None
-    _guid = ''
-    _id = 0
-    _ip = ''
-    _lastVisit = None
-    _login = ''
-    _maskGroup = None
-    _maskLevel = 0
-    _maxGroup = None
-    _maxLevel = None
-    _name = ''
-    _password = ''
-    _pluginData = None
-    _pbid = ''
-    _team = b3.TEAM_UNKNOWN
-    _tempLevel = None
-    _timeAdd = 0
-    _timeEdit = 0
-
-    # PUB
-    authed = False
-    authorizing = False
-    bot = False
-    cid = None
-    connected = True
-    console = None
-    hide = False
-    state = None
+    Attributes are stored in slots: a connected client doesn't carry an attribute dict unless something sets an
+    attribute which is not declared below (plugins still can). The plugin variables and data dicts are only
+    created when first used.
+    """
+    __slots__ = ('_autoLogin', '_connections', '_data', '_exactName', '_greeting', '_groupBits', '_groupRegistry',
+                 '_groups', '_guid', '_id', '_ip', '_lastVisit', '_login', '_maskGroup', '_maskLevel', '_maxGroup',
+                 '_maxLevel', '_name', '_password', '_penaltySummary', '_pluginData', '_pbid', '_team', '_tempLevel',
+                 '_timeAdd', '_timeEdit', 'authed', 'authorizing', 'bot', 'cid', 'clients', 'connected', 'console',
+                 'hide', 'state', '__dict__', '__weakref__')
+
+    # default values of the slots which are left empty until assigned (see __getattr__)
+    _lazyDefaults = {
+        '_autoLogin': 1,
+        '_connections': 0,
+        '_greeting': '',
+        '_groupRegistry': None,
+        '_groups': None,
+        '_lastVisit': None,
+        '_login': '',
+        '_maskGroup': None,
+        '_maxGroup': None,
+        '_password': '',
+        '_penaltySummary': None,
+        '_pbid': '',
+        '_tempLevel': None,
+        '_timeAdd': 0,
+        '_timeEdit': 0,
+        'authorizing': False,
+        'clients': None,
+        'console': None,
+    }
 
     def __init__(self, **kwargs):
         """
         Object constructor.
         :param kwargs: A dict containing client object attributes.
         """
-        self._pluginData = {}
+        # slots read all the time: the others keep empty until assigned (see __getattr__)
+        self._data = None
+        self._exactName = ''
+        self._groupBits = 0
+        self._guid = ''
+        self._id = 0
+        self._ip = ''
+        self._maskLevel = 0
+        self._maxLevel = None
+        self._name = ''
+        self._pluginData = None
+        self._team = b3.TEAM_UNKNOWN
+        self.authed = False
+        self.bot = False
+        self.cid = None
+        self.connected = True
+        self.hide = False
         self.state = b3.STATE_UNKNOWN
-        self._data = {}        
 
-        # make sure to set console before anything else
-        if 'console' in kwargs:
-            self.console = kwargs['console']
-            
+        # make sure to set console before anything else (subclasses may have set it already)
+        self.console = kwargs['console'] if 'console' in kwargs else self.console
+
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    def __getattr__(self, name):
+        # only called for attributes which are not set: empty slots read their default value
+        try:
+            return self._lazyDefaults[name]
+        except KeyError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+
     ####################################################################################################################
     #                                                                                                                  #
     #   PLUGIN VARIABLES                                                                                               #
@@ -156,6 +176,9 @@ class Client(object):
         :param value: The value of this variable.
         :return The stored variable.
         """
+        if self._pluginData is None:
+            self._pluginData = {}
+
         try:
             self._pluginData[id(plugin)]
         except Exception:
@@ -224,9 +247,11 @@ class Client(object):
 
     def _set_data(self, data):
         for k, v in data.items():
-            self._data[k] = v
+            self.data[k] = v
 
     def _get_data(self):
+        if self._data is None:
+            self._data = {}
         return self._data
 
     data = property(_get_data, _set_data)
@@ -236,24 +261,19 @@ class Client(object):
     def _get_firstWarn(self):
         if not self.id:
             return None
-        return self.console.storage.getClientFirstPenalty(self, 'Warning')
+        return self.penaltySummary.firstWarning
 
     firstWarning = property(_get_firstWarn)
 
     # -----------------------
 
     def getGroups(self):
-        if not self._groups:
-            self._groups = []
-            groups = self.console.storage.getGroups()
-            guest_group = None
-            for g in groups:
-                if g.id == 0:
-                    guest_group = g
-                if g.id & self._groupBits:
-                    self._groups.append(g)
-            if not len(self._groups) and guest_group:
-                self._groups.append(guest_group)
+        registry = self.console.storage.getGroupRegistry()
+        if self._groups is None or self._groupRegistry is not registry:
+            # first access or the groups have been reloaded since: the cached level is stale too
+            self._groupRegistry = registry
+            self._groups = list(registry.getGroupsForBits(self._groupBits))
+            self._maxLevel = None
         return self._groups
 
     groups = property(getGroups)
@@ -280,7 +300,7 @@ class Client(object):
     def _get_lastBan(self):
         if not self.id:
             return None
-        return self.console.storage.getClientLastPenalty(self, ('Ban', 'TempBan'))
+        return self.penaltySummary.lastBan
 
     lastBan = property(_get_lastBan)
 
@@ -289,17 +309,18 @@ class Client(object):
     def _get_lastWarn(self):
         if not self.id:
             return None
-        return self.console.storage.getClientLastPenalty(self, 'Warning')
+        return self.penaltySummary.lastWarning
 
     lastWarning = property(_get_lastWarn)
 
     # -----------------------
 
     def _get_maxLevel(self):
+        groups = self.groups
         if self._maxLevel is None:
-            if self.groups and len(self.groups):
+            if groups:
                 m = -1
-                for g in self.groups:
+                for g in groups:
                     if g.level > m:
                         m = g.level
                         self._maxGroup = g
@@ -328,7 +349,7 @@ class Client(object):
     def _get_numBans(self):
         if not self.id:
             return 0
-        return self.console.storage.numPenalties(self, ('Ban', 'TempBan'))
+        return self.penaltySummary.numBans
 
     numBans = property(_get_numBans)
 
@@ -337,12 +358,21 @@ class Client(object):
     def _get_numWarns(self):
         if not self.id:
             return 0
-        return self.console.storage.numPenalties(self, 'Warning')
+        return self.penaltySummary.numWarnings
 
     numWarnings = property(_get_numWarns)
 
     # -----------------------
 
+    def _get_penaltySummary(self):
+        # the storage keeps the summary as long as a client object holds it
+        self._penaltySummary = self.console.storage.getClientPenaltySummary(self)
+        return self._penaltySummary
+
+    penaltySummary = property(_get_penaltySummary)
+
+    # -----------------------
+
     def _set_team(self, team):
         if self._team != team:
             previous_team = self.team
@@ -385,7 +415,6 @@ class Client(object):
 
     # -----------------------
 
-    _connections = 0
     def _set_connections(self, v):
         self._connections = int(v)
 
@@ -436,9 +465,12 @@ class Client(object):
                 self.authed = False
             elif not self._guid:
                 self._guid = guid
+                self._reindex()
         else:
             self.authed = False
-            self._guid = ''
+            if self._guid:
+                self._guid = ''
+                self._reindex()
 
     def _get_guid(self):
         return self._guid
@@ -465,7 +497,8 @@ class Client(object):
             ip = ip[0:ip.find(':')]
         if self._ip != ip:
             self.makeIpAlias(self._ip)
-        self._ip = ip
+            self._ip = ip
+            self._reindex()
 
     def _get_ip(self):
         return self._ip
@@ -554,6 +587,7 @@ class Client(object):
         self.makeAlias(self._name)
         self._name = newName
         self._exactName = name + '^7'
+        self._reindex()
 
         if self.console and self.authed:
             self.console.queueEvent(self.console.getEvent('EVT_CLIENT_NAME_CHANGE', self.name, self))
@@ -620,6 +654,14 @@ class Client(object):
         self._maxLevel = None
         self._groups = None
 
+    def _reindex(self):
+        """
+        Update the clients registry indexes after a change of name, guid or ip.
+        """
+        clients = getattr(self.console, 'clients', None)
+        if isinstance(clients, Clients):
+            clients.reindex(self)
+
     def disconnect(self):
         """
         Disconnect the client.
@@ -918,6 +960,29 @@ class Client(object):
         return "Client<@%s:%s|%s:\"%s\":%s>" % (self.id, self.guid, self.pbid, self.name, self.cid)
 
 
+class ClientRecord(Client):
+    """
+    A client loaded from the storage (lookups by name or by database id) which is not connected to the game server.
+    Records are built straight from database rows: the console is attached once all the fields are loaded, so that
+    loading a row neither creates aliases nor touches the connected clients indexes. Everything else (groups,
+    aliases, penalties) is only fetched from the storage when accessed.
+    """
+    __slots__ = ()
+
+    def __init__(self, console=None, **kwargs):
+        """
+        Object constructor.
+        :param console: The console implementation
+        :param kwargs: The client fields (see Storage.getVar for the database columns names mapping)
+        """
+        Client.__init__(self, **kwargs)
+        self.connected = False
+        self.console = console
+
+    def __str__(self):
+        return "ClientRecord<@%s:%s|%s:\"%s\">" % (self.id, self.guid, self.pbid, self.name)
+
+
 class Struct(object):
     """
     Base class for Penalty/Alias/IpAlias/Group classes.
@@ -1065,6 +1130,122 @@ class ClientKick(Penalty):
     type = 'Kick'
 
 
+class PenaltySummary(object):
+    """
+    The active bans and warnings of a client, loaded once from the storage and then kept up to date in memory
+    when penalties are saved or disabled (see Storage.getClientPenaltySummary). Penalties expire while the summary
+    lives: expiration is checked every time a value is read.
+    """
+    TYPES = ('Ban', 'TempBan', 'Warning')
+    BANS = ('Ban', 'TempBan')
+    WARNINGS = ('Warning',)
+
+    def __init__(self, clientId, penalties=None, stamp=None):
+        """
+        Object constructor.
+        :param clientId: The client database id
+        :param penalties: The active penalties of the client
+        :param stamp: The version stamp of the client penalties in the storage when they were loaded
+        """
+        self.clientId = clientId
+        self.stamp = stamp
+        self.checked = time.time()
+        self._penalties = {}
+        self._lock = threading.Lock()
+        for penalty in penalties or ():
+            self._penalties[penalty.id] = penalty
+
+    def getActive(self, types):
+        """
+        Return the active penalties of the given types, most recent first.
+        :param types: The penalty types
+        """
+        now = int(time.time())
+        with self._lock:
+            penalties = [p for p in self._penalties.values()
+                         if p.type in types and (p.timeExpire == -1 or p.timeExpire > now)]
+        penalties.sort(key=lambda p: (p.timeAdd, p.id), reverse=True)
+        return penalties
+
+    def update(self, penalty):
+        """
+        Apply a penalty saved in the storage.
+        :param penalty: The saved penalty
+        """
+        if penalty.type not in self.TYPES:
+            return
+        with self._lock:
+            if penalty.inactive:
+                self._penalties.pop(penalty.id, None)
+            else:
+                self._penalties[penalty.id] = penalty
+
+    def disable(self, types):
+        """
+        Drop the penalties of the given types (they have been disabled in the storage).
+        :param types: The penalty types
+        """
+        if isinstance(types, str):
+            types = (types,)
+        with self._lock:
+            for penalty_id, penalty in list(self._penalties.items()):
+                if penalty.type in types:
+                    del self._penalties[penalty_id]
+
+    def isActive(self, penaltyId):
+        """
+        Tell whether the given penalty is one of the active penalties of the summary.
+        :param penaltyId: The penalty id
+        """
+        with self._lock:
+            return penaltyId in self._penalties
+
+    def advance(self, added=0, lastId=0, lastEdit=0, disabled=0):
+        """
+        Move the version stamp forward by a change made by this process, so that only the changes made by other
+        processes trigger a reload of the summary (see Storage.getClientPenaltyStamp).
+        :param added: The amount of penalties added
+        :param lastId: The id of the penalty added
+        :param lastEdit: The edit time of the change
+        :param disabled: The amount of penalties disabled
+        """
+        with self._lock:
+            if self.stamp is not None:
+                total, last_id, last_edit, inactive = self.stamp
+                self.stamp = (total + added, max(last_id, int(lastId)), max(last_edit, int(lastEdit)),
+                              inactive + disabled)
+
+    def _get_numBans(self):
+        return len(self.getActive(self.BANS))
+
+    numBans = property(_get_numBans)
+
+    def _get_lastBan(self):
+        bans = self.getActive(self.BANS)
+        return bans[0] if bans else None
+
+    lastBan = property(_get_lastBan)
+
+    def _get_numWarnings(self):
+        return len(self.getActive(self.WARNINGS))
+
+    numWarnings = property(_get_numWarnings)
+
+    def _get_lastWarning(self):
+        warnings = self.getActive(self.WARNINGS)
+        return warnings[0] if warnings else None
+
+    lastWarning = property(_get_lastWarning)
+
+    def _get_firstWarning(self):
+        # the one expiring last, the oldest first (permanent warnings last, like the storage query does)
+        warnings = self.getActive(self.WARNINGS)
+        warnings.sort(key=lambda p: (-p.timeExpire, p.timeAdd))
+        return warnings[0] if warnings else None
+
+    firstWarning = property(_get_firstWarning)
+
+
 class Alias(Struct):
     """
     Represent an Alias.
@@ -1257,12 +1438,228 @@ class Group(Struct):
         return "Group(%r)" % self.__dict__
 
 
+class GroupRegistry(object):
+    """
+    The client groups loaded from the storage, with lookup tables by keyword, level, id and group bits.
+    A registry is never modified once built: the storage replaces it with a new one when the groups change
+    (see Storage.refreshGroups), so that clients can tell their cached groups are stale by comparing registries.
+    """
+    def __init__(self, groups, maxcache=1024):
+        """
+        Object constructor.
+        :param groups: The client groups
+        :param maxcache: The maximum number of group bits combinations to cache
+        """
+        self.groups = tuple(sorted(groups, key=lambda g: g.level))
+        self.guest = None
+        self._byId = {}
+        self._byKeyword = {}
+        self._byLevel = {}
+        self._byBits = {}
+        self._maxcache = maxcache
+        for group in self.groups:
+            # same as the former SELECT ... LIMIT 1: the first group loaded wins
+            self._byId.setdefault(group.id, group)
+            self._byKeyword.setdefault(group.keyword, group)
+            self._byLevel.setdefault(group.level, group)
+            if group.id == 0 and self.guest is None:
+                self.guest = group
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def getById(self, groupId):
+        """
+        Return the group with the given id (group bit).
+        :param groupId: The group id
+        :raise KeyError: If there is no such group
+        """
+        try:
+            return self._byId[int(groupId)]
+        except (KeyError, TypeError, ValueError):
+            raise KeyError('no group matching id: %s' % groupId)
+
+    def getByKeyword(self, keyword):
+        """
+        Return the group with the given keyword.
+        :param keyword: The group keyword
+        :raise KeyError: If there is no such group
+        """
+        try:
+            return self._byKeyword[keyword]
+        except KeyError:
+            raise KeyError('no group matching keyword: %s' % keyword)
+
+    def getByLevel(self, level):
+        """
+        Return the group with the given level.
+        :param level: The group level
+        :raise KeyError: If there is no such group
+        """
+        try:
+            return self._byLevel[int(level)]
+        except (KeyError, TypeError, ValueError):
+            raise KeyError('no group matching level: %s' % level)
+
+    def getGroupsForBits(self, bits):
+        """
+        Return the groups of a client given its group bits, lowest level first.
+        Clients belonging to no group are part of the guest group (id 0).
+        :param bits: The client group bits
+        """
+        try:
+            return self._byBits[bits]
+        except KeyError:
+            pass
+
+        groups = tuple(g for g in self.groups if g.id & bits)
+        if not groups and self.guest is not None:
+            groups = (self.guest,)
+        if len(self._byBits) < self._maxcache:
+            self._byBits[bits] = groups
+        return groups
+
+
+class NameIndex(object):
+    """
+    Index player names for substring, prefix and fuzzy searches.
+
+    Names are normalized (color codes and whitespaces removed, lowercase) and every trigram of a normalized name
+    points to the slot numbers having it. A substring query only checks the names holding all of its trigrams,
+    starting from the rarest one. Fuzzy queries only compute the levenshtein distance to the names sharing at
+    least a trigram with the query. Queries shorter than a trigram check every name (no regex is involved).
+    """
+    _reStrip = re.compile(r'\^[0-9]|\s')
+
+    MATCH_EXACT = 0
+    MATCH_PREFIX = 1
+    MATCH_SUBSTRING = 2
+    MATCH_FUZZY = 3
+
+    def __init__(self):
+        """
+        Object constructor.
+        """
+        self.names = {}
+        self.trigrams = {}
+
+    @classmethod
+    def normalize(cls, name):
+        """
+        Return the normalized form of the given name.
+        :param name: The name to normalize
+        """
+        return cls._reStrip.sub('', name or '').lower()
+
+    @staticmethod
+    def getTrigrams(name):
+        """
+        Return the set of trigrams of the given normalized name.
+        :param name: The normalized name
+        """
+        return set(name[i:i + 3] for i in range(len(name) - 2))
+
+    def add(self, cid, name):
+        """
+        Index a name.
+        :param cid: The client slot number
+        :param name: The client name
+        """
+        self.remove(cid)
+        name = self.normalize(name)
+        if not name:
+            return
+        self.names[cid] = name
+        for trigram in self.getTrigrams(name):
+            self.trigrams.setdefault(trigram, set()).add(cid)
+
+    def remove(self, cid):
+        """
+        Remove a name from the index.
+        :param cid: The client slot number
+        """
+        name = self.names.pop(cid, None)
+        if name is None:
+            return
+        for trigram in self.getTrigrams(name):
+            cids = self.trigrams.get(trigram)
+            if cids is not None:
+                cids.discard(cid)
+                if not cids:
+                    del self.trigrams[trigram]
+
+    def search(self, query, fuzzy=False, maxdistance=None):
+        """
+        Search the names matching the given query.
+        :param query: The text to search
+        :param fuzzy: Whether to also return the names within maxdistance of the query (when nothing contains it)
+        :param maxdistance: The maximum levenshtein distance of fuzzy matches (default: a third of the query length)
+        :return: A list of tuples (match quality, slot number) sorted from the best match
+        """
+        query = self.normalize(query)
+        if not query:
+            return []
+
+        trigrams = self.getTrigrams(query)
+        if trigrams:
+            candidates = None
+            for trigram in sorted(trigrams, key=lambda x: len(self.trigrams.get(x, ()))):
+                cids = self.trigrams.get(trigram)
+                if not cids:
+                    candidates = set()
+                    break
+                candidates = set(cids) if candidates is None else candidates & cids
+                if not candidates:
+                    break
+        else:
+            candidates = self.names
+
+        results = []
+        for cid in candidates:
+            name = self.names[cid]
+            if name == query:
+                results.append(((self.MATCH_EXACT, len(name)), cid))
+            elif name.startswith(query):
+                results.append(((self.MATCH_PREFIX, len(name)), cid))
+            elif query in name:
+                results.append(((self.MATCH_SUBSTRING, len(name)), cid))
+
+        if not results and fuzzy and trigrams:
+            if maxdistance is None:
+                maxdistance = max(1, len(query) // 3)
+            candidates = set()
+            for trigram in trigrams:
+                candidates.update(self.trigrams.get(trigram, ()))
+            for cid in candidates:
+                name = self.names[cid]
+                if abs(len(name) - len(query)) > maxdistance:
+                    continue
+                distance = b3.functions.levenshteinDistance(query, name)
+                if distance <= maxdistance:
+                    results.append(((self.MATCH_FUZZY + distance, len(name)), cid))
+
+        results.sort(key=lambda x: x[0])
+        return [(quality[0], cid) for quality, cid in results]
+
+
 class Clients(dict):
+    """
+    The connected clients, by slot number.
 
+    The clients are also indexed by lowercase name, lowercase exact name, guid and ip. The indexes map each key
+    to a tuple of slot numbers (in connection order) and are kept up to date as clients connect, disconnect and
+    change name, guid or ip, so that lookups never have to scan the whole list. Index tuples are replaced, never
+    modified, so lookups don't need to lock. Names are also indexed in a NameIndex for partial name searches.
+    """
     _authorizing = False
     _exactNameIndex = None
     _guidIndex = None
+    _ipIndex = None
     _nameIndex = None
+    _indexKeys = None
 
     console = None
 
@@ -1276,7 +1673,11 @@ class Clients(dict):
         self.console = console
         self._exactNameIndex = {}
         self._guidIndex = {}
+        self._ipIndex = {}
         self._nameIndex = {}
+        self._indexKeys = {}
+        self._indexLock = threading.RLock()
+        self._names = NameIndex()
 
         # Python 2/3 compatibility for unichr
         try:
@@ -1293,6 +1694,151 @@ class Clients(dict):
         self.escape_table[ord('"')] = u'\\"'
         self.escape_table[ord("'")] = u"\\'"
 
+    ####################################################################################################################
+    #                                                                                                                  #
+    #   INDEXES                                                                                                        #
+    #                                                                                                                  #
+    ####################################################################################################################
+
+    def __setitem__(self, cid, client):
+        with self._indexLock:
+            self._unindex(cid)
+            super(Clients, self).__setitem__(cid, client)
+            self._index(cid, client)
+
+    def __delitem__(self, cid):
+        with self._indexLock:
+            super(Clients, self).__delitem__(cid)
+            self._unindex(cid)
+
+    def pop(self, cid, *args):
+        with self._indexLock:
+            client = super(Clients, self).pop(cid, *args)
+            self._unindex(cid)
+            return client
+
+    @staticmethod
+    def _getIndexKeys(client):
+        """
+        Return the keys the given client must be indexed with, as a tuple (name, exact name, guid, ip).
+        """
+        return (client.name.lower() if client.name else None,
+                client.exactName.lower() if client.exactName else None,
+                client.guid or None,
+                client.ip or None)
+
+    def _getIndexes(self):
+        return self._nameIndex, self._exactNameIndex, self._guidIndex, self._ipIndex
+
+    def _index(self, cid, client):
+        """
+        Add a client to the indexes.
+        """
+        if client is None:
+            return
+        keys = self._getIndexKeys(client)
+        for index, key in zip(self._getIndexes(), keys):
+            if key is not None:
+                index[key] = index.get(key, ()) + (cid,)
+        self._indexKeys[cid] = keys
+        self._names.add(cid, client.name)
+
+    def _unindex(self, cid):
+        """
+        Remove a client from the indexes.
+        """
+        keys = self._indexKeys.pop(cid, None)
+        if keys is None:
+            return
+        self._names.remove(cid)
+        for index, key in zip(self._getIndexes(), keys):
+            if key is not None:
+                cids = tuple(x for x in index.get(key, ()) if x != cid)
+                if cids:
+                    index[key] = cids
+                else:
+                    index.pop(key, None)
+
+    def reindex(self, client):
+        """
+        Update the indexes after the given client changed name, guid or ip.
+        :param client: The client whose attributes changed
+        """
+        with self._indexLock:
+            cid = client.cid
+            if self.get(cid) is not client or self._indexKeys.get(cid) == self._getIndexKeys(client):
+                return
+            self._unindex(cid)
+            self._index(cid, client)
+
+    def resetIndex(self):
+        """
+        Rebuild the indexes from the clients list.
+        """
+        with self._indexLock:
+            self._nameIndex = {}
+            self._guidIndex = {}
+            self._exactNameIndex = {}
+            self._ipIndex = {}
+            self._indexKeys = {}
+            self._names = NameIndex()
+            for cid, client in list(self.items()):
+                self._index(cid, client)
+
+    def checkIndex(self):
+        """
+        Check the indexes against the clients list.
+        :return: A list of inconsistencies (empty if the indexes are correct)
+        """
+        errors = []
+        with self._indexLock:
+            expected = [{}, {}, {}, {}]
+            for cid, client in list(self.items()):
+                if client is None:
+                    continue
+                keys = self._getIndexKeys(client)
+                if self._indexKeys.get(cid) != keys:
+                    errors.append('client %s indexed with %r instead of %r' % (cid, self._indexKeys.get(cid), keys))
+                for index, key in zip(expected, keys):
+                    if key is not None:
+                        index.setdefault(key, set()).add(cid)
+            for cid in self._indexKeys:
+                if cid not in self:
+                    errors.append('client %s is indexed but not connected' % cid)
+            for name, index, wanted in zip(('name', 'exact name', 'guid', 'ip'), self._getIndexes(), expected):
+                for key in set(index) | set(wanted):
+                    cids = index.get(key, ())
+                    if len(set(cids)) != len(cids):
+                        errors.append('%s index %r has duplicate entries: %r' % (name, key, cids))
+                    if set(cids) != wanted.get(key, set()):
+                        errors.append('%s index %r is %r instead of %r' % (name, key, sorted(cids),
+                                                                           sorted(wanted.get(key, ()))))
+            names = NameIndex()
+            for cid, client in list(self.items()):
+                if client is not None:
+                    names.add(cid, client.name)
+            if names.names != self._names.names:
+                errors.append('name search index names are %r instead of %r' % (self._names.names, names.names))
+            if names.trigrams != self._names.trigrams:
+                errors.append('name search index trigrams differ from the clients names')
+        return errors
+
+    def _getIndexed(self, index, key):
+        """
+        Return the first connected client indexed with the given key, or None.
+        """
+        for cid in index.get(key, ()):
+            client = self.get(cid)
+            if client is not None:
+                return client
+        return None
+
+    ####################################################################################################################
+    #                                                                                                                  #
+    #   LOOKUPS                                                                                                        #
+    #                                                                                                                  #
+    ####################################################################################################################
+
     def find(self, handle, maxres=None):
         """
         Search a client.
@@ -1312,34 +1858,14 @@ class Clients(dict):
         Search a client by matching his name.
         :param name: The name to use for the search
         """
-        name = name.lower()
-        try:
-            return self[self._nameIndex[name]]
-        except Exception:
-            for cid, c in self.items():
-                if c.name and c.name.lower() == name:
-                    # self.console.debug('found client by name %s = %s', name, c.name)
-                    self._nameIndex[name] = c.cid
-                    return c
-        return None
+        return self._getIndexed(self._nameIndex, name.lower())
 
     def getByExactName(self, name):
         """
         Search a client by matching his exact name.
         :param name: The name to use for the search
         """
-        name = name.lower() + '^7'
-        try:
-            c = self[self._exactNameIndex[name]]
-            # self.console.debug('found client by exact name in index %s = %s : %s', name, c.exactName, c.__class__.__name__)
-            return c
-        except Exception:
-            for cid, c in self.items():
-                if c.exactName and c.exactName.lower() == name:
-                    #self.console.debug('Found client by exact name %s = %s', name, c.exactName)
-                    self._exactNameIndex[name] = c.cid
-                    return c
-        return None
+        return self._getIndexed(self._exactNameIndex, name.lower() + '^7')
 
     def getList(self):
         """
@@ -1372,29 +1898,40 @@ class Clients(dict):
                 clist.append(c)
         return clist
 
-    def getClientsByName(self, name):
+    def searchByName(self, name, fuzzy=False, maxdistance=None):
         """
-        Return a list of clients matching the given name.
+        Return a list of tuples (match quality, client) for the clients matching the given name, best matches
+        first: exact matches, then names starting with the given one, then names containing it. Whitespaces and
+        color codes are ignored. Fuzzy matches (NameIndex.MATCH_FUZZY + levenshtein distance) are only returned
+        when no name contains the given one.
         :param name: The name to match
+        :param fuzzy: Whether to return names within maxdistance of the given one if no name contains it
+        :param maxdistance: The maximum levenshtein distance of fuzzy matches (default: a third of the name length)
         """
-        clist = []
-        needle = re.sub(r'\s', '', name.lower())
-        for cid,c in self.items():
-            cleanname = re.sub(r'\s', '', c.name.lower())
-            if not c.hide and needle in cleanname:
-                clist.append(c)
-        return clist
+        with self._indexLock:
+            matches = self._names.search(name, fuzzy, maxdistance)
+        results = []
+        for quality, cid in matches:
+            c = self.get(cid)
+            if c is not None and not c.hide:
+                results.append((quality, c))
+        return results
+
+    def getClientsByName(self, name, fuzzy=False):
+        """
+        Return a list of clients matching the given name, best matches first.
+        :param name: The name to match
+        :param fuzzy: Whether to return names close to the given one if no name contains it
+        """
+        return [c for quality, c in self.searchByName(name, fuzzy)]
 
     def getClientLikeName(self, name):
         """
         Return the client who has the given name in its name (match substring).
         :param name: The name to match
         """
-        name = name.lower()
-        for cid,c in self.items():
-            if not c.hide and string.find(c.name.lower(), name) != -1:
-                return c
-        return None
+        clist = self.getClientsByName(name)
+        return clist[0] if clist else None
 
     def getClientsByState(self, state):
         """
@@ -1414,7 +1951,7 @@ class Clients(dict):
         m = re.match(r'^@([0-9]+)$', client_id)
         if m:
             try:
-                sclient = self.console.storage.getClientsMatching({'id': m.group(1)})
+                sclient = self.console.storage.getClientsMatching({'id': m.group(1)}, console=self.console)
                 if not sclient:
                     return []
 
@@ -1462,19 +1999,25 @@ class Clients(dict):
     def getByGUID(self, guid):
         """
         Return the client matching the given GUID.
-        :param guid: The GUID to match        """
+        :param guid: The GUID to match
+        """
         guid = guid.upper()
-        try:
-            return self[self._guidIndex[guid]]
-        except Exception:
-            for cid,c in self.items():
-                if c.guid and c.guid == guid:
-                    self._guidIndex[guid] = c.cid
-                    return c
-                elif b3.functions.fuzzyGuidMatch(c.guid, guid):
-                    # found by fuzzy matching: don't index
+        client = self._getIndexed(self._guidIndex, guid)
+        if client is None:
+            for cid, c in list(self.items()):
+                if c and b3.functions.fuzzyGuidMatch(c.guid, guid):
+                    # found by fuzzy matching
                     return c
-        return None
+        return client
+
+    def getByIP(self, ip):
+        """
+        Return the list of clients connected from the given ip address.
+        :param ip: The ip address (a trailing :port is ignored)
+        """
+        if ':' in ip:
+            ip = ip[0:ip.find(':')]
+        return [c for c in (self.get(cid) for cid in self._ipIndex.get(ip, ())) if c is not None]
 
     def getByCID(self, cid):
         """
@@ -1527,7 +2070,7 @@ class Clients(dict):
 
         name = self.escape_string(name)
 
-        sclient = self.console.storage.getClientsMatching({'%name%': name})
+        sclient = self.console.storage.getClientsMatching({'%name%': name}, console=self.console)
 
         if not sclient:
             return []
@@ -1555,7 +2098,7 @@ class Clients(dict):
             self.console.error('Could not get superadmin group: %s', e)
             return False
 
-        sclient = self.console.storage.getClientsMatching({'&group_bits': group.id})
+        sclient = self.console.storage.getClientsMatching({'&group_bits': group.id}, console=self.console)
 
         if not sclient:
             return []
@@ -1584,16 +2127,6 @@ class Clients(dict):
             del self[cid]
             self.console.queueEvent(self.console.getEvent('EVT_CLIENT_DISCONNECT', data=cid, client=client))
 
-        self.resetIndex()
-
-    def resetIndex(self):
-        """
-        Reset the indexes.
-        """
-        self._nameIndex    = {}
-        self._guidIndex    = {}
-        self._exactNameIndex = {}
-
     def newClient(self, cid, **kwargs):
         """
         Create a new client.
@@ -1602,7 +2135,6 @@ class Clients(dict):
         """
         client = Client(console=self.console, cid=cid, timeAdd=self.console.time(), **kwargs)
         self[client.cid] = client
-        self.resetIndex()
         self.console.debug('Client connected: [%s] %s - %s (%s)', self[client.cid].cid,
                            self[client.cid].name, self[client.cid].guid, self[client.cid].data)
         self.console.queueEvent(self.console.getEvent('EVT_CLIENT_CONNECT', data=client, client=client))
@@ -1621,11 +2153,10 @@ class Clients(dict):
 
     def clear(self):
         """
-        Empty the clients list and reset the indexes.
+        Empty the clients list and the indexes.
         """
-        self.resetIndex()
-        for cid, c in self.items():
-            if not c.hide:
+        for cid, c in list(self.items()):
+            if not c or not c.hide:
                 del self[cid]
 
     def sync(self):
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.1'
+
+import threading
+import time
+
+from collections import OrderedDict
+
+# raw damage event key -> aggregated damage event key
+AGGREGATED_EVENTS = OrderedDict((
+    ('EVT_CLIENT_DAMAGE', 'EVT_CLIENT_DAMAGE_AGGREGATED'),
+    ('EVT_CLIENT_DAMAGE_TEAM', 'EVT_CLIENT_DAMAGE_TEAM_AGGREGATED'),
+    ('EVT_CLIENT_DAMAGE_SELF', 'EVT_CLIENT_DAMAGE_SELF_AGGREGATED'),
+))
+
+# events which cause pending aggregates concerning their target (the victim) to be queued right away
+FLUSH_TARGET_EVENTS = ('EVT_CLIENT_KILL', 'EVT_CLIENT_KILL_TEAM', 'EVT_CLIENT_SUICIDE',
+                       'EVT_CLIENT_GIB', 'EVT_CLIENT_GIB_TEAM', 'EVT_CLIENT_GIB_SELF')
+
+# events which cause all the pending aggregates to be queued right away
+FLUSH_ALL_EVENTS = ('EVT_GAME_ROUND_END', 'EVT_GAME_EXIT', 'EVT_GAME_MAP_CHANGE', 'EVT_EXIT', 'EVT_STOP')
+
+
+class DamageCoalescer(object):
+    """
+    Merge damage events sharing the same attacker, victim and weapon within a time window.
+
+    The coalescer sits between the parser and the event queue: every damage event is accounted in a pending
+    aggregate which is queued as a single *_AGGREGATED event once the window elapsed, carrying the following
+    data: (points, weapon, hits) where points is the sum of the damage points and hits the number of merged
+    damage events. Pending aggregates concerning a victim are queued before any kill event of that victim so
+    that plugins receive the damage totals before the kill.
+
+    Plugins opt in by registering the aggregated events: raw damage events are still queued for the plugins
+    which registered them, so nothing changes for them.
+    """
+    def __init__(self, console, window=0.5, maxpending=512):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param window: The amount of seconds damage events are merged for
+        :param maxpending: The maximum number of pending aggregates (the oldest is queued when exceeded)
+        """
+        self.console = console
+        self.window = window
+        self.maxpending = maxpending
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._aggregated = dict((console.getEventID(raw), console.getEventID(agg))
+                                for raw, agg in AGGREGATED_EVENTS.items())
+        self._flushTarget = set(console.getEventID(k) for k in FLUSH_TARGET_EVENTS)
+        self._flushAll = set(console.getEventID(k) for k in FLUSH_ALL_EVENTS)
+
+    def now(self):
+        """
+        Return the current time as a float (console.time() is rounded to the second, which would make every
+        window jitter by up to a second): the simulated time when replaying a game log.
+        """
+        clock = self.console.clock
+        return clock.time() if clock else time.time()
+
+    def timeout(self, delay):
+        """
+        Return how long the log reader may sleep before the oldest pending aggregate is due.
+        :param delay: The amount of seconds the log reader would sleep otherwise
+        """
+        with self._lock:
+            if not self._pending:
+                return delay
+            created = next(iter(self._pending.values()))[0]
+        return max(0.0, min(delay, created + self.window - self.now()))
+
+    def feed(self, event):
+        """
+        Account an event going to the event queue.
+        :param event: The event
+        :return: True if the event has been merged into an aggregate, False otherwise
+        """
+        if event.type in self._flushTarget:
+            self.flush(victim=event.target)
+            return False
+        elif event.type in self._flushAll:
+            self.flush(force=True)
+            return False
+
+        agg_type = self._aggregated.get(event.type)
+        if agg_type is None or agg_type not in self.console._handlers or not event.client or not event.target:
+            return False
+
+        try:
+            points = float(event.data[0])
+            weapon = event.data[1]
+        except (TypeError, ValueError, IndexError):
+            return False
+
+        overflow = None
+        key = (agg_type, event.client.cid, event.target.cid, weapon)
+        with self._lock:
+            try:
+                aggregate = self._pending[key]
+            except KeyError:
+                aggregate = self._pending[key] = [self.now(), agg_type, event.client, event.target,
+                                                  weapon, 0.0, 0]
+                if len(self._pending) > self.maxpending:
+                    overflow = [self._pending.popitem(last=False)[1]]
+            aggregate[5] += points
+            aggregate[6] += 1
+
+        if overflow:
+            self._queue(overflow)
+        return True
+
+    def flush(self, force=False, victim=None):
+        """
+        Queue the pending aggregates.
+        :param force: Queue all the pending aggregates, regardless of their window
+        :param victim: Queue all the pending aggregates concerning the given victim (a Client instance)
+        """
+        if not self._pending:
+            return
+
+        ready = []
+        with self._lock:
+            if force:
+                ready = list(self._pending.values())
+                self._pending.clear()
+            elif victim is not None:
+                for key, aggregate in list(self._pending.items()):
+                    if aggregate[3] is victim:
+                        ready.append(self._pending.pop(key))
+            else:
+                # aggregates are ordered by creation time: stop at the first one still within its window
+                deadline = self.now() - self.window
+                while self._pending:
+                    key, aggregate = next(iter(self._pending.items()))
+                    if aggregate[0] > deadline:
+                        break
+                    ready.append(self._pending.pop(key))
+
+        if ready:
+            self._queue(ready)
+
+    def _queue(self, aggregates):
+        """
+        Queue the given aggregates as aggregated damage events.
+        """
+        for created, agg_type, client, target, weapon, points, hits in aggregates:
+            self.console.queueEvent(self.console.getEvent(agg_type, (points, weapon, hits), client, target))
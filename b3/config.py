@@ -23,7 +23,7 @@
 # ################################################################### #
 
 __author__  = 'ThorN, Courgette, Fenix'
-__version__ = '1.7.9'
+__version__ = '1.8'
 
 import os
 import re
@@ -55,6 +55,10 @@ class B3ConfigParserMixin(object):
     """
     Mixin implementing ConfigParser methods more useful for B3 business.
     """
+    # the main configuration this configuration belongs to: @conf paths are resolved against its directory
+    # (several game servers with their own main configuration may live in the same process)
+    mainconfig = None
+
     def get(self, *args, **kwargs):
         """
         Return a configuration value as a string.
@@ -92,7 +96,7 @@ class B3ConfigParserMixin(object):
         :param section: The configuration file section.
         :param setting: The configuration file setting.
         """
-        return b3.getAbsolutePath(self.get(section, setting), decode=True)
+        return b3.getAbsolutePath(self.get(section, setting), decode=True, conf=self.mainconfig)
 
     def getTextTemplate(self, section, setting=None, **kwargs):
         """
@@ -411,10 +415,12 @@ class CfgConfigParser(B3ConfigParserMixin, ConfigParser.ConfigParser):
             else:
                 fp.write("%s: \n" % key)
 
-def load(filename):
+def load(filename, mainconfig=None):
     """
     Load a configuration file.
     Will instantiate the correct configuration object parser.
+    :param filename: The configuration file path
+    :param mainconfig: The main configuration the file belongs to (resolves @conf paths)
     """
     if os.path.splitext(filename)[1].lower() == '.xml':
         config = XmlConfigParser()
@@ -422,7 +428,8 @@ def load(filename):
         # allow the use of empty keys to support the new b3.ini configuration file
         config = CfgConfigParser(allow_no_value=True)
 
-    filename = b3.getAbsolutePath(filename, True)
+    filename = b3.getAbsolutePath(filename, True, conf=mainconfig)
+    config.mainconfig = mainconfig
 
     # return the config if it can be loaded
     return config if config.load(filename) else None
@@ -435,6 +442,8 @@ class MainConfig(B3ConfigParserMixin):
     """
     def __init__(self, config_parser):
         self._config_parser = config_parser
+        self._config_parser.mainconfig = self
+        self.mainconfig = self
         self._plugins = []
         if isinstance(self._config_parser, XmlConfigParser):
             self._init_plugins_from_xml()
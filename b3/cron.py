@@ -23,7 +23,7 @@
 # ################################################################### #
 #
 __author__ = 'ThorN, Courgette'
-__version__ = '1.5'
+__version__ = '1.7'
 
 import re
 try:
@@ -317,15 +317,24 @@ class Cron(object):
 
     def start(self):
         """
-        Start the cron scheduler in a separate thread.
+        Start the cron scheduler in a separate thread (or on the asyncio runtime event loop if enabled).
+        When replaying a game log the cron tabs are executed by the virtual clock instead.
         """
-        thread.start_new_thread(self.run, ())
+        runtime = getattr(self.console, '_runtime', None)
+        if getattr(self.console, 'clock', None):
+            self.console.info("Cron scheduler driven by the replay clock")
+        elif runtime:
+            runtime.startCron(self)
+        else:
+            thread.start_new_thread(self.run, ())
 
-    @staticmethod
-    def time():
+    def time(self):
         """
-        Return the current timestamp.
+        Return the current timestamp (the simulated time when replaying a game log).
         """
+        clock = getattr(self.console, 'clock', None)
+        if clock:
+            return clock.time()
         return time.time()
 
     def stop(self):
@@ -351,27 +360,39 @@ class Cron(object):
             if abs(self.time() - nexttime) > 120:
                 nexttime = self.getNextTime()
 
-            t = time.gmtime(nexttime)
-            for k, c in self._tabs.items():
-                if c.match(t):
-                    if 0 < c.maxRuns < c.numRuns + 1:
-                        # reached max executions, remove tab
-                        del self._tabs[k]
-                    else:
-                        c.numRuns += 1
-                        try:
-                            c.run()
-                        except Exception as msg:
-                            self.console.error('Exception raised while executing crontab %s: %s\n%s', c.command,
-                                               msg, traceback.extract_tb(sys.exc_info()[2]))
+            self.runTabs(nexttime)
             nexttime += 1
 
         self.console.info("Cron scheduler ended")
 
-    @staticmethod
-    def getNextTime():
+    def runTabs(self, nexttime):
+        """
+        Execute the crontabs matching the given timestamp.
+        :param nexttime: The timestamp to match crontabs against
+        """
+        t = time.gmtime(nexttime)
+        for k, c in list(self._tabs.items()):
+            if c.match(t):
+                if 0 < c.maxRuns < c.numRuns + 1:
+                    # reached max executions, remove tab
+                    del self._tabs[k]
+                else:
+                    c.numRuns += 1
+                    try:
+                        c.run()
+                    except Exception as msg:
+                        self.console.error('Exception raised while executing crontab %s: %s\n%s', c.command,
+                                           msg, traceback.extract_tb(sys.exc_info()[2]))
+
+    def isStopped(self):
+        """
+        Return True if the cron scheduler has been asked to stop.
+        """
+        return self._stopEvent.isSet()
+
+    def getNextTime(self):
         # store the time first, we don't want it to change on us
-        t = time.time()
+        t = self.time()
         # current time, minus it's 1 second remainder, plus 1 seconds
         # will round to the next nearest 1 seconds
         return (t - t % 1) + 1
\ No newline at end of file
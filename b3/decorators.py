@@ -23,7 +23,7 @@
 # ################################################################### #
 
 __author__ = 'Courgette, Fenix'
-__version__ = '1.3'
+__version__ = '1.4'
 
 import re
 import functools
@@ -123,10 +123,46 @@ class GameEventRouter(object):
     Note that the handler function must have parameters that matches the regular expression groups.
     The @ger.gameEvent decorator accepts multiple parameters if you need to have one handling function for
     multiple kind of game events. Note that those regular expressions should all define the same groups.
+
+    Regular expressions starting with a literal word (i.e: "^join: ...") are indexed by that word: getHandler only
+    tries the regular expressions which can match the leading word of the given game event, in declaration order.
     """
+    # literal word at the beginning of a regular expression (the last character is dropped if it has a quantifier)
+    _reLiteralPrefix = re.compile(r'^\^?(?P<prefix>[A-Za-z0-9_]+)(?P<next>.?)')
+    # leading word of a game event
+    _reWord = re.compile(r'\w*')
+    _maxcache = 1024
+
     def __init__(self):
         # will hold mapping between regular expressions and handler functions
         self._gameevents_mapping = list()
+        # will hold the literal prefix of each regular expression (None if the regular expression can't be indexed)
+        self._prefixes = list()
+        # leading word -> candidate (regex, func) list
+        self._index = dict()
+
+    def _getPrefix(self, regex):
+        """
+        Return the literal word every string matched by the given regular expression starts with.
+        :param regex: The compiled regular expression
+        :return: The prefix (lowercase if the regular expression is case insensitive) or None
+        """
+        if '|' in regex.pattern:
+            return None
+        m = self._reLiteralPrefix.match(regex.pattern)
+        if not m:
+            return None
+        prefix = m.group('prefix')
+        if m.group('next') and m.group('next') in '*?{':
+            prefix = prefix[:-1]
+        if not prefix:
+            return None
+        return prefix.lower() if regex.flags & re.IGNORECASE else prefix
+
+    def _addMapping(self, regex, func):
+        self._gameevents_mapping.append((regex, func))
+        self._prefixes.append(self._getPrefix(regex))
+        self._index.clear()
 
     def gameEvent(self, *decorator_param):
         """
@@ -136,9 +172,9 @@ class GameEventRouter(object):
         def wrapper(func):
             for param in decorator_param:
                 if isinstance(param, type(re.compile(''))):
-                    self._gameevents_mapping.append((param, func))
+                    self._addMapping(param, func)
                 elif isinstance(param, str):
-                    self._gameevents_mapping.append((re.compile(str(param)), func))
+                    self._addMapping(re.compile(str(param)), func)
             return func
         return wrapper
 
@@ -148,7 +184,19 @@ class GameEventRouter(object):
         For a given game event, return the corresponding handler
         function and a dict of the matched regular expression groups
         """
-        for regex, hfunc in self._gameevents_mapping:
+        word = self._reWord.match(gameEvent).group(0)
+        try:
+            candidates = self._index[word]
+        except KeyError:
+            lower = word.lower()
+            candidates = []
+            for (regex, hfunc), prefix in zip(self._gameevents_mapping, self._prefixes):
+                if prefix is None or (lower if regex.flags & re.IGNORECASE else word).startswith(prefix):
+                    candidates.append((regex, hfunc))
+            if len(self._index) < self._maxcache:
+                self._index[word] = candidates
+
+        for regex, hfunc in candidates:
             match = regex.match(gameEvent)
             if match:
                 return hfunc, match.groupdict()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.1'
+
+import sys
+import threading
+import time
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+import b3.events
+
+from traceback import extract_tb
+
+DISPATCH_SERIAL = 'serial'
+DISPATCH_WORKERS = 'workers'
+
+DISPATCH_MODES = (DISPATCH_SERIAL, DISPATCH_WORKERS)
+
+
+class DispatchWorker(object):
+    """
+    A thread consuming events for the plugins of a dispatch group.
+    Each worker processes its own queue in FIFO order.
+    """
+    def __init__(self, group, index, queuesize):
+        """
+        Object constructor.
+        :param group: The DispatchGroup this worker belongs to
+        :param index: The index of this worker inside the group
+        :param queuesize: The size of the worker queue
+        """
+        self.group = group
+        self.console = group.console
+        self.name = '%s:%s' % (group.name, index)
+        self.queue = Queue.Queue(queuesize)
+        self.thread = threading.Thread(target=self.run, name='b3-dispatch-%s' % self.name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, item):
+        """
+        Enqueue an event for this worker.
+        :param item: A tuple (expire, event, handler)
+        :return: True if the event has been queued, False otherwise
+        """
+        try:
+            self.queue.put(item, True, 2)
+        except Queue.Full:
+            self.console.error('**** Dispatch queue %s was full (%s)', self.name, self.queue.qsize())
+            return False
+        return True
+
+    def stop(self):
+        """
+        Ask the worker to terminate once it processed the events already queued.
+        """
+        try:
+            self.queue.put(None, True, 2)
+        except Queue.Full:
+            pass
+
+    def run(self):
+        """
+        Worker main loop.
+        """
+        while True:
+            item = self.queue.get(True)
+            if item is None:
+                break
+            expire, event, hfunc = item
+            self.group.dispatcher.callHandler(hfunc, event, expire)
+
+
+class DispatchGroup(object):
+    """
+    A set of workers sharing the same queue(s). Events are routed to the
+    worker matching their client so that per-client ordering is preserved.
+    """
+    def __init__(self, dispatcher, name, workers=1, queuesize=50):
+        """
+        Object constructor.
+        :param dispatcher: The EventDispatcher instance
+        :param name: The name of this group
+        :param workers: The number of workers in this group
+        :param queuesize: The size of each worker queue
+        """
+        self.dispatcher = dispatcher
+        self.console = dispatcher.console
+        self.name = name
+        self.workers = [DispatchWorker(self, i, queuesize) for i in range(max(1, workers))]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, timeout=5):
+        """
+        Stop all the workers of this group.
+        :param timeout: How many seconds to wait for each worker to terminate
+        """
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.thread.join(timeout)
+
+    def qsize(self):
+        """
+        Return the number of events waiting in this group.
+        """
+        return sum(w.queue.qsize() for w in self.workers)
+
+    def put(self, expire, event, hfunc):
+        """
+        Route an event to the worker handling its client.
+        :param expire: The event expire time
+        :param event: The event to dispatch
+        :param hfunc: The event handler (plugin) which will handle the event
+        """
+        if len(self.workers) == 1 or not event.client:
+            worker = self.workers[0]
+        else:
+            worker = self.workers[hash(event.client.cid) % len(self.workers)]
+        if worker.put((expire, event, hfunc)):
+            self.console._eventsStats.add_queue_depth(hfunc.__class__.__name__, worker.queue.qsize())
+
+
+class EventDispatcher(object):
+    """
+    Dispatch events to plugins using worker threads.
+
+    Plugins flagged as inline (Plugin.dispatchInline) are executed in the event handler thread, in the order
+    they registered for the event, so that a VetoEvent raised by them still stops the dispatch. Every other
+    plugin receives the event through the queue of its dispatch group: each group is consumed by one or more
+    workers and events concerning a given client are always handled by the same worker, in order.
+    """
+    def __init__(self, console, workers=1, queuesize=50, inline=None, groups=None):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param workers: The number of workers for each dispatch group
+        :param queuesize: The size of each worker queue
+        :param inline: A list of plugin names to be executed inline, in addition to the ones flagged by the plugin
+        :param groups: A dict mapping plugin names to dispatch group names
+        """
+        self.console = console
+        self._workers = workers
+        self._queuesize = queuesize
+        self._inline = set(inline or [])
+        self._groupnames = dict(groups or {})
+        self._groups = {}
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def _getPluginName(self, hfunc):
+        """
+        Return the name the given handler has been loaded with.
+        """
+        for name, plugin in list(self.console._plugins.items()):
+            if plugin is hfunc:
+                return name
+        return hfunc.__class__.__name__.lower()
+
+    def getRoute(self, hfunc):
+        """
+        Return the DispatchGroup for the given handler, or None if it must be executed inline.
+        :param hfunc: The event handler
+        """
+        try:
+            return self._routes[hfunc]
+        except KeyError:
+            pass
+
+        with self._lock:
+            name = self._getPluginName(hfunc)
+            if getattr(hfunc, 'dispatchInline', False) or name in self._inline:
+                self.console.debug('Dispatching events to plugin %s inline', name)
+                group = None
+            else:
+                groupname = self._groupnames.get(name) or getattr(hfunc, 'dispatchGroup', None) or name
+                group = self._groups.get(groupname)
+                if group is None:
+                    self.console.debug('Creating dispatch group %s (%s worker(s))', groupname, self._workers)
+                    group = self._groups[groupname] = DispatchGroup(self, groupname, self._workers, self._queuesize)
+                    group.start()
+                self.console.debug('Dispatching events to plugin %s using group %s', name, groupname)
+            self._routes[hfunc] = group
+            return group
+
+    def dispatch(self, event, expire):
+        """
+        Dispatch an event to all the handlers registered for it.
+        :param event: The event to dispatch
+        :param expire: The event expire time
+        """
+        for hfunc in self.console._handlers[event.type]:
+            if not hfunc.isEnabled():
+                continue
+
+            group = self.getRoute(hfunc)
+            if group is not None:
+                group.put(expire, event, hfunc)
+            elif not self.callHandler(hfunc, event):
+                # event vetoed by an inline plugin: stop here
+                break
+
+    def callHandler(self, hfunc, event, expire=None):
+        """
+        Make the given handler process an event.
+        :param hfunc: The event handler
+        :param event: The event to process
+        :param expire: The event expire time (only checked for events coming from worker queues)
+        :return: False if the handler vetoed the event, True otherwise
+        """
+        console = self.console
+        event_name = console.getEventName(event.type)
+        if expire is not None and console.time() >= expire:
+            console.error('**** Event sat in %s queue too long: %s %s', hfunc.__class__.__name__,
+                          event_name, console.time() - expire)
+            console._eventsStats.add_event_expired(event_name)
+            return True
+
+        console.verbose('Parsing event: %s: %s', event_name, hfunc.__class__.__name__)
+        timer_plugin_begin = time.perf_counter()
+        try:
+            hfunc.parseEvent(event)
+        except b3.events.VetoEvent:
+            if expire is not None:
+                console.warning('Event %s vetoed by %s: the plugin is not dispatched inline, '
+                                'the veto has no effect', event_name, str(hfunc))
+            else:
+                # plugin called for event hault, do not continue processing
+                console.bot('Event %s vetoed by %s', event_name, str(hfunc))
+                return False
+        except SystemExit as e:
+            console.exitcode = e.code
+        except Exception as msg:
+            console.error('Handler %s could not handle event %s: %s: %s %s', hfunc.__class__.__name__,
+                          event_name, msg.__class__.__name__, msg, extract_tb(sys.exc_info()[2]))
+        finally:
+            elapsed = time.perf_counter() - timer_plugin_begin
+            console._eventsStats.add_event_handled(hfunc.__class__.__name__, event_name, elapsed * 1000)
+        return True
+
+    def getQueueDepths(self):
+        """
+        Return a dict with the number of events waiting in each dispatch group.
+        """
+        return dict((name, group.qsize()) for name, group in list(self._groups.items()))
+
+    def stop(self, timeout=5):
+        """
+        Stop all the dispatch groups, letting them process the events already queued.
+        :param timeout: How many seconds to wait for each worker to terminate
+        """
+        for group in list(self._groups.values()):
+            group.stop(timeout)
@@ -23,10 +23,15 @@
 # ################################################################### #
 
 __author__ = 'ThorN, xlr8or, Courgette'
-__version__ = '1.8.2'
+__version__ = '1.12'
 
 import re
+import threading
 import time
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
 
 from b3.functions import meanstdv
 from b3.decorators import Memoize
@@ -70,6 +75,9 @@ class Events:
             ('EVT_CLIENT_DAMAGE', 'Client Damage'),
             ('EVT_CLIENT_DAMAGE_SELF', 'Client Damage Self'),
             ('EVT_CLIENT_DAMAGE_TEAM', 'Client Team Damage'),
+            ('EVT_CLIENT_DAMAGE_AGGREGATED', 'Client Damage Aggregated'),
+            ('EVT_CLIENT_DAMAGE_SELF_AGGREGATED', 'Client Damage Self Aggregated'),
+            ('EVT_CLIENT_DAMAGE_TEAM_AGGREGATED', 'Client Team Damage Aggregated'),
             ('EVT_CLIENT_JOIN', 'Client Join Team'),
             ('EVT_CLIENT_NAME_CHANGE', 'Client Name Change'),
             ('EVT_CLIENT_TEAM_CHANGE', 'Client Team Change'),     # provides only the new team
@@ -182,6 +190,204 @@ class Event(object):
         return "Event<%s>(%r, %s, %s)" % (eventManager.getKey(self.type), self.data, self.client, self.target)
 
 
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+PRIORITIES = {'high': PRIORITY_HIGH, 'normal': PRIORITY_NORMAL, 'low': PRIORITY_LOW}
+
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_COALESCE = 'coalesce'
+
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_COALESCE)
+
+# default priority of events (events not listed here have normal priority)
+DEFAULT_EVENT_PRIORITIES = {
+    'EVT_CLIENT_SAY': PRIORITY_HIGH,
+    'EVT_CLIENT_TEAM_SAY': PRIORITY_HIGH,
+    'EVT_CLIENT_SQUAD_SAY': PRIORITY_HIGH,
+    'EVT_CLIENT_PRIVATE_SAY': PRIORITY_HIGH,
+    'EVT_CLIENT_CONNECT': PRIORITY_HIGH,
+    'EVT_CLIENT_AUTH': PRIORITY_HIGH,
+    'EVT_CLIENT_DISCONNECT': PRIORITY_HIGH,
+    'EVT_CLIENT_DAMAGE': PRIORITY_LOW,
+    'EVT_CLIENT_DAMAGE_SELF': PRIORITY_LOW,
+    'EVT_CLIENT_DAMAGE_TEAM': PRIORITY_LOW,
+    'EVT_CLIENT_ITEM_PICKUP': PRIORITY_LOW,
+    'EVT_CLIENT_ACTION': PRIORITY_LOW,
+}
+
+# default policy applied to events when the queue is full (events not listed here use the block policy)
+DEFAULT_EVENT_POLICIES = {
+    'EVT_CLIENT_DAMAGE': POLICY_DROP_OLDEST,
+    'EVT_CLIENT_DAMAGE_SELF': POLICY_DROP_OLDEST,
+    'EVT_CLIENT_DAMAGE_TEAM': POLICY_DROP_OLDEST,
+    'EVT_CLIENT_ITEM_PICKUP': POLICY_DROP_OLDEST,
+    'EVT_CLIENT_ACTION': POLICY_DROP_OLDEST,
+    'EVT_CLIENT_UPDATE': POLICY_COALESCE,
+}
+
+
+class EventQueue(object):
+    """
+    Bounded FIFO queue holding (added, expire, event) tuples.
+
+    Events are always returned in the order they were queued, whatever their priority: plugins rely on events
+    of the same client being handled in log order (damage before the kill, kill before the disconnect).
+    Priority levels (high, normal, low) only decide which events make room when the queue is full, where the
+    policy of the incoming event type applies:
+
+        - coalesce: an event of the same type concerning the same client and target still waiting in the
+                    queue is replaced by the incoming one.
+        - drop-oldest: the oldest waiting event whose type can be dropped is discarded to make room.
+        - block: same as drop-oldest, but if nothing can be dropped the caller waits for a free slot.
+
+    A slot is only freed by dropping events of the same or lower priority than the incoming one, lowest
+    priority first.
+    Events which can be dropped (drop-oldest and coalesce) are discarded immediately if no slot can be freed.
+    """
+    def __init__(self, console, maxsize=50, priorities=None, policies=None):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param maxsize: The maximum number of events the queue can hold
+        :param priorities: A dict mapping event keys to priority levels (merged with DEFAULT_EVENT_PRIORITIES)
+        :param policies: A dict mapping event keys to queue full policies (merged with DEFAULT_EVENT_POLICIES)
+        """
+        self.console = console
+        self.maxsize = maxsize
+        self._priorities = dict(DEFAULT_EVENT_PRIORITIES)
+        self._priorities.update(priorities or {})
+        self._policies = dict(DEFAULT_EVENT_POLICIES)
+        self._policies.update(policies or {})
+        self._queue = deque()
+        self._size = 0
+        self._settings = {}
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        # optional callable invoked whenever an event is queued (used to wake up the asyncio runtime)
+        self.listener = None
+
+    def getSettings(self, event_type):
+        """
+        Return the priority level and the queue full policy of the given event type.
+        :param event_type: The event ID
+        """
+        try:
+            return self._settings[event_type]
+        except KeyError:
+            try:
+                key = eventManager.getKey(event_type)
+            except KeyError:
+                key = None
+            settings = self._settings[event_type] = (self._priorities.get(key, PRIORITY_NORMAL),
+                                                     self._policies.get(key, POLICY_BLOCK))
+            return settings
+
+    def qsize(self):
+        """
+        Return the number of events waiting in the queue.
+        """
+        return self._size
+
+    def _dropped(self, event):
+        self.console._eventsStats.add_event_dropped(self.console.getEventName(event.type))
+
+    def _coalesce(self, item):
+        """
+        Replace a waiting event matching the given one (same type, client and target).
+        The newest matching event is replaced so that the incoming one doesn't overtake the events
+        queued after an older match.
+        """
+        event = item[2]
+        queue = self._queue
+        for i in range(len(queue) - 1, -1, -1):
+            queued = queue[i][2]
+            if queued.type == event.type and queued.client is event.client and queued.target is event.target:
+                del queue[i]
+                queue.append(item)
+                self._dropped(queued)
+                return True
+        return False
+
+    def _dropOldest(self, level):
+        """
+        Drop the oldest waiting event which can be dropped, starting from the lowest priority level
+        up to the given one.
+        """
+        oldest = {}
+        for i, (added, expire, queued) in enumerate(self._queue):
+            priority, policy = self.getSettings(queued.type)
+            if priority >= level and policy != POLICY_BLOCK and priority not in oldest:
+                oldest[priority] = i
+        if not oldest:
+            return False
+        i = oldest[max(oldest)]
+        queued = self._queue[i][2]
+        del self._queue[i]
+        self._size -= 1
+        self._dropped(queued)
+        return True
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Put an event in the queue.
+        :param item: A tuple (added, expire, event)
+        :param block: Whether to wait for a free slot if the queue is full and nothing can be dropped
+        :param timeout: The maximum amount of seconds to wait for a free slot
+        :raise Queue.Full: If no slot was available in time for an event with the block policy
+        :return: True if the event has been queued, False if it has been dropped
+        """
+        event = item[2]
+        level, policy = self.getSettings(event.type)
+        with self._not_full:
+            if self._size >= self.maxsize:
+                if policy == POLICY_COALESCE and self._coalesce(item):
+                    # the replaced event was already signaled to the listener
+                    return True
+                if not self._dropOldest(level):
+                    if policy != POLICY_BLOCK:
+                        self._dropped(event)
+                        return False
+                    if not block:
+                        raise Queue.Full
+                    end = time.time() + timeout if timeout is not None else None
+                    while self._size >= self.maxsize:
+                        remaining = end - time.time() if end is not None else None
+                        if remaining is not None and remaining <= 0:
+                            raise Queue.Full
+                        self._not_full.wait(remaining)
+            self._queue.append(item)
+            self._size += 1
+            self._not_empty.notify()
+        if self.listener:
+            self.listener()
+        return True
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return the oldest event waiting in the queue.
+        :param block: Whether to wait for an event if the queue is empty
+        :param timeout: The maximum amount of seconds to wait
+        :raise Queue.Empty: If no event was available in time
+        """
+        with self._not_empty:
+            end = time.time() + timeout if timeout is not None else None
+            while not self._size:
+                if not block:
+                    raise Queue.Empty
+                remaining = end - time.time() if end is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise Queue.Empty
+                self._not_empty.wait(remaining)
+            item = self._queue.popleft()
+            self._size -= 1
+            self._not_full.notify()
+            return item
+
+
 class EventsStats(object):
 
     def __init__(self, console, max_samples=100):
@@ -194,6 +400,9 @@ class EventsStats(object):
         self._max_samples = max_samples
         self._handling_timers = {}
         self._queue_wait = deque(maxlen=max_samples)
+        self._queue_depths = {}
+        self._dropped = {}
+        self._expired = {}
         
     def add_event_handled(self, plugin_name, event_name, milliseconds_elapsed):
         """
@@ -209,6 +418,30 @@ class EventsStats(object):
         self._handling_timers[plugin_name][event_name].append(milliseconds_elapsed)
         self.console.verbose2("%s event handled by %s in %0.3f ms", event_name, plugin_name, milliseconds_elapsed)
 
+    def add_queue_depth(self, plugin_name, depth):
+        """
+        Add a sample of the dispatch queue depth of a plugin.
+        :param plugin_name: The name of the plugin
+        :param depth: The amount of events waiting in the plugin dispatch queue
+        """
+        if plugin_name not in self._queue_depths:
+            self._queue_depths[plugin_name] = deque(maxlen=self._max_samples)
+        self._queue_depths[plugin_name].append(depth)
+
+    def add_event_dropped(self, event_name):
+        """
+        Count an event dropped because the event queue was full.
+        :param event_name: The event name
+        """
+        self._dropped[event_name] = self._dropped.get(event_name, 0) + 1
+
+    def add_event_expired(self, event_name):
+        """
+        Count an event discarded because it sat in the queue past its expire time.
+        :param event_name: The event name
+        """
+        self._expired[event_name] = self._expired.get(event_name, 0) + 1
+
     def add_event_wait(self, milliseconds_wait):
         """
         Add delay to the event processing.
@@ -221,8 +454,8 @@ class EventsStats(object):
         Print event stats in the log file.
         """
         if self.console.log.isEnabledFor(VERBOSE):
-            for plugin_name, plugin_timers in self._handling_timers.items():
-                for event_name, event_timers in plugin_timers.items():
+            for plugin_name, plugin_timers in list(self._handling_timers.items()):
+                for event_name, event_timers in list(plugin_timers.items()):
                     mean, stdv = meanstdv(event_timers)
                     if len(event_timers):
                         self.console.verbose("%s %s : (ms) min(%0.1f), max(%0.1f), mean(%0.1f), "
@@ -234,6 +467,18 @@ class EventsStats(object):
             if len(self._queue_wait):
                 self.console.debug("Events waiting in queue stats : (ms) min(%0.1f), max(%0.1f), mean(%0.1f), "
                                    "stddev(%0.1f)", min(self._queue_wait), max(self._queue_wait), mean, stdv)
+
+            for event_name, count in sorted(self._dropped.items()):
+                self.console.debug("%s : %s event(s) dropped (queue full)", event_name, count)
+
+            for event_name, count in sorted(self._expired.items()):
+                self.console.debug("%s : %s event(s) expired in queue", event_name, count)
+
+            for plugin_name, depths in list(self._queue_depths.items()):
+                mean, stdv = meanstdv(depths)
+                if len(depths):
+                    self.console.debug("%s dispatch queue depth : min(%d), max(%d), mean(%0.1f), stddev(%0.1f)",
+                                       plugin_name, min(depths), max(depths), mean, stdv)
     
 
 class VetoEvent(Exception):
@@ -10,7 +10,7 @@
 # (at your option) any later version.
 
 __author__ = 'B3 Community'
-__version__ = '1.0.1'
+__version__ = '1.0.2'
 
 import b3
 import b3.plugin
@@ -213,8 +213,7 @@ class VpnblockerPlugin(b3.plugin.Plugin):
             return
             
         # Check IP in separate thread to avoid blocking
-        check_thread = threading.Thread(target=self._checkClientIP, args=(client,), daemon=True)
-        check_thread.start()
+        self.console.runInBackground(self._checkClientIP, client)
         
     def onAuth(self, event):
         """
@@ -483,8 +482,7 @@ class VpnblockerPlugin(b3.plugin.Plugin):
             except Exception as e:
                 client.message("^1Error checking %s: %s" % (target.name, e))
                 
-        check_thread = threading.Thread(target=check_and_report, daemon=True)
-        check_thread.start()
+        self.console.runInBackground(check_and_report)
         
     def cmd_vpnstatus(self, data, client, cmd=None):
         """
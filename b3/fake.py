@@ -38,7 +38,6 @@ import logging
 import re
 from io import StringIO
 import sys
-import time
 import traceback
 
 from b3.clients import Clients
@@ -124,7 +123,6 @@ class FakeConsole(b3.parser.Parser):
 
             try:
                 hfunc.parseEvent(event)
-                time.sleep(0.001)
             except b3.events.VetoEvent:
                 # plugin called for event hault, do not continue processing
                 self.bot('Event %s vetoed by %s', self.Events.getName(event.type), str(hfunc))
@@ -26,13 +26,10 @@
 
 """http://developer.valvesoftware.com/wiki/Server_Queries"""
 
-# TODO:  code cleanup
-
 # TODO:  according to spec, packets may be bzip2 compressed.
 # TODO:: not implemented yet because I couldn't find a server that does this.
 
-import socket, struct, sys, time
-import StringIO
+import select, socket, struct, threading, time
 
 PACKETSIZE=1400
 
@@ -48,7 +45,7 @@ SPLIT=-2
 
 # A2S_INFO
 A2S_INFO = ord('T')
-A2S_INFO_STRING = 'Source Engine Query'
+A2S_INFO_STRING = b'Source Engine Query'
 A2S_INFO_REPLY = ord('I')
 
 # A2S_PLAYER
@@ -63,49 +60,167 @@ A2S_RULES_REPLY = ord('E')
 CHALLENGE = -1
 S2C_CHALLENGE = ord('A')
 
-class SourceQueryPacket(StringIO.StringIO):
+# query kinds
+INFO = 'info'
+PLAYER = 'player'
+RULES = 'rules'
+
+REPLIES = {A2S_INFO_REPLY: INFO, A2S_PLAYER_REPLY: PLAYER, A2S_RULES_REPLY: RULES}
+
+# how many times a server may answer with a new challenge number before giving up
+MAX_CHALLENGES = 3
+
+_byte = struct.Struct('<B')
+_short = struct.Struct('<h')
+_long = struct.Struct('<l')
+_longlong = struct.Struct('<Q')
+_float = struct.Struct('<f')
+_split = struct.Struct('<lBBh')
+
+class SourceQueryPacket(object):
+    """A query packet. Values are read in place from the received datagram."""
+    def __init__(self, data=b''):
+        self.data = bytes(data)
+        self.view = memoryview(self.data)
+        self.pos = 0
+        self.out = bytearray()
+
+    def unpack(self, fmt):
+        val = fmt.unpack_from(self.data, self.pos)[0]
+        self.pos += fmt.size
+        return val
+
+    def read(self):
+        """Return the remaining data (a memoryview, no copy)."""
+        val = self.view[self.pos:]
+        self.pos = len(self.data)
+        return val
+
+    def getvalue(self):
+        return bytes(self.out)
+
     # putting and getting values
     def putByte(self, val):
-        self.write(struct.pack('<B', val))
+        self.out += _byte.pack(val)
 
     def getByte(self):
-        return struct.unpack('<B', self.read(1))[0]
+        return self.unpack(_byte)
 
     def putShort(self, val):
-        self.write(struct.pack('<h', val))
+        self.out += _short.pack(val)
 
     def getShort(self):
-        return struct.unpack('<h', self.read(2))[0]
+        return self.unpack(_short)
 
     def putLong(self, val):
-        self.write(struct.pack('<l', val))
+        self.out += _long.pack(val)
 
     def getLong(self):
-        return struct.unpack('<l', self.read(4))[0]
+        return self.unpack(_long)
 
     def getLongLong(self):
-        return struct.unpack('<Q', self.read(8))[0]
+        return self.unpack(_longlong)
 
     def putFloat(self, val):
-        self.write(struct.pack('<f', val))
+        self.out += _float.pack(val)
 
     def getFloat(self):
-        return struct.unpack('<f', self.read(4))[0]
+        return self.unpack(_float)
 
     def putString(self, val):
-        self.write(val + '\x00')
+        self.out += val + b'\x00'
 
     def getString(self):
-        val = self.getvalue()
-        start = self.tell()
-        end = val.index('\0', start)
-        val = val[start:end]
-        self.seek(end+1)
-        return val
+        end = self.data.index(b'\x00', self.pos)
+        val = self.data[self.pos:end]
+        self.pos = end + 1
+        if bytes is str:
+            return val
+        return val.decode('utf-8', 'replace')
 
 class SourceQueryError(Exception):
     pass
 
+class SourceQueryExchange(object):
+    """The queries in flight to one server. Should only be used internally."""
+    def __init__(self, query, kinds):
+        self.query = query
+        self.pending = set(kinds)
+        self.results = {}
+        self.splits = {}
+        self.challenges = 0
+        self.sent = 0
+
+    def requests(self):
+        """Return the request packets for the queries still waiting for a reply."""
+        self.sent = time.time()
+        return [self.query.request(kind) for kind in sorted(self.pending)]
+
+    def feed(self, data):
+        """Process a datagram received from the server.
+           Return the request packets to send again (the challenge changed)."""
+        packet = self.reassemble(data)
+        if packet is None:
+            # waiting for more split packets
+            return []
+
+        header = packet.getByte()
+        if header == S2C_CHALLENGE:
+            challenge = packet.getLong()
+            if challenge == self.query.challenge_number and (self.query.info_challenge or INFO not in self.pending):
+                # the other requests sent along got the same answer: they have been sent again already
+                return []
+            self.challenges += 1
+            if self.challenges > MAX_CHALLENGES:
+                raise SourceQueryError('Server keeps sending new challenges')
+            self.query.challenge_number = challenge
+            if INFO in self.pending:
+                # recent servers want a challenge for A2S_INFO too
+                self.query.info_challenge = True
+            return self.requests()
+
+        kind = REPLIES.get(header)
+        if kind in self.pending:
+            self.pending.discard(kind)
+            self.results[kind] = getattr(self.query, 'parse_' + kind)(packet)
+            if kind == INFO:
+                self.results[kind]['ping'] = time.time() - self.sent
+        return []
+
+    def reassemble(self, data):
+        """Return a packet from a datagram, or None if it is an incomplete split packet."""
+        packet = SourceQueryPacket(data)
+        typ = packet.getLong()
+
+        if typ == WHOLE:
+            return packet
+
+        elif typ == SPLIT:
+            # handle split packets
+            reqid, total, num, splitsize = _split.unpack_from(packet.data, packet.pos)
+            packet.pos += _split.size
+
+            result = self.splits.setdefault(reqid, [None] * total)
+            if num >= len(result):
+                raise SourceQueryError('Invalid split packet')
+            result[num] = packet.read()
+            if None in result:
+                return None
+
+            del self.splits[reqid]
+            data = bytearray()
+            for part in result:
+                data += part
+            packet = SourceQueryPacket(data)
+            if packet.getLong() == WHOLE:
+                return packet
+
+            else:
+                raise SourceQueryError('Invalid split packet')
+
+        else:
+            raise SourceQueryError("Received invalid packet type %d" % (typ,))
+
 class SourceQuery(object):
     """Example usage:
 
@@ -115,83 +230,102 @@ class SourceQuery(object):
        print(server.info())
        print(server.player())
        print(server.rules())
+       print(server.query(SourceQuery.INFO, SourceQuery.PLAYER, SourceQuery.RULES))
+
+       The challenge number is kept between queries, replies are cached
+       for ttl seconds and query() sends all its requests at once.
     """
 
-    def __init__(self, host, port=27015, timeout=1.0):
+    def __init__(self, host, port=27015, timeout=1.0, ttl=5.0):
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.ttl = ttl
         self.udp = False
+        self.challenge_number = CHALLENGE
+        self.info_challenge = False
+        self.cache = {}
+        self.lock = threading.RLock()
 
     def disconnect(self):
         if self.udp:
             self.udp.close()
             self.udp = False
 
-    def connect(self, challenge=False):
+    def connect(self):
         self.disconnect()
         self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.udp.settimeout(self.timeout)
         self.udp.connect((self.host, self.port))
 
-        if challenge:
-            return self.challenge()
-
-    def receive(self):
-        packet = SourceQueryPacket(self.udp.recv(PACKETSIZE))
-        typ = packet.getLong()
-
-        if typ == WHOLE:
-            return packet
-
-        elif typ == SPLIT:
-            # handle split packets
-            reqid = packet.getLong()
-            total = packet.getByte()
-            num = packet.getByte()
-            splitsize = packet.getShort()
-            result = [0 for x in range(total)]
-
-            result[num] = packet.read()
-
-            # fetch all remaining splits
-            while 0 in result:
-                packet = SourceQueryPacket(self.udp.recv(PACKETSIZE))
-
-                if packet.getLong() == SPLIT and packet.getLong() == reqid:
-                    total = packet.getByte()
-                    num = packet.getByte()
-                    splitsize = packet.getShort()
-                    result[num] = packet.read()
-
-                else:
-                    raise SourceQueryError('Invalid split packet')
-
-            packet = SourceQueryPacket("".join(result))
-
-            if packet.getLong() == WHOLE:
-                return packet
-
-            else:
-                raise SourceQueryError('Invalid split packet')
-
-        else:
-            raise SourceQueryError("Received invalid packet type %d" % (typ,))
-
-    def challenge(self):
-        # use A2S_PLAYER to obtain a challenge
+    def request(self, kind):
+        """Return the request packet for the given query kind. Should only be used internally."""
         packet = SourceQueryPacket()
         packet.putLong(WHOLE)
-        packet.putByte(A2S_PLAYER)
-        packet.putLong(CHALLENGE)
-
-        self.udp.send(packet.getvalue())
-        packet = self.receive()
+        if kind == INFO:
+            packet.putByte(A2S_INFO)
+            packet.putString(A2S_INFO_STRING)
+            if self.info_challenge:
+                packet.putLong(self.challenge_number)
+        else:
+            packet.putByte(A2S_PLAYER if kind == PLAYER else A2S_RULES)
+            packet.putLong(self.challenge_number)
+        return packet.getvalue()
+
+    def cached(self, kinds, maxage=None):
+        """Return the cached results younger than maxage (default: ttl) for the given query kinds."""
+        if maxage is None:
+            maxage = self.ttl
+        now = time.time()
+        results = {}
+        for kind in kinds:
+            entry = self.cache.get(kind)
+            if entry and now - entry[0] < maxage:
+                results[kind] = entry[1]
+        return results
+
+    def store(self, results):
+        now = time.time()
+        for kind, result in results.items():
+            self.cache[kind] = (now, result)
+
+    def query(self, *kinds, **kwargs):
+        """Return a dict with the replies to the given query kinds (info,
+           player, rules). The requests missing from the cache are sent
+           together, over one socket. Use maxage=0 to bypass the cache."""
+        with self.lock:
+            results = self.cached(kinds, kwargs.get('maxage'))
+            missing = [kind for kind in kinds if kind not in results]
+            if missing:
+                if not self.udp:
+                    self.connect()
+
+                exchange = SourceQueryExchange(self, missing)
+                deadline = time.time() + self.timeout
+                for data in exchange.requests():
+                    self.udp.send(data)
+
+                while exchange.pending:
+                    remaining = deadline - time.time()
+                    try:
+                        if remaining <= 0:
+                            raise socket.timeout()
+                        self.udp.settimeout(remaining)
+                        data = self.udp.recv(PACKETSIZE)
+                    except socket.timeout:
+                        raise SourceQueryError('Timed out while waiting for %s reply' % ', '.join(exchange.pending))
+                    for data in exchange.feed(data):
+                        self.udp.send(data)
+
+                self.store(exchange.results)
+                results.update(exchange.results)
+            return results
 
-        # this is our challenge packet
-        if packet.getByte() == S2C_CHALLENGE:
-            challenge = packet.getLong()
-            return challenge
+    def challenge(self):
+        """Return the challenge number, asking the server for one if needed."""
+        if self.challenge_number == CHALLENGE:
+            self.query(PLAYER, maxage=0)
+        return self.challenge_number
 
     def ping(self):
         """Deprecated. Use info()['ping'] instead."""
@@ -199,118 +333,142 @@ class SourceQuery(object):
 
     def info(self):
         """Return a dict with server info and ping."""
-        self.connect()
-
-        packet = SourceQueryPacket()
-        packet.putLong(WHOLE)
-        packet.putByte(A2S_INFO)
-        packet.putString(A2S_INFO_STRING)
-
-        before = time.time()
-
-        self.udp.send(packet.getvalue())
-        packet = self.receive()
-
-        after = time.time()
-
-        if packet.getByte() == A2S_INFO_REPLY:
-            result = {}
-
-            result['ping'] = after - before
-
-            result['network_version'] = packet.getByte()
-            result['hostname'] = packet.getString()
-            result['map'] = packet.getString()
-            result['gamedir'] = packet.getString()
-            result['gamedesc'] = packet.getString()
-            result['appid'] = packet.getShort()
-            result['numplayers'] = packet.getByte()
-            result['maxplayers'] = packet.getByte()
-            result['numbots'] = packet.getByte()
-            result['dedicated'] = chr(packet.getByte())
-            result['os'] = chr(packet.getByte())
-            result['passworded'] = packet.getByte()
-            result['secure'] = packet.getByte()
-            result['version'] = packet.getString()
-
-            # edf may or may not be present
-            # contents undefined (see wiki page)
-            # this protocol is horrible
-            try:
-                edf = packet.getByte()
-                result['edf'] = edf
-
-                if edf & 0x80:
-                    result['port'] = packet.getShort()
-                if edf & 0x10:
-                    result['steamid'] = packet.getLongLong()
-                if edf & 0x40:
-                    result['specport'] = packet.getShort()
-                    result['specname'] = packet.getString()
-                if edf & 0x20:
-                    result['tag'] = packet.getString()
-            except:
-                # let's just ignore all errors...
-                pass
-
-            return result
+        return self.query(INFO)[INFO]
 
     def player(self):
-        challenge = self.connect(True)
-
-        # now obtain the actual player info
-        packet = SourceQueryPacket()
-        packet.putLong(WHOLE)
-        packet.putByte(A2S_PLAYER)
-        packet.putLong(challenge)
-
-        self.udp.send(packet.getvalue())
-        packet = self.receive()
-
-        # this is our player info
-        if packet.getByte() == A2S_PLAYER_REPLY:
-            numplayers = packet.getByte()
-
-            result = []
-
-            # TF2 32player servers may send an incomplete reply
-            try:
-                for x in range(numplayers):
-                    player = {}
-                    player['index'] = packet.getByte()
-                    player['name'] = packet.getString()
-                    player['kills'] = packet.getLong()
-                    player['time'] = packet.getFloat()
-                    result.append(player)
-
-            except:
-                pass
-
-            return result
+        return self.query(PLAYER)[PLAYER]
 
     def rules(self):
-        challenge = self.connect(True)
-
-        # now obtain the actual rules
-        packet = SourceQueryPacket()
-        packet.putLong(WHOLE)
-        packet.putByte(A2S_RULES)
-        packet.putLong(challenge)
-
-        self.udp.send(packet.getvalue())
-        packet = self.receive()
-
-        # this is our rules
-        if packet.getByte() == A2S_RULES_REPLY:
-            rules = {}
-            numrules = packet.getShort()
-
-            # TF2 sends incomplete packets, so we have to ignore numrules
-            while 1:
-                try:
-                    key = packet.getString()
-                    rules[key] = packet.getString()
-                except:
-                    break
-
-            return rules
+        return self.query(RULES)[RULES]
+
+    def parse_info(self, packet):
+        result = {}
+
+        result['network_version'] = packet.getByte()
+        result['hostname'] = packet.getString()
+        result['map'] = packet.getString()
+        result['gamedir'] = packet.getString()
+        result['gamedesc'] = packet.getString()
+        result['appid'] = packet.getShort()
+        result['numplayers'] = packet.getByte()
+        result['maxplayers'] = packet.getByte()
+        result['numbots'] = packet.getByte()
+        result['dedicated'] = chr(packet.getByte())
+        result['os'] = chr(packet.getByte())
+        result['passworded'] = packet.getByte()
+        result['secure'] = packet.getByte()
+        result['version'] = packet.getString()
+
+        # edf may or may not be present
+        # contents undefined (see wiki page)
+        # this protocol is horrible
+        try:
+            edf = packet.getByte()
+            result['edf'] = edf
+
+            if edf & 0x80:
+                result['port'] = packet.getShort()
+            if edf & 0x10:
+                result['steamid'] = packet.getLongLong()
+            if edf & 0x40:
+                result['specport'] = packet.getShort()
+                result['specname'] = packet.getString()
+            if edf & 0x20:
+                result['tag'] = packet.getString()
+        except (struct.error, ValueError):
+            # let's just ignore all errors...
+            pass
+
+        return result
+
+    def parse_player(self, packet):
+        numplayers = packet.getByte()
+
+        result = []
+
+        # TF2 32player servers may send an incomplete reply
+        try:
+            for x in range(numplayers):
+                player = {}
+                player['index'] = packet.getByte()
+                player['name'] = packet.getString()
+                player['kills'] = packet.getLong()
+                player['time'] = packet.getFloat()
+                result.append(player)
+
+        except (struct.error, ValueError):
+            pass
+
+        return result
+
+    def parse_rules(self, packet):
+        rules = {}
+        numrules = packet.getShort()
+
+        # TF2 sends incomplete packets, so we have to ignore numrules
+        while 1:
+            try:
+                key = packet.getString()
+                rules[key] = packet.getString()
+            except (struct.error, ValueError):
+                break
+
+        return rules
+
+def poll(servers, kinds=(INFO,), timeout=1.0, maxage=None):
+    """Query a list of servers in parallel, over a single socket.
+
+       servers is a list of SourceQuery instances or (host, port) tuples.
+       Return a dict mapping each server to the dict of its replies, or to
+       the SourceQueryError raised while querying it (e.g. it timed out)."""
+    results = {}
+    exchanges = {}
+    udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for server in servers:
+            query = server if isinstance(server, SourceQuery) else SourceQuery(server[0], server[1], timeout)
+            results[server] = query.cached(kinds, maxage)
+            missing = [kind for kind in kinds if kind not in results[server]]
+            if not missing:
+                continue
+            try:
+                address = (socket.gethostbyname(query.host), query.port)
+                exchange = SourceQueryExchange(query, missing)
+                for data in exchange.requests():
+                    udp.sendto(data, address)
+            except (socket.error, SourceQueryError) as e:
+                results[server] = SourceQueryError('%s: %s' % (query.host, e))
+                continue
+            exchanges[address] = (server, exchange)
+
+        deadline = time.time() + timeout
+        waiting = set(exchanges)
+        while waiting:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([udp], [], [], remaining)[0]:
+                break
+            try:
+                data, address = udp.recvfrom(PACKETSIZE)
+            except socket.error:
+                continue
+            if address not in waiting:
+                continue
+            server, exchange = exchanges[address]
+            try:
+                for data in exchange.feed(data):
+                    udp.sendto(data, address)
+            except SourceQueryError as e:
+                results[server] = e
+                waiting.discard(address)
+                continue
+            if not exchange.pending:
+                exchange.query.store(exchange.results)
+                results[server].update(exchange.results)
+                waiting.discard(address)
+
+        for address in waiting:
+            server, exchange = exchanges[address]
+            results[server] = SourceQueryError('Timed out while waiting for %s reply' % ', '.join(exchange.pending))
+    finally:
+        udp.close()
+    return results
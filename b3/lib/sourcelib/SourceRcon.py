@@ -26,7 +26,7 @@
 
 """http://developer.valvesoftware.com/wiki/Source_RCON_Protocol"""
 
-import select, socket, struct
+import collections, select, socket, struct, threading, time
 
 SERVERDATA_AUTH = 3
 SERVERDATA_AUTH_RESPONSE = 2
@@ -39,11 +39,15 @@ MAX_COMMAND_LENGTH=510 # found by trial & error
 MIN_MESSAGE_LENGTH=4+4+1+1 # command (4), id (4), string1 (1), string2 (1)
 MAX_MESSAGE_LENGTH=4+4+4096+1 # command (4), id (4), string (4096), string2 (1)
 
+MAX_REQUEST_ID=0x7fffffff
+
 # there is no indication if a packet was split, and they are split by lines
-# instead of bytes, so even the size of split packets is somewhat random.
-# Allowing for a line length of up to 400 characters, risk waiting for an
-# extra packet that may never come if the previous packet was this large.
-PROBABLY_SPLIT_IF_LARGER_THAN = MAX_MESSAGE_LENGTH - 400
+# instead of bytes, so the end of a reply can't be told from its packets.
+# After the commands, an empty SERVERDATA_RESPONSE_VALUE request is sent:
+# the server mirrors it once it has answered all the commands sent before,
+# which marks the end of the replies (and of the pipeline).
+# Some servers follow the mirrored packet with a second one (body 0x00000100):
+# when it shows up late, it is dropped by the next receive (see stale).
 
 class SourceRconError(Exception):
     pass
@@ -54,133 +58,222 @@ class SourceRcon(object):
        import SourceRcon
        server = SourceRcon.SourceRcon('1.2.3.4', 27015, 'secret')
        print(server.rcon('cvarlist'))
+       print(server.batch(['status', 'mp_timelimit']))
+
+       The connection is opened and authenticated on the first command, then
+       kept alive and reused: it is reopened automatically if it dropped.
     """
-    def __init__(self, host, port=27015, password='', timeout=1.0):
+    def __init__(self, host, port=27015, password='', timeout=1.0, pipeline=16):
         self.host = host
         self.port = port
         self.password = password
         self.timeout = timeout
+        self.pipeline = pipeline # max number of commands sent before reading the replies
         self.tcp = False
+        self.authed = False
         self.reqid = 0
+        self.lastused = 0
+        self.received = False
+        self.lock = threading.RLock()
+        self._buffer = b''
+        self._stale = collections.deque(maxlen=8) # ids of the terminators which may still be mirrored
 
     def disconnect(self):
         """Disconnect from the server."""
         if self.tcp:
-            self.tcp.close()
+            try:
+                self.tcp.close()
+            except socket.error:
+                pass
+        self.tcp = False
+        self.authed = False
+        self._buffer = b''
+        self._stale.clear()
 
     def connect(self):
         """Connect to the server. Should only be used internally."""
+        self.disconnect()
         self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.tcp.settimeout(self.timeout)
+        self.tcp.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.tcp.connect((self.host, self.port))
 
-    def send(self, cmd, message):
-        """Send command and message to the server. Should only be used internally."""
+    def isconnected(self):
+        """Tell whether the connection is still open (the server did not close it)."""
+        if not self.tcp:
+            return False
+        try:
+            readable = select.select([self.tcp], [], [], 0)[0]
+            # a readable socket with nothing to read has been closed by the server
+            return not readable or bool(self.tcp.recv(1, socket.MSG_PEEK))
+        except (socket.error, ValueError):
+            return False
+
+    def nextid(self):
+        """Return a new request id. Should only be used internally."""
+        self.reqid = self.reqid % MAX_REQUEST_ID + 1
+        return self.reqid
+
+    def pack(self, cmd, message):
+        """Build a packet. Should only be used internally.
+           Return a tuple (request id, packet data)."""
+        if not isinstance(message, bytes):
+            message = message.encode('utf-8')
         if len(message) > MAX_COMMAND_LENGTH:
             raise SourceRconError('RCON message too large to send')
 
-        self.reqid += 1
-        data = struct.pack('<l', self.reqid) + struct.pack('<l', cmd) + message + '\x00\x00'
-        self.tcp.send(struct.pack('<l', len(data)) + data)
+        reqid = self.nextid()
+        data = struct.pack('<ll', reqid, cmd) + message + b'\x00\x00'
+        return reqid, struct.pack('<l', len(data)) + data
+
+    def send(self, cmd, message):
+        """Send command and message to the server. Should only be used internally.
+           Return the request id."""
+        reqid, data = self.pack(cmd, message)
+        self.tcp.sendall(data)
+        return reqid
+
+    def read(self, size):
+        """Read exactly size bytes from the server. Should only be used internally."""
+        while len(self._buffer) < size:
+            try:
+                recv = self.tcp.recv(max(4096, size - len(self._buffer)))
+            except socket.timeout:
+                raise SourceRconError('Timed out while waiting for reply')
+            if not len(recv):
+                raise SourceRconError('RCON connection unexpectedly closed by remote host')
+            self._buffer += recv
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
 
     def receive(self):
-        """Receive a reply from the server. Should only be used internally."""
-        packetsize = False
-        requestid = False
-        response = False
-        message = ''
-        message2 = ''
-
-        # response may be split into multiple packets, we don't know how many
-        # so we loop until we decide to finish
+        """Receive a packet from the server. Should only be used internally.
+           Return a tuple (request id, response type, message)."""
         while 1:
-            # read the size of this packet
-            buf = ''
-
-            while len(buf) < 4:
-                try:
-                    recv = self.tcp.recv(4 - len(buf))
-                    if not len(recv):
-                        raise SourceRconError('RCON connection unexpectedly closed by remote host')
-                    buf += recv
-                except SourceRconError:
-                    raise
-                except:
-                    break
-
-            if len(buf) != 4:
-                # we waited for a packet but there isn't anything
-                break
-
-            packetsize = struct.unpack('<l', buf)[0]
+            packetsize = struct.unpack('<l', self.read(4))[0]
 
             if packetsize < MIN_MESSAGE_LENGTH or packetsize > MAX_MESSAGE_LENGTH:
                 raise SourceRconError('RCON packet claims to have illegal size: %d bytes' % (packetsize,))
 
-            # read the whole packet
-            buf = ''
-
-            while len(buf) < packetsize:
-                try:
-                    recv = self.tcp.recv(packetsize - len(buf))
-                    if not len(recv):
-                        raise SourceRconError('RCON connection unexpectedly closed by remote host')
-                    buf += recv
-                except SourceRconError:
-                    raise
-                except:
-                    break
-
-            if len(buf) != packetsize:
-                raise SourceRconError('Received RCON packet with bad length (%d of %d bytes)' % (len(buf),packetsize,))
-
-            # parse the packet
-            requestid = struct.unpack('<l', buf[:4])[0]
-
+            buf = self.read(packetsize)
+            requestid, response = struct.unpack('<ll', buf[:8])
+            if requestid not in self._stale:
+                break
+            # late second mirrored packet of a previous terminator: its body is not a valid reply
+            self._stale.remove(requestid)
+
+        # extract the two strings using index magic
+        str1 = buf[8:]
+        pos1 = str1.index(b'\x00')
+        str2 = str1[pos1+1:]
+        pos2 = str2.index(b'\x00')
+        crap = str2[pos2+1:]
+
+        if crap:
+            raise SourceRconError('RCON response contains %d superfluous bytes' % (len(crap),))
+        elif str2[:pos2]:
+            raise SourceRconError('Invalid response message: %s' % (repr(str2[:pos2]),))
+
+        return requestid, response, str1[:pos1]
+
+    def auth(self):
+        """Open the connection and authenticate. Should only be used internally."""
+        self.connect()
+        reqid = self.send(SERVERDATA_AUTH, self.password)
+
+        # the auth response may be preceded by an empty SERVERDATA_RESPONSE_VALUE
+        # or by a "you have been banned" message
+        while 1:
+            requestid, response, message = self.receive()
             if requestid == -1:
                 self.disconnect()
                 raise SourceRconError('Bad RCON password')
+            elif response == SERVERDATA_AUTH_RESPONSE and requestid == reqid:
+                break
+            elif message and requestid != reqid:
+                self.disconnect()
+                raise SourceRconError('RCON authentication failure: %s' % (repr(message),))
 
-            elif requestid != self.reqid:
-                raise SourceRconError('RCON request id error: %d, expected %d' % (requestid,self.reqid,))
-
-            response = struct.unpack('<l', buf[4:8])[0]
+        self.authed = True
 
-            if response == SERVERDATA_AUTH_RESPONSE:
-                # This response says we're successfully authed.
-                return True
+    def execute(self, commands):
+        """Pipeline commands over the current connection. Should only be used internally.
+           Return the list of replies, in the same order as the commands."""
+        packets = [self.pack(SERVERDATA_EXECCOMMAND, command) for command in commands]
+        terminator, data = self.pack(SERVERDATA_RESPONSE_VALUE, b'')
+        packets.append((terminator, data))
+        replies = dict((reqid, []) for reqid, data in packets[:-1])
 
+        self.received = False
+        self.tcp.sendall(b''.join(data for reqid, data in packets))
+        while 1:
+            requestid, response, message = self.receive()
+            self.received = True
+            if requestid == terminator:
+                # some servers follow the mirrored packet with a second one,
+                # read it now so that it doesn't end up in the next replies
+                # (if it is not there yet, the next receive drops it)
+                self._stale.append(terminator)
+                self.discard()
+                break
+            elif requestid == -1:
+                self.disconnect()
+                raise SourceRconError('Bad RCON password')
             elif response != SERVERDATA_RESPONSE_VALUE:
                 raise SourceRconError('Invalid RCON command response: %d' % (response,))
+            elif requestid in replies:
+                replies[requestid].append(message)
+            # else: a late packet from a previous request, drop it
 
-            # extract the two strings using index magic
-            str1 = buf[8:]
-            pos1 = str1.index('\x00')
-            str2 = str1[pos1+1:]
-            pos2 = str2.index('\x00')
-            crap = str2[pos2+1:]
-
-            if crap:
-                raise SourceRconError('RCON response contains %d superfluous bytes' % (len(crap),))
-
-            # add the strings to the full message result
-            message += str1[:pos1]
-            message2 += str2[:pos2]
-
-            # unconditionally poll for more packets
-            poll = select.select([self.tcp], [], [], 0)
+        self.lastused = time.time()
+        return [self.decode(b''.join(replies[reqid])) for reqid, data in packets[:-1]]
 
-            if not len(poll[0]) and packetsize < PROBABLY_SPLIT_IF_LARGER_THAN:
-                # no packets waiting, previous packet wasn't large: let's stop here.
-                break
-
-        if response is False:
-            raise SourceRconError('Timed out while waiting for reply')
-
-        elif message2:
-            raise SourceRconError('Invalid response message: %s' % (repr(message2),))
-
-        return message
+    def discard(self):
+        """Drop the second mirrored terminator packets which are there. Should only be used internally."""
+        timeout = self.tcp.gettimeout()
+        self.tcp.settimeout(0.01)
+        try:
+            while self._buffer or len(select.select([self.tcp], [], [], 0)[0]):
+                size = struct.unpack('<l', self.read(4))[0]
+                data = self.read(size)
+                reqid = struct.unpack('<l', data[:4])[0]
+                if reqid not in self._stale:
+                    # not a terminator: put it back
+                    self._buffer = struct.pack('<l', size) + data + self._buffer
+                    break
+                self._stale.remove(reqid)
+        except SourceRconError:
+            pass
+        finally:
+            self.tcp.settimeout(timeout)
+
+    def decode(self, message):
+        """Return the reply as a string. Should only be used internally."""
+        if bytes is str:
+            return message
+        return message.decode('utf-8', 'replace')
+
+    def batch(self, commands):
+        """Send a list of RCON commands to the server and return the list of replies,
+           in the same order. Commands are pipelined over a single connection:
+           connect and auth if necessary, handle dropped connections."""
+        results = []
+        with self.lock:
+            for i in range(0, len(commands), self.pipeline):
+                chunk = commands[i:i + self.pipeline]
+                if not self.authed or not self.isconnected():
+                    self.auth()
+                try:
+                    results.extend(self.execute(chunk))
+                except (SourceRconError, socket.error) as e:
+                    if self.received or not self.authed:
+                        # the server answered (or refused the password): don't execute the commands twice
+                        self.disconnect()
+                        raise
+                    # the connection dropped before anything was executed, try one more time
+                    self.auth()
+                    results.extend(self.execute(chunk))
+        return results
 
     def rcon(self, command):
         """Send RCON command to the server. Connect and auth if necessary,
@@ -189,29 +282,7 @@ class SourceRcon(object):
         if '\n' in command:
             commands = command.split('\n')
             def f(x): y = x.strip(); return len(y) and not y.startswith("//")
-            commands = filter(f, commands)
-            results = map(self.rcon, commands)
-            return "".join(results)
-
-        # send a single command. connect and auth if necessary.
-        try:
-            self.send(SERVERDATA_EXECCOMMAND, command)
-            return self.receive()
-        except:
-            # timeout? invalid? we don't care. try one more time.
-            self.disconnect()
-            self.connect()
-            self.send(SERVERDATA_AUTH, self.password)
-
-            auth = self.receive()
-            # the first packet may be a "you have been banned" or empty string.
-            # in the latter case, fetch the second packet
-            if auth == '':
-                auth = self.receive()
-
-            if auth is not True:
-                self.disconnect()
-                raise SourceRconError('RCON authentication failure: %s' % (repr(auth),))
+            commands = list(filter(f, commands))
+            return "".join(self.batch(commands))
 
-            self.send(SERVERDATA_EXECCOMMAND, command)
-            return self.receive()
+        return self.batch([command])[0]
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.0'
+
+import mmap
+import os
+
+
+class MmapLogReader(object):
+    """
+    Read a game log file in bulk (offline replay, stats rebuild, testing).
+
+    The file is memory mapped and newlines are searched on the raw buffer: a line is only copied out of the
+    map and decoded if the given filter accepts it, so huge archives can be processed without loading them
+    in memory and without paying the decoding cost of the lines no parser is interested in.
+    Pages already consumed are released from time to time to keep the resident memory bounded.
+    """
+    chunk_size = 1024 * 1024
+    release_size = 64 * 1024 * 1024
+
+    def __init__(self, path, accept=None, encoding='latin-1', start=0):
+        """
+        Object constructor.
+        :param path: The path of the game log file
+        :param accept: A function telling whether a raw line (bytes) must be decoded (None to decode every line)
+        :param encoding: The game log encoding
+        :param start: The offset where to start reading from
+        """
+        self.path = path
+        self.accept = accept
+        self.encoding = encoding or 'latin-1'
+        self.offset = start
+        self.scanned = 0
+        self.decoded = 0
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        self._map = None
+        if self.size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self._map, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                self._map.madvise(mmap.MADV_SEQUENTIAL)
+
+    def close(self):
+        """
+        Release the file and the memory map.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _release(self, upto):
+        """
+        Tell the kernel we are done with the pages before the given offset.
+        """
+        if hasattr(self._map, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+            length = upto - upto % mmap.PAGESIZE
+            if length > 0:
+                self._map.madvise(mmap.MADV_DONTNEED, 0, length)
+
+    def __iter__(self):
+        """
+        Yield the decoded lines accepted by the filter (without the trailing newline).
+        """
+        mm = self._map
+        if mm is None:
+            return
+
+        accept = self.accept
+        encoding = self.encoding
+        size = self.size
+        pos = self.offset
+        release = pos + self.release_size
+        while pos < size:
+            # split a chunk of complete lines at once: only the accepted ones are decoded
+            end = mm.rfind(b'\n', pos, min(pos + self.chunk_size, size))
+            if end < 0:
+                end = mm.find(b'\n', pos)
+                if end < 0:
+                    end = size
+            raws = mm[pos:end].split(b'\n')
+            pos = end + 1
+            self.scanned += len(raws)
+            for raw in raws:
+                if accept is None or accept(raw):
+                    self.decoded += 1
+                    yield raw.decode(encoding, 'replace')
+            self.offset = min(pos, size)
+            if pos >= release:
+                self._release(pos)
+                release = pos + self.release_size
+
+    def batches(self, size=1000):
+        """
+        Yield the decoded lines accepted by the filter in lists of the given size.
+        :param size: The maximum number of lines per batch
+        """
+        batch = []
+        for line in self:
+            batch.append(line)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
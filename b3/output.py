@@ -23,7 +23,7 @@
 # ################################################################### #
 
 __author__  = 'ThorN'
-__version__ = '1.7.2'
+__version__ = '1.8'
 
 import sys
 import logging
@@ -53,6 +53,9 @@ logging._srcfile = None
 # logger object instance
 __output = None
 
+# named logger instances (one per game server in supervisor mode)
+__outputs = {}
+
 
 class OutputHandler(logging.Logger):
 
@@ -158,42 +161,61 @@ class STDErrLogger:
 logging.setLoggerClass(OutputHandler)
 
 
-def getInstance(logfile='b3.log', loglevel=21, logsize=10485760, log2console=False):
+def _setupLogger(logger, logfile, loglevel, logsize, log2console, tag=''):
+    """
+    Attach the file (and console) handlers to the given logger.
+    :param tag: A format string prepended to every message (i.e. the logger name)
+    """
+    # FILE HANDLER
+    file_formatter = logging.Formatter('%(asctime)s %(levelname)s ' + tag + '%(message)r', '%y%m%d %H:%M:%S')
+    handler = handlers.RotatingFileHandler(logfile, maxBytes=logsize, backupCount=5, encoding="UTF-8")
+    handler.doRollover()
+    handler.setFormatter(file_formatter)
+
+    logger.addHandler(handler)
+
+    if log2console:
+        # CONSOLE HANDLER
+        console_formatter = logging.Formatter('%(asctime)s\t%(levelname)s\t' + tag + '%(message)r', '%M:%S')
+        handler2 = logging.StreamHandler(sys.stdout)
+        handler2.setFormatter(console_formatter)
+
+        logger.addHandler(handler2)
+
+        handler_error = logging.StreamHandler(sys.stderr)
+        handler_error.setFormatter(console_formatter)
+        handler_error.setLevel(logging.ERROR)
+
+        logger.addHandler(handler_error)
+
+    logger.setLevel(loglevel)
+
+
+def getInstance(logfile='b3.log', loglevel=21, logsize=10485760, log2console=False, name=None):
     """
     Return a Logger instance.
     :param logfile: The logfile name.
     :param loglevel: The logging level.
     :param logsize: The size of the log file (in bytes)
     :param log2console: Whether or not to extend logging to the console.
+    :param name: The game server name: every game server hosted in the same process (supervisor mode) gets its
+                 own logger, writing in its own log file with every message tagged with the logger name.
     """
     global __output
 
+    if name is not None:
+        try:
+            return __outputs[name]
+        except KeyError:
+            logger = __outputs[name] = logging.getLogger('b3.%s' % name)
+            # don't forward messages to the handlers of the other game servers
+            logger.propagate = False
+            _setupLogger(logger, logfile, loglevel, logsize, log2console, '[%(name)s] ')
+            return logger
+
     if __output is None:
 
         __output = logging.getLogger('output')
-
-        # FILE HANDLER
-        file_formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)r', '%y%m%d %H:%M:%S')
-        handler = handlers.RotatingFileHandler(logfile, maxBytes=logsize, backupCount=5, encoding="UTF-8")
-        handler.doRollover()
-        handler.setFormatter(file_formatter)
-
-        __output.addHandler(handler)
-
-        if log2console:
-            # CONSOLE HANDLER
-            console_formatter = logging.Formatter('%(asctime)s\t%(levelname)s\t%(message)r', '%M:%S')
-            handler2 = logging.StreamHandler(sys.stdout)
-            handler2.setFormatter(console_formatter)
-
-            __output.addHandler(handler2)
-
-            handler_error = logging.StreamHandler(sys.stderr)
-            handler_error.setFormatter(console_formatter)
-            handler_error.setLevel(logging.ERROR)
-
-            __output.addHandler(handler_error)
-
-        __output.setLevel(loglevel)
+        _setupLogger(__output, logfile, loglevel, logsize, log2console)
 
     return __output
\ No newline at end of file
@@ -23,12 +23,13 @@
 # ################################################################### #
 
 __author__ = 'ThorN, Courgette, xlr8or, Bakes, Ozon, Fenix'
-__version__ = '1.43.6'
+__version__ = '1.56'
 
 
 import os
 import sys
 import re
+import threading
 import time
 try:
     import thread
@@ -77,7 +78,13 @@ import b3.events
 import b3.output
 import b3.game
 import b3.cron
+import b3.coalesce
+import b3.dispatch
+import b3.logreader
+import b3.replay
+import b3.runtime
 import b3.parsers.q3a.rcon
+import b3.tailer
 import b3.timezones
 
 try:
@@ -88,7 +95,6 @@ from collections import OrderedDict
 from b3 import __version__ as currentVersion
 from b3.clients import Clients
 from b3.clients import Group
-from b3.decorators import Memoize
 from b3.exceptions import MissingRequirement
 from b3.functions import getModule
 from b3.functions import vars2printf
@@ -113,12 +119,21 @@ class Parser(object):
     OutputClass = b3.parsers.q3a.rcon.Rcon  # default output class set to the q3a rcon class
 
     _commands = {}  # will hold RCON commands for the current game
+    _coalescer = None  # damage events coalescer (None when damage events are not merged)
+    _catchupEnd = 0  # game log offset where the catch up started from a checkpoint ends
+    _checkpoint = None  # game log checkpoint (None when checkpointing is disabled)
+    _checkpointInterval = 10  # minimum time between two game log checkpoints
+    _checkpointNext = 0  # when the next game log checkpoint is due
     _cron = None  # cron instance
+    _dispatcher = None  # plugin workers dispatcher (None when events are dispatched serially)
     _events = {}  # available events (K=>EVENT)
     _eventNames = {}  # available event names (K=>NAME)
     _eventsStats_cronTab = None  # crontab used to log event statistics
+    _fastForward = False  # set to True while catching up with the game log: chat output is suppressed
     _handlers = {}  # event handlers
     _lineTime = None  # used to track log file time changes
+    _logTimeLast = 0  # game log time of the last line parsed (relative to _logTimeStart)
+    _logTimeStart = None  # game log time of the first line parsed
     _lineFormat = re.compile('^([a-z ]+): (.*?)', re.IGNORECASE)
     _line_color_prefix = ''  # a color code prefix to be added to every line resulting from getWrap
     _line_length = 80  # max wrap length
@@ -134,15 +149,18 @@ class Parser(object):
     _rconIp = ''  # the ip address where to forward RCON commands
     _rconPort = None  # the virtual port where to forward RCON commands
     _rconPassword = ''  # the rcon password set on the server
+    _runtime = None  # asyncio runtime (None when B3 runs with one thread per task)
     _reColor = re.compile(r'\^[0-9a-z]') # regex used to strip out color codes from a given string
+    _replay = None  # game log replay (None unless B3 has been started with --replay)
     _timeStart = None  # timestamp when B3 has first started
     _use_color_codes = True  # whether the game supports color codes or not
 
     autorestart = False  # whether B3 has been started in autorestart mode
     clients = None
+    clock = None  # virtual clock (only set when replaying a game log)
     config = None  # parser configuration file instance
     delay = 0.33  # time between each game log lines fetching
-    delay2 = 0.02  # time between each game log line processing: max number of lines processed in one second
+    delay2 = 0  # minimum time spent on each game log line: only set when lines_per_second is configured
     encoding = 'latin-1'
     game = None
     gameName = None # console name
@@ -156,6 +174,8 @@ class Parser(object):
     remoteLog = False
     screen = None
     storage = None  # storage module instance
+    supervisor = None  # supervisor instance (only set when B3 hosts several game servers in the same process)
+    tailer = None  # game log tailer instance
     type = None
     working = True  # whether B3 is running or not
     wrapper = None  # textwrapper instance
@@ -216,9 +236,6 @@ class Parser(object):
     exitcode = None
 
     def __new__(cls, *args, **kwargs):
-        cls.__read = cls.__read_input
-        if sys.platform == 'darwin':
-            cls.__read = cls.___read_input_darwin
         return object.__new__(cls)
 
     def __init__(self, conf, options):
@@ -229,6 +246,12 @@ class Parser(object):
         """
         self._timeStart = self.time()
 
+        # per instance state: several parsers may live in the same process (supervisor mode)
+        self._handlers = {}
+        self._messages = {}
+        self.exiting = thread.allocate_lock()
+        self.supervisor = getattr(options, 'supervisor', None)
+
         # store in the parser whether we are running B3 in autorestart mode so
         # plugins can react on this and perform different operations
         self.autorestart = options.autorestart
@@ -253,11 +276,12 @@ class Parser(object):
             logsize = b3.functions.getBytes('10MB')
 
         # create the main logger instance
-        self.log = b3.output.getInstance(logfile, self.config.getint('b3', 'log_level'), logsize, log2console)
+        self.log = b3.output.getInstance(logfile, self.config.getint('b3', 'log_level'), logsize, log2console,
+                                         name=getattr(options, 'server', None))
 
         # save screen output to self.screen
         self.screen = sys.stdout
-        self.screen.write('Activating log   : %s\n' % b3.getShortPath(os.path.abspath(b3.getAbsolutePath(logfile, True))))
+        self.screen.write('Activating log   : %s\n' % b3.getShortPath(os.path.abspath(b3.getAbsolutePath(logfile, True, conf=self.config))))
         self.screen.flush()
 
         sys.stdout = b3.output.STDOutLogger(self.log)
@@ -287,13 +311,13 @@ class Parser(object):
 
         if self._publicIp and self._publicIp[0:1] in ('~', '/'):
             # load ip from a file
-            f = open(b3.getAbsolutePath(self._publicIp, decode=True))
+            f = open(b3.getAbsolutePath(self._publicIp, decode=True, conf=self.config))
             self._publicIp = f.read().strip()
             f.close()
 
         if self._rconIp[0:1] in ('~', '/'):
             # load ip from a file
-            f = open(b3.getAbsolutePath(self._rconIp, decode=True))
+            f = open(b3.getAbsolutePath(self._rconIp, decode=True, conf=self.config))
             self._rconIp = f.read().strip()
             f.close()
 
@@ -344,19 +368,49 @@ class Parser(object):
         try:
             # setup storage module
             dsn = self.config.get('b3', 'database')
-            self.storage = b3.storage.getStorage(dsn=dsn, dsnDict=splitDSN(dsn), console=self)
+            if self.supervisor:
+                # storage (connection and groups cache) shared with the other game servers of this process
+                self.storage = self.supervisor.getStorage(dsn, self)
+            else:
+                self.storage = b3.storage.getStorage(dsn=dsn, dsnDict=splitDSN(dsn), console=self)
         except (AttributeError, ImportError) as e:
             # exit if we don't manage to setup the storage module: B3 will stop working upon Admin
             # Plugin loading so it makes no sense to keep going with the console initialization
             self.critical('Could not setup storage module: %s', e)
 
-        # establish a connection with the database
-        self.storage.connect()
+        if not self.supervisor:
+            # establish a connection with the database
+            self.storage.connect()
 
-        if self.config.has_option('server', 'game_log'):
+        try:
+            # load the client groups once: group lookups are then served from memory
+            self.storage.getGroupRegistry()
+        except Exception as e:
+            self.error('Could not load the client groups: %s', e)
+
+        if self.config.has_option('caching', 'penalty_summary_ttl'):
+            # seconds between two checks of the penalties of a client in the database
+            self.storage.penaltySummaryTTL = max(0.0, self.config.getfloat('caching', 'penalty_summary_ttl'))
+            self.bot('Setting penalty summary TTL to %s seconds', self.storage.penaltySummaryTTL)
+
+        replay = getattr(options, 'replay', None)
+        if replay:
+            # run against a recorded game log: the configured game log and game server are not used
+            self._replay = b3.replay.LogReplay(self, replay, getattr(options, 'replay_speed', 0))
+            self.clock = self._replay.clock
+            speed = self.clock.speed
+            self.bot('Replaying game log %s (%s)', replay, 'x%s' % speed if speed else 'as fast as possible')
+            self.screen.write('Replaying gamelog: %s\n' % b3.getShortPath(os.path.abspath(replay)))
+        elif self.config.has_option('server', 'game_log'):
             # open log file
             game_log = self.config.get('server', 'game_log')
-            if game_log[0:6] == 'ftp://' or game_log[0:7] == 'sftp://' or game_log[0:7] == 'http://':
+            if game_log[0:6] == 'udp://':
+                self.remoteLog = True
+                self.bot('Working in UDP remote-log mode: %s', game_log)
+                self.screen.write('Using gamelog    : %s\n' % game_log)
+                self.tailer = self.getUdpTailer(game_log)
+                self.bot('Using %s game log tailer', self.tailer.name)
+            elif game_log[0:6] == 'ftp://' or game_log[0:7] == 'sftp://' or game_log[0:7] == 'http://':
                 self.remoteLog = True
                 self.bot('Working in remote-log mode: %s', game_log)
                 
@@ -386,25 +440,55 @@ class Parser(object):
                 self.bot('Game log is: %s', game_log)
                 f = self.config.getpath('server', 'game_log')
 
-            self.bot('Starting bot reading file: %s', os.path.abspath(f))
-            self.screen.write('Using gamelog    : %s\n' % b3.getShortPath(os.path.abspath(f)))
+            if not self.tailer:
+                self.bot('Starting bot reading file: %s', os.path.abspath(f))
+                self.screen.write('Using gamelog    : %s\n' % b3.getShortPath(os.path.abspath(f)))
+
+                if os.path.isfile(f):
+                    seek = True
+                    if self.config.has_option('server', 'seek'):
+                        seek = self.config.getboolean('server', 'seek')
 
-            if os.path.isfile(f):
-                self.input = open(f, 'r')
-                if self.config.has_option('server', 'seek'):
-                    seek = self.config.getboolean('server', 'seek')
-                    if seek:
-                        self.input.seek(0, os.SEEK_END)
+                    tailer = b3.tailer.TAILER_AUTO
+                    if self.config.has_option('server', 'log_tailer'):
+                        tailer = self.config.get('server', 'log_tailer').lower()
+
+                    self.tailer = b3.tailer.getTailer(self, f, seek=seek, kind=tailer)
+                    self.bot('Using %s game log tailer', self.tailer.name)
+
+                    if self.config.has_option('server', 'log_checkpoint'):
+                        self.resumeLog()
                 else:
-                    self.input.seek(0, os.SEEK_END)
-            else:
-                self.screen.write(">>> Cannot read file: %s\n" % os.path.abspath(f))
-                self.screen.flush()
-                self.critical("Cannot read file: %s", os.path.abspath(f))
+                    self.screen.write(">>> Cannot read file: %s\n" % os.path.abspath(f))
+                    self.screen.flush()
+                    self.critical("Cannot read file: %s", os.path.abspath(f))
+
+        runtime = b3.runtime.RUNTIME_THREADS
+        if self.config.has_option('b3', 'runtime'):
+            runtime = self.config.get('b3', 'runtime').lower()
+            if runtime not in b3.runtime.RUNTIMES:
+                self.warning('Invalid runtime specified: %s: falling back to %s', runtime, b3.runtime.RUNTIME_THREADS)
+                runtime = b3.runtime.RUNTIME_THREADS
+
+        if runtime == b3.runtime.RUNTIME_ASYNCIO and self._replay:
+            self.warning('The asyncio runtime is not supported when replaying a game log: falling back to %s',
+                         b3.runtime.RUNTIME_THREADS)
+        elif runtime == b3.runtime.RUNTIME_ASYNCIO:
+            workers = 4
+            if self.config.has_option('b3', 'runtime_workers'):
+                try:
+                    workers = max(1, self.config.getint('b3', 'runtime_workers'))
+                except ValueError as err:
+                    self.warning(err)
+            self.bot('Using asyncio runtime (%s worker(s) for blocking calls)', workers)
+            self._runtime = b3.runtime.AsyncRuntime(self, workers)
 
         try:
             # setup rcon
-            self.output = self.OutputClass(self, (self._rconIp, self._rconPort), self._rconPassword)
+            if self._replay:
+                self.output = b3.replay.ReplayOutput(self)
+            else:
+                self.output = self.OutputClass(self, (self._rconIp, self._rconPort), self._rconPassword)
         except Exception as err:
             self.screen.write(">>> Cannot setup RCON: %s\n" % err)
             self.screen.flush()
@@ -436,7 +520,7 @@ class Parser(object):
             self.bot('Setting multiline_noprefix to: %s', self._multiline_noprefix)
 
         # testing rcon
-        if self.rconTest:
+        if self.rconTest and not self._replay:
             res = self.output.write('status')
             self.output.flush()
             self.screen.write('Testing RCON     : ')
@@ -474,23 +558,209 @@ class Parser(object):
             queuesize = 50
             self.warning(err)
 
+        priorities, policies = self._getEventQueueSettings()
         self.debug("Creating the event queue with size %s", queuesize)
-        self.queue = Queue.Queue(queuesize)
+        self.queue = b3.events.EventQueue(self, queuesize, priorities=priorities, policies=policies)
+        if self._runtime:
+            self.queue.listener = self._runtime.notifyEvent
+
+        dispatch = b3.dispatch.DISPATCH_SERIAL
+        if self.config.has_option('b3', 'event_dispatch'):
+            dispatch = self.config.get('b3', 'event_dispatch').lower()
+            if dispatch not in b3.dispatch.DISPATCH_MODES:
+                self.warning('Invalid event_dispatch specified: %s: falling back to %s',
+                             dispatch, b3.dispatch.DISPATCH_SERIAL)
+                dispatch = b3.dispatch.DISPATCH_SERIAL
+
+        if dispatch == b3.dispatch.DISPATCH_WORKERS and self._runtime:
+            self.warning('event_dispatch %s is not supported by the asyncio runtime: blocking plugins are '
+                         'executed by the runtime workers', dispatch)
+        elif dispatch == b3.dispatch.DISPATCH_WORKERS:
+            workers = 1
+            if self.config.has_option('b3', 'event_dispatch_workers'):
+                try:
+                    workers = max(1, self.config.getint('b3', 'event_dispatch_workers'))
+                except ValueError as err:
+                    self.warning(err)
+
+            inline = []
+            if self.config.has_option('b3', 'event_dispatch_inline'):
+                inline = [x.strip().lower() for x in self.config.get('b3', 'event_dispatch_inline').split(',')
+                          if x.strip()]
+
+            groups = {}
+            if self.config.has_option('b3', 'event_dispatch_groups'):
+                # format: plugin:group, plugin:group, ...
+                for item in self.config.get('b3', 'event_dispatch_groups').split(','):
+                    if ':' in item:
+                        plugin_name, group_name = item.split(':', 1)
+                        groups[plugin_name.strip().lower()] = group_name.strip()
+
+            self.bot('Dispatching events using plugin workers (%s worker(s) per group)', workers)
+            self._dispatcher = b3.dispatch.EventDispatcher(self, workers=workers, queuesize=queuesize,
+                                                           inline=inline, groups=groups)
+
+        if self.config.has_option('b3', 'damage_coalesce_window'):
+            try:
+                window = self.config.getfloat('b3', 'damage_coalesce_window')
+                if window > 0:
+                    self.bot('Setting damage events coalescing window to %s seconds', window)
+                    self._coalescer = b3.coalesce.DamageCoalescer(self, window)
+            except ValueError as err:
+                self.warning(err)
 
         atexit.register(self.shutdown)
 
+    def _getEventQueueSettings(self):
+        """
+        Read event priorities and queue full policies from the event_queue section of the main config file.
+        Every option holds a comma separated list of event keys, i.e: low: EVT_CLIENT_DAMAGE, EVT_CLIENT_GIB
+        :return: A tuple of dicts (priorities, policies) mapping event keys to their setting
+        """
+        priorities = {}
+        policies = {}
+        if not self.config.has_section('event_queue'):
+            return priorities, policies
+
+        def _keys(option):
+            return [x.strip().upper() for x in self.config.get('event_queue', option).split(',') if x.strip()]
+
+        for name, level in b3.events.PRIORITIES.items():
+            if self.config.has_option('event_queue', name):
+                for key in _keys(name):
+                    priorities[key] = level
+                    self.bot('Setting event queue priority for %s: %s', key, name)
+
+        for policy in b3.events.POLICIES:
+            option = policy.replace('-', '_')
+            if self.config.has_option('event_queue', option):
+                for key in _keys(option):
+                    policies[key] = policy
+                    self.bot('Setting event queue policy for %s: %s', key, policy)
+
+        return priorities, policies
+
+    def getLineFilter(self):
+        """
+        Return a function telling whether a raw (undecoded) game log line can produce an event, used by bulk
+        readers to skip decoding the other lines, or None if every line must be parsed.
+        """
+        return None
+
+    def getLogReader(self, path, start=0):
+        """
+        Return a bulk reader over a whole game log file (offline processing).
+        :param path: The path of the game log file
+        :param start: The offset where to start reading from
+        """
+        return b3.logreader.MmapLogReader(path, accept=self.getLineFilter(), encoding=self.encoding, start=start)
+
+    def getUdpTailer(self, url):
+        """
+        Create the tailer receiving the game log from an UDP stream.
+        :param url: The stream url (udp://host:port)
+        """
+        secret = None
+        if self.config.has_option('server', 'log_secret'):
+            secret = self.config.get('server', 'log_secret').strip() or None
+
+        sources = None
+        if self.config.has_option('server', 'log_sources'):
+            sources = [x.strip() for x in self.config.get('server', 'log_sources').split(',') if x.strip()]
+            self.bot('Accepting UDP game log datagrams from: %s', ', '.join(sources))
+
+        reorder_window = 0.05
+        if self.config.has_option('server', 'log_reorder_window'):
+            try:
+                reorder_window = max(0.0, self.config.getfloat('server', 'log_reorder_window'))
+            except ValueError as err:
+                self.warning(err)
+        self.bot('Setting UDP game log reorder/duplicate window to %s seconds', reorder_window)
+
+        try:
+            return b3.tailer.getUdpTailer(self, url, secret=secret, sources=sources, reorder_window=reorder_window)
+        except (ValueError, socket.error) as e:
+            self.screen.write(">>> Cannot listen for UDP game log: %s\n" % e)
+            self.screen.flush()
+            self.critical("Cannot listen for UDP game log: %s", e)
+
+    def resumeLog(self):
+        """
+        Setup game log checkpointing and resume reading the game log from the last checkpoint.
+        Lines written while B3 was down are parsed in fast-forward mode (no chat output) unless the
+        checkpoint is older than the catch up window (log_catchup_window, in seconds: 0 means no limit).
+        """
+        path = self.config.getpath('server', 'log_checkpoint')
+        self._checkpoint = b3.tailer.LogCheckpoint(path)
+        self.bot('Game log checkpoint file: %s', path)
+
+        if self.config.has_option('server', 'log_checkpoint_interval'):
+            try:
+                self._checkpointInterval = max(1.0, self.config.getfloat('server', 'log_checkpoint_interval'))
+            except ValueError as err:
+                self.warning(err)
+        self.bot('Setting game log checkpoint interval to %s seconds', self._checkpointInterval)
+
+        window = 300
+        if self.config.has_option('server', 'log_catchup_window'):
+            try:
+                window = max(0, self.config.getint('server', 'log_catchup_window'))
+            except ValueError as err:
+                self.warning(err)
+        self.bot('Setting game log catch up window to %s seconds', window)
+
+        checkpoint = self._checkpoint.load()
+        if checkpoint is None:
+            self.bot('No game log checkpoint available')
+            return
+
+        age = time.time() - checkpoint['time']
+        if window and age > window:
+            self.bot('Game log checkpoint is too old (%d seconds): skipping the lines written in the meantime', age)
+            return
+
+        if not self.tailer.resume(checkpoint['inode'], checkpoint['offset']):
+            self.bot('Game log checkpoint does not match the game log file (rotated or truncated): ignoring it')
+            return
+
+        self._catchupEnd = self.tailer.size()
+        if self._catchupEnd > checkpoint['offset']:
+            self.bot('Resuming game log from checkpoint: catching up with %s bytes (chat output suppressed)',
+                     self._catchupEnd - checkpoint['offset'])
+            self._fastForward = True
+
+    def checkpointLog(self, force=False):
+        """
+        Store the game log read position if a checkpoint is due.
+        :param force: Store the read position regardless of the checkpoint interval
+        """
+        if not self._checkpoint or not self.tailer or not self.tailer.file:
+            return
+
+        now = time.time()
+        if not force and now < self._checkpointNext:
+            return
+
+        self._checkpointNext = now + self._checkpointInterval
+        try:
+            self._checkpoint.save(self.tailer.inode, self.tailer.tell())
+        except (IOError, OSError) as e:
+            self.warning('Could not save game log checkpoint: %s', e)
+
     def getAbsolutePath(self, path, decode=False):
         """
         Return an absolute path name and expand the user prefix (~)
         :param path: the relative path we want to expand
         """
-        return b3.getAbsolutePath(path, decode=decode)
+        return b3.getAbsolutePath(path, decode=decode, conf=self.config)
 
     def _dumpEventsStats(self):
         """
-        Dump event statistics into the B3 log file.
+        Dump event (and RCON queue) statistics into the B3 log file.
         """
         self._eventsStats.dumpStats()
+        if hasattr(self.output, 'dumpStats'):
+            self.output.dumpStats()
 
     def start(self):
         """
@@ -506,10 +776,19 @@ class Parser(object):
         self.cron.add(self._eventsStats_cronTab)
         self.bot("All plugins started")
         self.pluginsStarted()
-        self.bot("Starting event dispatching thread")
-        thread.start_new_thread(self.handleEvents, ())
-        self.bot("Start reading game events")
-        self.run()
+        if self._replay:
+            self.bot("Starting event dispatching thread")
+            thread.start_new_thread(self.handleEvents, ())
+            self.bot("Start replaying game events")
+            self.runReplay()
+        elif self._runtime:
+            self.bot("Start reading game events using the asyncio runtime")
+            self.runAsync()
+        else:
+            self.bot("Starting event dispatching thread")
+            thread.start_new_thread(self.handleEvents, ())
+            self.bot("Start reading game events")
+            self.run()
 
     def die(self):
         """
@@ -525,7 +804,6 @@ class Parser(object):
         Stop B3 with the restart exit status (221)
         """
         self.shutdown()
-        time.sleep(5)
         self.bot('Restarting...')
         self.exitcode = 221
 
@@ -580,7 +858,8 @@ class Parser(object):
         """
         self._paused = False
         self._pauseNotice = False
-        self.input.seek(0, os.SEEK_END)
+        if self.tailer:
+            self.tailer.seek(0, os.SEEK_END)
 
     def loadEvents(self):
         """
@@ -663,13 +942,13 @@ class Parser(object):
                 :param match: The plugin name
                 """
                 # first look in the built-in plugins directory
-                search = '%s%s*%s*' % (b3.getAbsolutePath('@conf\\', decode=True), os.path.sep, match)
+                search = '%s%s*%s*' % (b3.getAbsolutePath('@conf\\', decode=True, conf=self.config), os.path.sep, match)
                 self.debug('Searching for configuration file(s) matching: %s' % search)
                 collection = glob.glob(search)
                 if len(collection) > 0:
                     return collection
                 # if none is found, then search in the extplugins directory
-                search = '%s%s*%s*' % (os.path.join(b3.getAbsolutePath(extplugins_dir, decode=True), match, 'conf'), os.path.sep, match)
+                search = '%s%s*%s*' % (os.path.join(b3.getAbsolutePath(extplugins_dir, decode=True, conf=self.config), match, 'conf'), os.path.sep, match)
                 self.debug('Searching for configuration file(s) matching: %s' % search)
                 collection = glob.glob(search)
                 return collection
@@ -695,15 +974,15 @@ class Parser(object):
                 # if the load fails, an exception is raised and the plugin won't be loaded
                 self.warning('Using %s as configuration file for plugin %s', search_path[0], p_name)
                 self.bot('Loading configuration file %s for plugin %s', search_path[0], p_name)
-                return b3.config.load(search_path[0])
+                return b3.config.load(search_path[0], self.config)
             else:
                 # configuration file specified: load it if it's found. If we are not able to find the configuration
                 # file, then keep loading the plugin if such a plugin doesn't require a configuration file (optional)
                 # otherwise stop loading the plugin and loag an error message.
-                p_config_absolute_path = b3.getAbsolutePath(p_config_path, decode=True)
+                p_config_absolute_path = b3.getAbsolutePath(p_config_path, decode=True, conf=self.config)
                 if os.path.exists(p_config_absolute_path):
                     self.bot('Loading configuration file %s for plugin %s', p_config_absolute_path, p_name)
-                    return b3.config.load(p_config_absolute_path)
+                    return b3.config.load(p_config_absolute_path, self.config)
 
                 # notice missing configuration file
                 self.warning('Could not find specified configuration file %s for plugin %s', p_config_absolute_path, p_name)
@@ -1134,18 +1413,16 @@ class Parser(object):
 
         return cmd % kwargs
 
-    @Memoize
     def getGroup(self, data):
         """
-        Return a valid Group from storage.
+        Return a valid Group from the storage group registry (not memoized: the registry is refreshed on changes).
         <data> can be either a group keyword or a group level.
         Raises KeyError if group is not found.
         """
+        registry = self.storage.getGroupRegistry()
         if type(data) is int or isinstance(data, str) and data.isdigit():
-            g = Group(level=data)
-        else:
-            g = Group(keyword=data)
-        return self.storage.getGroup(g)
+            return registry.getByLevel(data)
+        return registry.getByKeyword(data)
 
     def getGroupLevel(self, data):
         """
@@ -1218,55 +1495,112 @@ class Parser(object):
         self.screen.flush()
         self.updateDocumentation()
 
-        log_time_start = None
-        log_time_last = 0
         while self.working:
             if self._paused:
                 if not self._pauseNotice:
                     self.bot('PAUSED - not parsing any lines: B3 will be out of sync')
                     self._pauseNotice = True
+                time.sleep(self.delay)
             else:
                 lines = self.read()
-                if lines:
-                    for line in lines:
-                        line = str(line).strip()
-                        if line and self._lineTime is not None:
-                            # Track the log file time changes. This is mostly for
-                            # parsing old log files for testing and to have time increase
-                            # predictably
-                            m = self._lineTime.match(line)
-                            if m:
-                                log_time_current = (int(m.group('minutes')) * 60) + int(m.group('seconds'))
-                                if log_time_start and log_time_current - log_time_start < log_time_last:
-                                    # Time in log has reset
-                                    log_time_start = log_time_current
-                                    log_time_last = 0
-                                    self.debug('log time reset %d' % log_time_current)
-                                elif not log_time_start:
-                                    log_time_start = log_time_current
-
-                                # Remove starting offset, we want the first line to be at 0 seconds
-                                log_time_current -= log_time_start
-                                self.logTime += log_time_current - log_time_last
-                                log_time_last = log_time_current
-
-                            self.console(line)
+                if not lines:
+                    # nothing new in the game log: sleep until the tailer reports new data
+                    self.tailer.wait(self._coalescer.timeout(self.delay) if self._coalescer else self.delay)
+                else:
+                    throttle = self.processLines(lines)
+                    if throttle > 0:
+                        time.sleep(throttle)
 
-                            try:
-                                self.parseLine(line)
-                            except SystemExit:
-                                raise
-                            except Exception as msg:
-                                self.error('Could not parse line %s: %s', msg, extract_tb(sys.exc_info()[2]))
-                            
-                            time.sleep(self.delay2)
+                if self._coalescer:
+                    self._coalescer.flush()
+
+                self.checkpointLog()
+
+        self.stopReading()
 
-            time.sleep(self.delay)
+    def runAsync(self):
+        """
+        Main worker for B3 when the asyncio runtime is enabled: the game log reading, the event
+        dispatching and the cron scheduler are all driven by the runtime event loop.
+        """
+        self.screen.write('Startup complete : B3 is running! Let\'s get to work!\n\n')
+        self.screen.write('If you run into problems check your B3 log file for more information\n')
+        self.screen.flush()
+        self.updateDocumentation()
+        self._runtime.run()
+        self.stopReading()
 
+    def runReplay(self):
+        """
+        Main worker for B3 when replaying a recorded game log: once the whole log has been parsed B3 shuts down.
+        """
+        self.screen.write('Startup complete : B3 is replaying the game log\n\n')
+        self.screen.flush()
+        self._replay.run()
+        self._dumpEventsStats()
+        self.shutdown()
+        self.stopReading()
+
+    def processLines(self, lines):
+        """
+        Parse a batch of game log lines.
+        :param lines: The lines read from the game log
+        :return: The amount of seconds to wait before reading the next batch (lines_per_second throttling)
+        """
+        batch_start = time.time()
+        for line in lines:
+            line = str(line).strip()
+            if line and self._lineTime is not None:
+                # Track the log file time changes. This is mostly for
+                # parsing old log files for testing and to have time increase
+                # predictably
+                m = self._lineTime.match(line)
+                if m:
+                    log_time_current = (int(m.group('minutes')) * 60) + int(m.group('seconds'))
+                    if self._logTimeStart and log_time_current - self._logTimeStart < self._logTimeLast:
+                        # Time in log has reset
+                        self._logTimeStart = log_time_current
+                        self._logTimeLast = 0
+                        self.debug('log time reset %d' % log_time_current)
+                    elif not self._logTimeStart:
+                        self._logTimeStart = log_time_current
+
+                    # Remove starting offset, we want the first line to be at 0 seconds
+                    log_time_current -= self._logTimeStart
+                    self.logTime += log_time_current - self._logTimeLast
+                    self._logTimeLast = log_time_current
+                    if self.clock:
+                        # replaying a game log: simulated time follows the game log time
+                        self.clock.advance(self.logTime)
+
+                self.console(line)
+
+                try:
+                    self.parseLine(line)
+                except SystemExit:
+                    raise
+                except Exception as msg:
+                    self.error('Could not parse line %s: %s', msg, extract_tb(sys.exc_info()[2]))
+
+        if self._fastForward and self.tailer.tell() >= self._catchupEnd:
+            self._fastForward = False
+            self.bot('Caught up with the game log: chat output enabled')
+
+        if self.delay2:
+            # lines_per_second is configured: throttle the whole batch instead of every single line
+            return len(lines) * self.delay2 - (time.time() - batch_start)
+        return 0
+
+    def stopReading(self):
+        """
+        Release the game log and the output once the main loop is over.
+        """
         self.bot('Stop reading')
 
         with self.exiting:
-            self.input.close()
+            if self.tailer:
+                self.checkpointLog(force=True)
+                self.tailer.close()
             self.output.close()
 
             if self.exitcode:
@@ -1301,36 +1635,72 @@ class Parser(object):
 
     def queueEvent(self, event, expire=10):
         """
-        QueEvents.gevent for processing.
+        Queue an event for processing.
+        Events are dispatched in the same order they are queued: the event queue is consumed by a single
+        thread (handleEvents) so there is no need to space out producers. When the queue is full the event is
+        either dropped or made room for according to its queue policy and priority.
+        Damage events are merged into aggregated damage events first if damage_coalesce_window is configured.
         """
         if not hasattr(event, 'type'):
             return False
+
+        cache = getattr(self.output, 'cache', None)
+        if cache is not None:
+            # drop the cached rcon replies made stale by this event (i.e. the map name on map change)
+            cache.onEvent(event)
+
+        if self._coalescer and self._coalescer.feed(event) and event.type not in self._handlers:
+            # merged into an aggregated damage event and nobody listens for the raw one
+            return True
         elif event.type in self._handlers:  # queue only if there are handlers to listen for this event
             self.verbose('Queueing event %s : %s', self.getEventName(event.type), event.data)
+            # never wait for room from the asyncio event loop: it is the one emptying the queue
+            block = not (self._runtime and self._runtime.inLoop())
             try:
-                time.sleep(0.001)  # wait a bit so event doesnt get jumbled
-                self.queue.put((self.time(), self.time() + expire, event), True, 2)
-                return True
+                # False means the event has been dropped by its queue policy (already accounted in stats)
+                return self.queue.put((time.time(), self.time() + expire, event), block, 2)
             except Queue.Full:
                 self.error('**** Event queue was full (%s)', self.queue.qsize())
+                self._eventsStats.add_event_dropped(self.getEventName(event.type))
                 return False
 
         return False
 
+    def checkEvent(self, added, expire, event):
+        """
+        Account an event taken out of the event queue and check whether it must be dispatched.
+        :param added: When the event was queued
+        :param expire: The event expire time
+        :param event: The event
+        :return: The event, or None if it expired
+        """
+        if event.type == self.getEventID('EVT_EXIT') or event.type == self.getEventID('EVT_STOP'):
+            self.working = False
+
+        self._eventsStats.add_event_wait((time.time() - added) * 1000)
+        if self.time() >= expire:  # events can only sit in the queue until expire time
+            event_name = self.getEventName(event.type)
+            self.error('**** Event sat in queue too long: %s %s', event_name, self.time() - expire)
+            self._eventsStats.add_event_expired(event_name)
+            return None
+        return event
+
     def handleEvents(self):
         """
         Event handler thread.
         """
         while self.working:
-            added, expire, event = self.queue.get(True)
-            if event.type == self.getEventID('EVT_EXIT') or event.type == self.getEventID('EVT_STOP'):
-                self.working = False
-
-            event_name = self.getEventName(event.type)
-            self._eventsStats.add_event_wait((self.time() - added)*1000)
-            if self.time() >= expire:  # events can only sit in the queue until expire time
-                self.error('**** Event sat in queue too long: %s %s', event_name, self.time() - expire)
+            try:
+                # wake up now and then: B3 may be shut down from another thread while the queue is empty
+                added, expire, event = self.queue.get(True, 1)
+            except Queue.Empty:
+                continue
+            if self.checkEvent(added, expire, event) is None:
+                continue
+            elif self._dispatcher:
+                self._dispatcher.dispatch(event, expire)
             else:
+                event_name = self.getEventName(event.type)
                 nomore = False
                 for hfunc in self._handlers[event.type]:
                     if not hfunc.isEnabled():
@@ -1342,7 +1712,6 @@ class Parser(object):
                     timer_plugin_begin = time.perf_counter()
                     try:
                         hfunc.parseEvent(event)
-                        time.sleep(0.001)
                     except b3.events.VetoEvent:
                         # plugin called for event hault, do not continue processing
                         self.bot('Event %s vetoed by %s', event_name, str(hfunc))
@@ -1358,10 +1727,39 @@ class Parser(object):
                     
         self.bot('Shutting down event handler')
 
+        if self._dispatcher:
+            self.bot('Stopping plugin dispatch workers')
+            self._dispatcher.stop()
+
         # releasing lock if it was set by self.shutdown() for instance
         if self.exiting.locked():
             self.exiting.release()
 
+    def callLater(self, delay, func, *args):
+        """
+        Execute a function after the given delay without blocking the caller.
+        :param delay: The amount of seconds to wait
+        :param func: The function to execute
+        """
+        if self.clock:
+            self.clock.callLater(delay, func, *args)
+        elif self._runtime:
+            self._runtime.callLater(delay, func, *args)
+        else:
+            threading.Timer(delay, func, args).start()
+
+    def runInBackground(self, func, *args):
+        """
+        Execute a (possibly blocking) function without blocking the caller.
+        :param func: The function to execute
+        """
+        if self._runtime:
+            self._runtime.submit(func, *args)
+        else:
+            t = threading.Thread(target=func, args=args)
+            t.daemon = True  # won't prevent B3 from exiting
+            t.start()
+
     def write(self, msg, maxRetries=None, socketTimeout=None):
         """
         Write a message to Rcon/Console
@@ -1376,45 +1774,25 @@ class Parser(object):
         Write a sequence of messages to Rcon/Console. Optimized for speed.
         :param msg: The message to be sent to Rcon/Console.
         """
+        if self._fastForward:
+            # catching up with the game log: do not answer old chat lines
+            self.verbose('Fast-forwarding game log: dropping %r', msg)
+            return None
         if self.output and msg:
             res = self.output.writelines(msg)
             self.output.flush()
             return res
 
-    def __read_input(self, game_log):
-        """
-        Read lines from the log file
-        :param game_log: The gamelog file pointer
-        """
-        return game_log.readlines()
-
-    def ___read_input_darwin(self, game_log):
-        """
-        Read lines from the log file (darwin version)
-        :param game_log: The gamelog file pointer
-        """
-        return [game_log.readline()]
-
     def read(self):
         """
-        Read from game server log file
+        Read from game server log file: return the batch of lines appended since the last call.
+        Log rotation and truncation are handled by the tailer.
         """
-        if not hasattr(self, 'input'):
+        if not self.tailer:
             self.critical("Cannot read game log file: check that you have a correct "
                           "value for the 'game_log' setting in your main config file")
 
-        # Getting the stats of the game log (we are looking for the size)
-        filestats = os.fstat(self.input.fileno())
-        # Compare the current cursor position against the current file size,
-        # if the cursor is at a number higher than the game log size, then
-        # there's a problem
-        if self.input.tell() > filestats.st_size:   
-            self.debug('Parser: game log is suddenly smaller than it was before (%s bytes, now %s), '
-                       'the log was probably either rotated or emptied. B3 will now re-adjust to the new '
-                       'size of the log' % (str(self.input.tell()), str(filestats.st_size)))
-            self.input.seek(0, os.SEEK_END)
-        # NOTE: __read is defined at runtime in __new__
-        return self.__read(self.input)
+        return self.tailer.read()
 
     def shutdown(self):
         """
@@ -1429,7 +1807,8 @@ class Parser(object):
                 if self._cron:
                     self.bot('Stopping cron')
                     self._cron.stop()
-                if self.storage:
+                if self.storage and not self.supervisor:
+                    # a shared storage is closed by the supervisor once all the game servers stopped
                     self.bot('Shutting down database connection')
                     self.storage.shutdown()
         except Exception as e:
@@ -1573,11 +1952,12 @@ class Parser(object):
         self.exitcode = 220
         raise SystemExit(self.exitcode)
 
-    @staticmethod
-    def time():
+    def time(self):
         """
-        Return the current time in GMT/UTC.
+        Return the current time in GMT/UTC (the simulated time when replaying a game log).
         """
+        if self.clock:
+            return int(self.clock.time())
         return int(time.time())
 
     def _get_cron(self):
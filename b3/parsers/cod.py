@@ -23,7 +23,7 @@
 # ################################################################### #
 
 __author__ = 'ThorN, xlr8or'
-__version__ = '1.5.3'
+__version__ = '1.5.4'
 
 
 import b3
@@ -555,6 +555,8 @@ class CodParser(AbstractParser):
         Return the client matchign the given slot number.
         :param ccid: The client slot number
         """
+        # the connecting client may not be in the server snapshot yet
+        self.invalidateSnapshot()
         players = self.getPlayerList()
         self.verbose('connectClient() = %s' % players)
         for cid, p in players.items():
@@ -73,7 +73,7 @@
 # 02/06/2017 - 0.17   - GrosBedo     - fix /tell message command (works only on ioq3 or e+ mod, but anyway most servers are running these)
 
 __author__ = 'Courgette, GrosBedo, Fenix'
-__version__ = '0.17'
+__version__ = '0.20'
 
 import b3
 import b3.clients
@@ -340,14 +340,9 @@ class Q3Parser(AbstractParser):
         Parse a log line returning extracted tokens.
         :param line: The line to be parsed
         """
-        line = re.sub(self._lineClear, '', line, 1)
-        m = None
-        for f in self._lineFormats:
-            m = re.match(f, line)
-            if m:
-                self.debug('XLR--------> line matched %s' % f.pattern)
-                break
+        m, f, line = self.getLineClassifier().match(line)
         if m:
+            self.debug('XLR--------> line matched %s', f.pattern)
             client = None
             target = None
             try:
@@ -685,6 +680,8 @@ class Q3Parser(AbstractParser):
         return gametype
 
     def connectClient(self, ccid):
+        # the connecting client may not be in the server snapshot yet
+        self.invalidateSnapshot()
         players = self.getPlayerList()
         self.verbose('connectClient() = %s' % players)
         for cid, p in players.items():
@@ -904,27 +901,6 @@ class Q3Parser(AbstractParser):
                 if not silent and fullreason != '':
                     self.say(fullreason)
 
-    def getPlayerPings(self, filter_client_ids=None):
-        """
-        Returns a dict having players' id for keys and players' ping for values.
-        :param filter_client_ids: If filter_client_id is an iterable, only return values for the given client ids.
-        """
-        data = self.write('status')
-        if not data:
-            return {}
-
-        players = {}
-        for line in data.split('\n'):
-            m = re.match(self._regPlayer, line.strip())
-            if m:
-                if m.group('ping') == 'ZMBI':
-                    # ignore them, let them not bother us with errors
-                    pass
-                else:
-                    players[str(m.group('slot'))] = int(m.group('ping'))
-
-        return players
-
     def sync(self):
         """
         For all connected players returned by self.get_player_list(), get the matching Client
@@ -23,7 +23,7 @@
 # ################################################################### #
 
 __author__ = 'ThorN, xlr8or'
-__version__ = '1.8.1'
+__version__ = '1.13'
 
 
 import re
@@ -35,8 +35,10 @@ import b3.clients
 import b3.functions
 import b3.parser
 import b3.cvar
+import b3.snapshot
 
 from b3.parsers.q3a import rcon
+from b3.parsers.q3a.classifier import LineClassifier
 from b3.parsers.punkbuster import PunkBuster
 from b3.functions import prefixText
 
@@ -50,8 +52,13 @@ class AbstractParser(b3.parser.Parser):
     rconTest = True
     OutputClass = rcon.Rcon
     PunkBuster = None
+    _snapshot = None  # server snapshot service (False when disabled)
 
     _clientConnectID = None
+    _dispatchTable = None
+    _dispatchTableMaxSize = 1024
+    _lineClassifier = None
+    _lineHandlers = None
     _logSync = 2
 
     _commands = {
@@ -176,18 +183,29 @@ class AbstractParser(b3.parser.Parser):
     #                                                                                                                  #
     ####################################################################################################################
 
+    def getLineClassifier(self):
+        """
+        Return the classifier matching log lines against the parser line formats.
+        The classifier is rebuilt if _lineFormats or _lineClear have been replaced.
+        """
+        classifier = self._lineClassifier
+        if classifier is None or classifier.lineFormats is not self._lineFormats or \
+                classifier.lineClear is not self._lineClear:
+            classifier = self._lineClassifier = LineClassifier(self._lineClear, self._lineFormats)
+        return classifier
+
+    def getLineFilter(self):
+        """
+        Return a function telling whether a raw (undecoded) game log line may match one of the line formats.
+        """
+        return self.getLineClassifier().getBytesFilter()
+
     def getLineParts(self, line):
         """
         Parse a log line returning extracted tokens.
         :param line: The line to be parsed
         """
-        line = re.sub(self._lineClear, '', line, 1)
-        m = None
-        for f in self._lineFormats:
-            m = re.match(f, line)
-            if m:
-                #self.debug('line matched %s' % f.pattern)
-                break
+        m, f, line = self.getLineClassifier().match(line)
         if m:
             client = None
             target = None
@@ -195,6 +213,56 @@ class AbstractParser(b3.parser.Parser):
         elif '------' not in line:
             self.verbose('Line did not match format: %s' % line)
 
+    def registerLineHandler(self, action, handler):
+        """
+        Register a fast handler for the given log line action: the handler takes precedence over the On* method
+        and the _eventMap entry matching the action. The handler is called as handler(action, data, match) and
+        returns the event to be queued (or None).
+        :param action: The action as returned by getLineParts (lowercase)
+        :param handler: The callable handling the action
+        """
+        if self._lineHandlers is None:
+            self._lineHandlers = {}
+        self._lineHandlers[action] = handler
+        if self._dispatchTable is not None:
+            self._dispatchTable[action] = (handler, None)
+
+    def _resolveAction(self, action):
+        """
+        Return the dispatch table entry for the given action: a tuple (handler, event id).
+        The lookup order is the one B3 always used: On* method first, then _eventMap, then EVT_UNKNOWN (None, None).
+        :param action: The action as returned by getLineParts
+        """
+        if self._lineHandlers and action in self._lineHandlers:
+            return self._lineHandlers[action], None
+        func = getattr(self, 'On%s' % string.capwords(action).replace(' ', ''), None)
+        if func is not None:
+            return func, None
+        if action in self._eventMap:
+            return None, self._eventMap[action]
+        return None, None
+
+    def buildDispatchTable(self):
+        """
+        Precompute the mapping between log line actions and their handlers, so that parseLine needs a single
+        dict lookup per line. The table covers all the On* methods, the _eventMap entries and the handlers
+        registered with registerLineHandler. Actions not known in advance are resolved on first sight and cached.
+        Call this again if _eventMap or the On* methods are changed after the parser started to parse lines.
+        """
+        table = {}
+        for action in list(self._eventMap.keys()):
+            table[action] = self._resolveAction(action)
+        for name in dir(self.__class__):
+            if name.startswith('On') and len(name) > 2:
+                action = name[2:].lower()
+                if 'On%s' % string.capwords(action).replace(' ', '') == name:
+                    table[action] = self._resolveAction(action)
+        for action in list((self._lineHandlers or {}).keys()):
+            table[action] = self._resolveAction(action)
+        self._dispatchTable = table
+        self.debug('Log line dispatch table built: %s actions', len(table))
+        return table
+
     def parseLine(self, line):
         """
         Parse a log line creating necessary events.
@@ -205,15 +273,23 @@ class AbstractParser(b3.parser.Parser):
             return False
 
         match, action, data, client, target = m
-        func = 'On%s' % string.capwords(action).replace(' ', '')
-        
-        if hasattr(self, func):
-            func = getattr(self, func)
+        table = self._dispatchTable
+        if table is None:
+            table = self.buildDispatchTable()
+
+        try:
+            func, event_id = table[action]
+        except KeyError:
+            func, event_id = self._resolveAction(action)
+            if len(table) < self._dispatchTableMaxSize:
+                table[action] = (func, event_id)
+
+        if func:
             event = func(action, data, match)
             if event:
                 self.queueEvent(event)
-        elif action in self._eventMap:
-            self.queueEvent(self.getEvent(self._eventMap[action], data=data, client=client, target=target))
+        elif event_id is not None:
+            self.queueEvent(self.getEvent(event_id, data=data, client=client, target=target))
 
         else:
             data = str(action) + ': ' + str(data)
@@ -664,46 +740,107 @@ class AbstractParser(b3.parser.Parser):
         time.sleep(1)
         self.write('map %s' % mapname)
 
-    def getPlayerPings(self, filter_client_ids=None):
+    def getSnapshot(self):
         """
-        Returns a dict having players' id for keys and players' ping for values.
-        :param filter_client_ids: If filter_client_id is an iterable, only return values for the given client ids.
+        Return the server snapshot service, or None if it's disabled (status_interval not set in the
+        server section): in that case every call to getPlayerList, getPlayerScores and getPlayerPings
+        queries the game server.
         """
-        data = self.write('status')
+        if self._snapshot is None:
+            self._snapshot = False
+            if self.config.has_option('server', 'status_interval'):
+                try:
+                    interval = self.config.getint('server', 'status_interval')
+                except ValueError as err:
+                    self.warning(err)
+                else:
+                    if interval > 0:
+                        self.bot('Polling the game server status every %s seconds', interval)
+                        self._snapshot = b3.snapshot.ServerSnapshot(self, self.readStatus, interval)
+                        self._snapshot.start()
+        return self._snapshot or None
+
+    def invalidateSnapshot(self):
+        """
+        Make the next status read query the game server, if the server snapshot is enabled.
+        """
+        if self._snapshot:
+            self._snapshot.invalidate()
+
+    def queueEvent(self, event, expire=10):
+        """
+        Queue an event for processing: a client connection makes the server snapshot out of date.
+        """
+        if self._snapshot and getattr(event, 'type', None) == self.getEventID('EVT_CLIENT_CONNECT'):
+            self._snapshot.invalidate()
+        return b3.parser.Parser.queueEvent(self, event, expire)
+
+    def shutdown(self):
+        """
+        Shutdown B3: stop polling the game server status.
+        """
+        if self._snapshot:
+            self._snapshot.stop()
+        b3.parser.Parser.shutdown(self)
+
+    def readStatus(self, maxRetries=None):
+        """
+        Query the game server status and parse the connected players.
+        :param maxRetries: How many times the query has to be retried upon failure
+        :return: A dict mapping slots to player rows (regular expression groups) or None if there was no reply
+        """
+        data = self.write('status', maxRetries=maxRetries)
         if not data:
-            return {}
+            return None
 
         players = {}
+        lastslot = -1
         for line in data.split('\n'):
-            m = re.match(self._regPlayerShort, line)
-            if not m:
-                m = re.match(self._regPlayer, line.strip())
-            
+            m = self._regPlayer.match(line.strip()) or self._regPlayerShort.match(line)
             if m:
-                players[str(m.group('slot'))] = int(m.group('ping'))
-        
+                if int(m.group('slot')) > lastslot:
+                    lastslot = int(m.group('slot'))
+                    d = m.groupdict()
+                    d['pbid'] = None
+                    players[str(m.group('slot'))] = d
+                else:
+                    self.debug('Duplicate or incorrect slot number - '
+                               'client ignored %s last slot %s' % (m.group('slot'), lastslot))
+        return players
+
+    def getStatusPlayers(self, maxRetries=None):
+        """
+        Return the players connected to the game server: from the server snapshot if enabled,
+        from a fresh status query otherwise.
+        :param maxRetries: How many times the query has to be retried upon failure
+        """
+        snapshot = self.getSnapshot()
+        if snapshot:
+            return snapshot.get(maxRetries)
+        return self.readStatus(maxRetries) or {}
+
+    def getPlayerPings(self, filter_client_ids=None):
+        """
+        Returns a dict having players' id for keys and players' ping for values.
+        :param filter_client_ids: If filter_client_id is an iterable, only return values for the given client ids.
+        """
+        players = {}
+        for slot, d in self.getStatusPlayers().items():
+            if d['ping'].isdigit():
+                # zombie connections (ZMBI, CNCT) have no ping yet
+                players[slot] = int(d['ping'])
         return players
         
     def getPlayerScores(self):
         """
         Returns a dict having players' id for keys and players' scores for values.
         """
-        data = self.write('status')
-        if not data:
-            return {}
-
         players = {}
-        for line in data.split('\n'):
-            #self.debug('Line: ' + line + "-")
-            m = re.match(self._regPlayerShort, line)
-            if not m:
-                m = re.match(self._regPlayer, line.strip())
-            
-            if m:  
-                players[str(m.group('slot'))] = int(m.group('score'))
-            #elif '------' not in line and 'map: ' not in line and 'num score ping' not in line:
-                #self.verbose('getPlayerScores() = Line did not match format: %s' % line)
-        
+        for slot, d in self.getStatusPlayers().items():
+            try:
+                players[slot] = int(d['score'])
+            except ValueError:
+                pass
         return players
 
     def getPlayerList(self, maxRetries=None):
@@ -713,27 +850,9 @@ class AbstractParser(b3.parser.Parser):
         """
         if self.PunkBuster:
             return self.PunkBuster.getPlayerList()
-        else:
-            data = self.write('status', maxRetries=maxRetries)
-            if not data:
-                return {}
-
-            players = {}
-            lastslot = -1
-            for line in data.split('\n')[3:]:
-                m = re.match(self._regPlayer, line.strip())
-                if m:
-                    d = m.groupdict()
-                    if int(m.group('slot')) > lastslot:
-                        lastslot = int(m.group('slot'))
-                        d['pbid'] = None
-                        players[str(m.group('slot'))] = d
-                        
-                    else:
-                        self.debug('Duplicate or incorrect slot number - '
-                                   'client ignored %s last slot %s' % (m.group('slot'), lastslot))
-
-        return players
+        # rows matched by _regPlayerShort only (no guid, no ip) are not reported
+        groups = set(self._regPlayer.groupindex)
+        return dict((slot, dict(d)) for slot, d in self.getStatusPlayers(maxRetries).items() if groups.issubset(d))
 
     def getCvar(self, cvar_name):
         """
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.1'
+
+import re
+
+
+class LineClassifier(object):
+    """
+    Match game log lines against a parser _lineFormats list in a single pass.
+
+    Every line format starting with ^(?P<action>...) followed by a ':' or ';' separator can only match
+    lines whose leading word (the action token) is accepted by the action sub-pattern. The classifier
+    extracts the action token once, then tries only the line formats which can accept it, in their original
+    order: the first matching format is the same one the linear scan over _lineFormats would have returned.
+    The list of candidate formats is computed once per action token and cached.
+    Line formats which do not follow this layout are always tried, so no line is ever misclassified.
+    """
+    # ^(?P<action>SUBPATTERN)SEPARATOR
+    _reActionPrefix = re.compile(r'^\^\(\?P<action>(?P<sub>[^()]+)\)(?P<sep>[:;])')
+    # action sub-patterns matching word characters only (character classes, \w, literals and quantifiers)
+    _reWordOnly = re.compile(r'^(?:(?:\[[\w\-]+\]|\\w|\w)(?:[+*?]|\{[0-9]+(?:,[0-9]*)?\})?)+$')
+    # leading word of a line and the character following it
+    _reToken = re.compile(r'(\w*)(.?)', re.DOTALL)
+
+    def __init__(self, lineClear, lineFormats, maxcache=1024):
+        """
+        Object constructor.
+        :param lineClear: The regular expression matching the prefix to strip from every line (timestamp)
+        :param lineFormats: The ordered list of line formats
+        :param maxcache: The maximum number of action tokens to cache
+        """
+        self.lineClear = lineClear
+        self.lineFormats = lineFormats
+        self._maxcache = maxcache
+        self._anchored = lineClear.pattern.startswith('^')
+        self._cache = {}
+        self._bytesFilter = None
+        self._probes = []
+        for f in lineFormats:
+            m = self._reActionPrefix.match(f.pattern)
+            if m and self._reWordOnly.match(m.group('sub')):
+                probe = re.compile(r'(?:%s)\Z' % m.group('sub'), f.flags)
+                self._probes.append((f, probe, m.group('sep')))
+            else:
+                # we can't tell which actions this format accepts: always try it
+                self._probes.append((f, None, None))
+
+    def candidates(self, token, sep):
+        """
+        Return the ordered list of line formats which may match a line starting with the given token.
+        :param token: The action token (leading word of the line)
+        :param sep: The character following the action token
+        """
+        key = token + sep
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        formats = tuple(f for f, probe, s in self._probes if probe is None or (sep == s and probe.match(token)))
+        if len(self._cache) < self._maxcache:
+            self._cache[key] = formats
+        return formats
+
+    def getBytesFilter(self):
+        """
+        Return a function telling whether a raw (undecoded) log line may match one of the line formats, or None
+        if raw lines can't be filtered (every line must be decoded and matched). The filter is conservative: it
+        never rejects a line which would have been matched once decoded, so that bulk readers can skip decoding
+        the lines nobody is interested in. Lines containing non ASCII characters right after the action token
+        are always accepted (the decoded line decides).
+        """
+        if self._bytesFilter is None:
+            self._bytesFilter = False
+            flags = set(f.flags & ~re.UNICODE for f, probe, sep in self._probes)
+            if self._anchored and len(flags) == 1 and all(probe is not None for f, probe, sep in self._probes):
+                # ^\s*(?:CLEAR)(?:(?:SUB1)SEP1|(?:SUB2)SEP2|...|\w*NONASCII): the action sub-patterns only match
+                # word characters, so SUB followed by SEP matches exactly the action token extracted by match()
+                actions = ['(?:%s)%s' % (self._reActionPrefix.match(f.pattern).group('sub'), re.escape(sep))
+                           for f, probe, sep in self._probes]
+                actions.append(r'\w*[\x80-\xff]')
+                pattern = r'\s*(?:%s)(?:%s)' % (self.lineClear.pattern[1:], '|'.join(actions))
+                try:
+                    self._bytesFilter = re.compile(pattern.encode('ascii'), flags.pop()).match
+                except (UnicodeError, re.error):
+                    pass
+
+        return self._bytesFilter or None
+
+    def clear(self, line):
+        """
+        Strip the prefix matched by lineClear from the given line.
+        :param line: The log line
+        """
+        if self._anchored:
+            m = self.lineClear.match(line)
+            return line[m.end():] if m else line
+        return self.lineClear.sub('', line, 1)
+
+    def match(self, line):
+        """
+        Match a line against the line formats.
+        :param line: The log line (timestamp included)
+        :return: A tuple (match, line format, cleared line): match and line format are None if no format matched
+        """
+        line = self.clear(line)
+        token, sep = self._reToken.match(line).groups()
+        for f in self.candidates(token, sep):
+            m = f.match(line)
+            if m:
+                return m, f, line
+        return None, None, line
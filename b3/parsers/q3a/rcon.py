@@ -23,8 +23,10 @@
 # ################################################################### #
 #
 __author__ = 'ThorN'
-__version__ = '1.11'
+__version__ = '1.18'
 
+import asyncio
+import collections
 import re
 import socket
 import select
@@ -34,16 +36,408 @@ try:
 except ImportError:
     import _thread as thread
 import threading
-try:
-    import Queue
-except ImportError:
-    import queue as Queue
+
+import b3.runtime
+
+PRIORITY_PENALTY = 0
+PRIORITY_QUERY = 1
+PRIORITY_CHAT = 2
+
+PRIORITY_NAMES = {PRIORITY_PENALTY: 'penalty', PRIORITY_QUERY: 'query', PRIORITY_CHAT: 'chat'}
+
+# commands sorted in the penalty and chat classes (every other command is a query)
+PENALTY_COMMANDS = frozenset(('kick', 'clientkick', 'clientkick_for_reason', 'kickall', 'ban', 'banid', 'banaddr',
+                              'banclient', 'banuser', 'addip', 'tempban', 'tempbanclient', 'tempbanuser', 'permban',
+                              'onlykick', 'mute', 'slap', 'nuke', 'forceteam'))
+CHAT_COMMANDS = frozenset(('say', 'tell', 'bigtext', 'sm', 'cp', 'saybig', 'screensay', 'screentell', 'sayraw',
+                           'tellraw'))
+
+# commands changing the value of the cvar given as first argument
+SET_COMMANDS = frozenset(('set', 'seta', 'sets', 'setu'))
+# commands loading another map
+MAP_COMMANDS = frozenset(('map', 'devmap', 'map_rotate', 'map_restart', 'fast_restart'))
+
+# cached replies dropped when these events are queued (or when a map command is sent)
+MAP_CACHE_KEYS = ('status', 'pb_sv_plist', 'mapname', 'sv_maprotation', 'sv_maprotationcurrent', 'g_nextmap',
+                  'nextmap', 'g_gametype')
+DEFAULT_CACHE_INVALIDATION = {
+    'EVT_GAME_MAP_CHANGE': MAP_CACHE_KEYS,
+    'EVT_CLIENT_CONNECT': ('status', 'pb_sv_plist'),
+    'EVT_CLIENT_DISCONNECT': ('status', 'pb_sv_plist'),
+}
+
+
+class ResponseCache(object):
+    """
+    Read-through cache for RCON queries.
+
+    Replies are cached by command for the amount of seconds configured for the command name (the first word
+    of the command: i.e. status, mapname or sv_maprotation for cvar queries). Cached replies are dropped when
+    they expire, when a command changing them is sent (setting a cvar, loading a map) or when one of the
+    events they depend on is queued by the parser.
+    """
+    def __init__(self, console, ttls, invalidation=None):
+        """
+        Object constructor.
+        :param console: The console implementation
+        :param ttls: A dict mapping command names to the amount of seconds their reply is cached
+        :param invalidation: A dict mapping event keys to the command names to drop from the cache
+        """
+        self.console = console
+        self.ttls = dict((k.lower(), v) for k, v in ttls.items() if v > 0)
+        self._events = {}
+        for key, names in (invalidation or {}).items():
+            event_id = console.getEventID(key)
+            if event_id is not None:
+                self._events[event_id] = frozenset(x.lower() for x in names)
+        self._entries = {}
+        self._stats = {}  # command name => [hits, misses]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def getName(cmd):
+        """
+        Return the command name (first word, lowercase) of an RCON command.
+        :param cmd: The RCON command
+        """
+        return cmd.split(None, 1)[0].lower() if cmd.strip() else ''
+
+    def getTTL(self, cmd):
+        """
+        Return the amount of seconds the reply to the given command is cached (0 if not cached).
+        :param cmd: The RCON command
+        """
+        return self.ttls.get(self.getName(cmd), 0) if self.ttls else 0
+
+    def get(self, cmd, count=True):
+        """
+        Return the cached reply to the given command or None if it's not cached (or expired).
+        :param cmd: The RCON command
+        :param count: Whether to account the lookup in the hit/miss statistics
+        """
+        key = cmd.strip()
+        name = self.getName(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                entry = None
+            if count:
+                stats = self._stats.setdefault(name, [0, 0])
+                stats[0 if entry is not None else 1] += 1
+        return entry[1] if entry is not None else None
+
+    def set(self, cmd, data):
+        """
+        Cache the reply to the given command.
+        :param cmd: The RCON command
+        :param data: The reply
+        """
+        ttl = self.getTTL(cmd)
+        if ttl and data:
+            with self._lock:
+                self._entries[cmd.strip()] = (time.time() + ttl, data)
+
+    def invalidate(self, names):
+        """
+        Drop the cached replies to the given commands.
+        :param names: The command names
+        """
+        with self._lock:
+            for key in [k for k in self._entries if self.getName(k) in names]:
+                del self._entries[key]
+
+    def onCommand(self, cmd):
+        """
+        Drop the cached replies made stale by the given command.
+        :param cmd: The RCON command about to be sent
+        """
+        name = self.getName(cmd)
+        if name in SET_COMMANDS:
+            parts = cmd.split(None, 2)
+            if len(parts) > 1:
+                self.invalidate((parts[1].lower(),))
+        elif name in MAP_COMMANDS:
+            self.invalidate(MAP_CACHE_KEYS)
+
+    def onEvent(self, event):
+        """
+        Drop the cached replies depending on the given event.
+        :param event: The event queued by the parser
+        """
+        names = self._events.get(event.type)
+        if names and self._entries:
+            self.invalidate(names)
+
+    def getStats(self):
+        """
+        Return the cache statistics.
+        :return: A dict mapping command names to tuples (hits, misses)
+        """
+        with self._lock:
+            return dict((k, tuple(v)) for k, v in self._stats.items())
+
+    def dumpStats(self):
+        """
+        Log the cache statistics.
+        """
+        for name, (hits, misses) in sorted(self.getStats().items()):
+            self.console.verbose('RCON cache %s: %s hits, %s misses (%0.1f%%)', name, hits, misses,
+                                 hits * 100.0 / (hits + misses) if hits + misses else 0)
+
+
+class LatencyStats(object):
+    """
+    RCON round trip time instrumentation.
+
+    For every command name the time between sending the command and receiving the first reply packet (RTT) is
+    recorded in a histogram, along with the most recent samples used to compute percentiles. The delays between
+    the packets of multi-packet replies are recorded as well: they tell how long to wait for the next packet
+    once a reply started coming in.
+    """
+    buckets = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)  # histogram upper bounds (in seconds)
+    samples = 200  # how many recent samples are kept to compute percentiles
+
+    def __init__(self):
+        self._histograms = {}  # command name => counts (one per bucket plus one for larger values)
+        self._recent = {}  # command name => recent RTT samples
+        self._rtts = collections.deque(maxlen=self.samples)
+        self._gaps = collections.deque(maxlen=self.samples)
+        self._lock = threading.Lock()
+
+    def add(self, name, rtt, gaps=()):
+        """
+        Record a reply.
+        :param name: The command name
+        :param rtt: The amount of seconds elapsed before the first reply packet came in
+        :param gaps: The amount of seconds elapsed between the following reply packets
+        """
+        with self._lock:
+            counts = self._histograms.get(name)
+            if counts is None:
+                counts = self._histograms[name] = [0] * (len(self.buckets) + 1)
+                self._recent[name] = collections.deque(maxlen=self.samples)
+            index = 0
+            while index < len(self.buckets) and rtt > self.buckets[index]:
+                index += 1
+            counts[index] += 1
+            self._recent[name].append(rtt)
+            self._rtts.append(rtt)
+            self._gaps.extend(gaps)
+
+    @staticmethod
+    def _percentile(samples, pct):
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+    def getPercentile(self, pct, name=None, minsamples=20):
+        """
+        Return a RTT percentile (in seconds) or None if not enough replies have been recorded.
+        :param pct: The percentile (0-100)
+        :param name: The command name (None for all the commands)
+        :param minsamples: The minimum amount of samples needed
+        """
+        with self._lock:
+            samples = self._rtts if name is None else self._recent.get(name, ())
+            if len(samples) < minsamples:
+                return None
+            return self._percentile(samples, pct)
+
+    def getGapPercentile(self, pct, minsamples=20):
+        """
+        Return a percentile of the delay between two packets of the same reply (in seconds) or None if not
+        enough multi-packet replies have been recorded.
+        :param pct: The percentile (0-100)
+        :param minsamples: The minimum amount of samples needed
+        """
+        with self._lock:
+            if len(self._gaps) < minsamples:
+                return None
+            return self._percentile(self._gaps, pct)
+
+    def getHistogram(self, name):
+        """
+        Return the RTT histogram of a command.
+        :param name: The command name
+        :return: A list of tuples (upper bound in seconds or None for the last bucket, count)
+        """
+        with self._lock:
+            counts = self._histograms.get(name, [0] * (len(self.buckets) + 1))
+            return list(zip(self.buckets + (None,), counts))
+
+    def dumpStats(self, console):
+        """
+        Log the RTT statistics.
+        :param console: The console implementation
+        """
+        for name in sorted(self._histograms):
+            with self._lock:
+                recent = list(self._recent[name])
+            histogram = ' '.join('%s:%s' % ('<%dms' % (b * 1000) if b else 'more', c)
+                                 for b, c in self.getHistogram(name) if c)
+            console.verbose('RCON rtt %s: p50 %0.1f ms, p90 %0.1f ms, p99 %0.1f ms [%s]', name,
+                            self._percentile(recent, 50) * 1000, self._percentile(recent, 90) * 1000,
+                            self._percentile(recent, 99) * 1000, histogram)
+
+
+class TokenBucket(object):
+    """
+    Packets per second budget. Senders reserve a slot and wait until it comes: slots are handed out
+    in the order they are reserved, so a command which reserved first is sent first.
+    """
+    def __init__(self, rate, burst=None):
+        """
+        Object constructor.
+        :param rate: The amount of packets per second (0 means unlimited)
+        :param burst: The amount of packets which can be sent at once after an idle period
+        """
+        self.rate = float(rate)
+        self.burst = float(max(1, burst if burst else rate))
+        self.tokens = self.burst
+        self.last = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Reserve a packet slot.
+        :return: The amount of seconds to wait before sending the packet
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class RconScheduler(object):
+    """
+    Queue of the RCON commands sent by the writer thread (Rcon.writelines).
+
+    Commands are sorted in priority classes: penalties are sent ahead of queries and queries ahead of chat
+    messages, in FIFO order inside each class. When merging is enabled, consecutive chat commands are joined
+    (using the engine command separator) into the fewest packets the engine accepts. The time every command
+    spent in the queue is recorded per class.
+    """
+    separator = ';'
+    maxsize = 1000  # the engine reads at most 1024 characters per RCON packet (header included)
+
+    def __init__(self, console, merge=False):
+        """
+        Object constructor.
+        :param console: The console implementation
+        :param merge: Whether to merge consecutive chat commands
+        """
+        self.console = console
+        self.merge = merge
+        self._queues = dict((p, collections.deque()) for p in PRIORITY_NAMES)
+        self._ready = threading.Condition(threading.Lock())
+        self._stats = dict((p, [0, 0.0, 0.0]) for p in PRIORITY_NAMES)  # count, total wait, max wait
+
+    @staticmethod
+    def getPriority(cmd):
+        """
+        Return the priority class of the given command.
+        :param cmd: The RCON command
+        """
+        name = cmd.split(None, 1)[0].lower() if cmd.strip() else ''
+        if name in PENALTY_COMMANDS:
+            return PRIORITY_PENALTY
+        if name in CHAT_COMMANDS:
+            return PRIORITY_CHAT
+        return PRIORITY_QUERY
+
+    def put(self, lines):
+        """
+        Enqueue multiple RCON commands.
+        :param lines: A list of RCON commands
+        """
+        now = time.time()
+        with self._ready:
+            for cmd in lines:
+                if cmd:
+                    self._queues[self.getPriority(cmd)].append((now, cmd))
+            self._ready.notify()
+
+    def qsize(self):
+        """
+        Return the number of queued commands.
+        """
+        return sum(len(q) for q in self._queues.values())
+
+    def _mergeable(self, cmd):
+        return self.separator not in cmd and '\n' not in cmd and '"' not in cmd
+
+    def pop(self):
+        """
+        Dequeue the next command to send (merged with the following chat commands when possible).
+        :return: A tuple (priority, command) or None if no command is queued
+        """
+        with self._ready:
+            return self._pop()
+
+    def get(self, timeout=None):
+        """
+        Dequeue the next command to send, waiting for one to be queued.
+        :param timeout: The maximum amount of seconds to wait
+        :return: A tuple (priority, command) or None if no command has been queued in time
+        """
+        with self._ready:
+            if not self.qsize():
+                self._ready.wait(timeout)
+            return self._pop()
+
+    def _pop(self):
+        for priority in sorted(self._queues):
+            queue = self._queues[priority]
+            if queue:
+                break
+        else:
+            return None
+
+        now = time.time()
+        queued, cmd = queue.popleft()
+        self._record(priority, now - queued)
+        if priority == PRIORITY_CHAT and self.merge and self._mergeable(cmd):
+            while queue and self._mergeable(queue[0][1]) and \
+                    len(cmd) + len(self.separator) + len(queue[0][1]) <= self.maxsize:
+                queued, other = queue.popleft()
+                self._record(priority, now - queued)
+                cmd = '%s%s%s' % (cmd, self.separator, other)
+        return priority, cmd
+
+    def _record(self, priority, wait):
+        stats = self._stats[priority]
+        stats[0] += 1
+        stats[1] += wait
+        stats[2] = max(stats[2], wait)
+
+    def getStats(self):
+        """
+        Return the queue wait time statistics.
+        :return: A dict mapping priority class names to tuples (count, average wait ms, max wait ms)
+        """
+        with self._ready:
+            return dict((PRIORITY_NAMES[p], (c, t * 1000 / c if c else 0, m * 1000))
+                        for p, (c, t, m) in self._stats.items())
+
+    def dumpStats(self):
+        """
+        Log the queue wait time statistics.
+        """
+        for name, (count, average, maximum) in sorted(self.getStats().items()):
+            if count:
+                self.console.verbose('RCON queue %s: %s commands, wait avg %0.1f ms, max %0.1f ms',
+                                     name, count, average, maximum)
+
 
 class Rcon(object):
 
     host = ()
     password = None
-    lock = thread.allocate_lock()
+    lock = None
     socket = None
     queue = None
     console = None
@@ -55,8 +449,21 @@ class Rcon(object):
     # default expiretime for the status cache in seconds and cache type
     status_cache_expire_time = 2
     status_cache = False
-    status_cache_expired = None
-    status_cache_data = ''
+
+    cache = None  # response cache (None when no reply is cached)
+
+    # adaptive read deadlines (rcon_adaptive_timeout): the first reply packet is waited for twice the observed
+    # p99 RTT, the following ones twice the observed p99 delay between two packets (both capped to socket_timeout)
+    adaptive = False
+    adaptive_min_timeout = 0.05
+    adaptive_min_gap = 0.02
+    # a reply packet shorter than this ends the reply of the commands known to reply with a single packet; the
+    # engine flushes its 1008 characters buffer whenever the next line would not fit, so a short packet does
+    # not end a multi-packet reply (status, cvarlist, dumpuser...): those end on the inter-packet gap deadline
+    adaptive_last_packet = 512
+    single_packet_commands = frozenset(('say', 'tell', 'bigtext', 'cp', 'kick', 'clientkick', 'banclient',
+                                        'tempbanclient', 'banuser', 'addip', 'removeip', 'set', 'seta', 'sets',
+                                        'setu', 'forceteam', 'mute', 'slap', 'nuke'))
 
     def __init__(self, console, host, password):
         """
@@ -66,7 +473,8 @@ class Rcon(object):
         :param password: The RCON password
         """
         self.console = console
-        self.queue = Queue.Queue()
+        # one lock per game server: a slow or unreachable server must not hold up the others (--supervise)
+        self.lock = thread.allocate_lock()
 
         if self.console.config.has_option('caching', 'status_cache_type'):
             status_cache_type = self.console.config.get('caching', 'status_cache_type').lower()
@@ -77,11 +485,55 @@ class Rcon(object):
             self.status_cache_expire_time = abs(self.console.config.getint('caching', 'status_cache_expire'))
             if self.status_cache_expire_time > 5:
                 self.status_cache_expire_time = 5
-        # set the cacche expire time to now, so the first status request will retrieve a status from the server
-        status_cache_expired = time.time()
 
         self.console.bot('Rcon status cache expire time: [%s sec] Type: [%s]' % (self.status_cache_expire_time,
                                                                                  self.status_cache))
+
+        ttls = {}
+        if self.status_cache:
+            ttls['status'] = ttls['pb_sv_plist'] = self.status_cache_expire_time
+        if self.console.config.has_option('caching', 'rcon_cache'):
+            # format: command:seconds, command:seconds, ... i.e: mapname:30, sv_maprotation:300, fdir:600
+            for item in self.console.config.get('caching', 'rcon_cache').split(','):
+                try:
+                    name, ttl = item.split(':', 1)
+                    ttls[name.strip().lower()] = float(ttl)
+                except ValueError:
+                    self.console.warning('Invalid rcon cache setting: %r', item.strip())
+        if ttls:
+            self.cache = ResponseCache(self.console, ttls, DEFAULT_CACHE_INVALIDATION)
+            self.console.bot('Rcon cache: %s' % ', '.join('%s [%s sec]' % x for x in sorted(self.cache.ttls.items())))
+        rate = 0
+        if self.console.config.has_option('server', 'rcon_rate'):
+            try:
+                rate = max(0.0, self.console.config.getfloat('server', 'rcon_rate'))
+            except ValueError as e:
+                self.console.warning('Invalid rcon_rate setting: using default (unlimited): %s', e)
+        burst = None
+        if self.console.config.has_option('server', 'rcon_burst'):
+            try:
+                burst = max(1, self.console.config.getint('server', 'rcon_burst'))
+            except ValueError as e:
+                self.console.warning('Invalid rcon_burst setting: using default: %s', e)
+        merge = False
+        if self.console.config.has_option('server', 'rcon_merge'):
+            try:
+                merge = self.console.config.getboolean('server', 'rcon_merge')
+            except ValueError as e:
+                self.console.warning('Invalid rcon_merge setting: using default (%s): %s', merge, e)
+
+        if self.console.config.has_option('server', 'rcon_adaptive_timeout'):
+            try:
+                self.adaptive = self.console.config.getboolean('server', 'rcon_adaptive_timeout')
+            except ValueError as e:
+                self.console.warning('Invalid rcon_adaptive_timeout setting: using default (%s): %s', self.adaptive, e)
+        self.console.bot('Rcon adaptive timeout: [%s]' % self.adaptive)
+
+        self.latency = LatencyStats()
+        self.bucket = TokenBucket(rate, burst)
+        self.scheduler = RconScheduler(self.console, merge)
+        self.console.bot('Rcon rate limit: [%s] burst: [%s] merge chat commands: [%s]' % (
+                         '%s packets/sec' % rate if rate else 'unlimited', int(self.bucket.burst), merge))
         self.console.bot('Game name is: %s' % self.console.gameName)
         self.socket = socket.socket(type=socket.SOCK_DGRAM)
         self.host = host
@@ -90,7 +542,14 @@ class Rcon(object):
         self.socket.connect(self.host)
 
         self._stopEvent = threading.Event()
-        thread.start_new_thread(self._writelines, ())
+        self._signal = None
+        runtime = getattr(self.console, '_runtime', None)
+        if runtime:
+            # queued commands are sent from the asyncio runtime event loop
+            self._signal = b3.runtime.Signal(runtime)
+            runtime.addService(self._awritelines, runtime)
+        else:
+            thread.start_new_thread(self._writelines, ())
 
     def encode_data(self, data, source):
         """
@@ -191,6 +650,8 @@ class Rcon(object):
 
         self.console.verbose('RCON sending (%s:%s) %r', self.host[0], self.host[1], data)
         start_time = time.time()
+        name = original_data.split(None, 1)[0].lower() if original_data else ''
+        timeout, gap = self.getReadDeadlines(name, socketTimeout)
 
         retries = 0
         while time.time() - start_time < 5:
@@ -199,26 +660,21 @@ class Rcon(object):
             if len(errors) > 0:
                 self.console.warning('RCON: %s', str(errors))
             elif len(writeables) > 0:
+                delay = self.bucket.reserve()
+                if delay:
+                    # packets per second budget exhausted
+                    time.sleep(delay)
+                if self.adaptive:
+                    # a late reply to a previous command must not be taken for the reply to this one
+                    self.discardPending(self.socket)
                 try:
-                    # Ensure password is also encoded if needed
-                    password = self.password
-                    if isinstance(data, bytes):
-                        # If data is bytes, we need to send bytes
-                        if isinstance(password, str):
-                            password = password.encode('utf-8', 'replace')
-                        command = b'\377\377\377\377rcon "%s" %s\n' % (password, data)
-                    else:
-                        # If data is string, send as string
-                        command = self.rconsendstring % (password, data)
-                        if self.console.encoding:
-                            command = command.encode(self.console.encoding, 'replace')
-                    
-                    writeables[0].send(command)
+                    writeables[0].send(self.getRconCommand(data))
                 except Exception as msg:
                     self.console.warning('RCON: error sending: %r', msg)
                 else:
                     try:
-                        data = self.readSocket(self.socket, socketTimeout=socketTimeout)
+                        data = self.readReply(self.socket, timeout=timeout, gap=gap, name=name,
+                                              single=name in self.single_packet_commands)
                         self.console.verbose2('RCON: received %r' % data)
                         return data
                     except Exception as msg:
@@ -245,30 +701,134 @@ class Rcon(object):
         self.console.debug('RCON: did not send any data')
         return ''
 
+    def getRconCommand(self, data):
+        """
+        Build the RCON packet for the given (already encoded) command.
+        :param data: The RCON command
+        """
+        # Ensure password is also encoded if needed
+        password = self.password
+        if isinstance(data, bytes):
+            # If data is bytes, we need to send bytes
+            if isinstance(password, str):
+                password = password.encode('utf-8', 'replace')
+            return b'\377\377\377\377rcon "%s" %s\n' % (password, data)
+
+        # If data is string, send as string
+        command = self.rconsendstring % (password, data)
+        if self.console.encoding:
+            command = command.encode(self.console.encoding, 'replace')
+        return command
+
     def stop(self):
         """
         Stop the rcon writelines queue.
         """
         self._stopEvent.set()
+        if self._signal:
+            self._signal.set()
 
     def _writelines(self):
         """
-        Write multiple RCON commands on the socket.
+        Write the queued RCON commands on the socket, highest priority first.
         """
         while not self._stopEvent.isSet():
-            lines = self.queue.get(True)
-            for cmd in lines:
-                if not cmd:
-                    continue
+            item = self.scheduler.get(1)
+            if item is not None:
                 with self.lock:
-                    self.sendRcon(cmd, maxRetries=1)
+                    self.sendRcon(item[1], maxRetries=1)
+
+    async def _awritelines(self, runtime):
+        """
+        Write multiple RCON commands on the socket from the asyncio runtime event loop.
+        Commands are sent on a dedicated non blocking socket so that replies never mix with
+        the ones of the synchronous RCON queries sent by other threads.
+        :param runtime: The AsyncRuntime instance
+        """
+        loop = runtime.loop
+        sock = socket.socket(type=socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.connect(self.host)
+        try:
+            while not self._stopEvent.isSet():
+                item = self.scheduler.pop()
+                if item is None:
+                    await self._signal.wait()
+                    continue
+
+                delay = self.bucket.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                await self._asendRcon(loop, sock, item[1])
+        finally:
+            sock.close()
+
+    async def _asendRcon(self, loop, sock, data):
+        """
+        Send an RCON command without blocking the event loop (no retry).
+        :param loop: The event loop
+        :param sock: The non blocking socket to use
+        :param data: The string to be sent
+        """
+        data = data.strip()
+        name = data.split(None, 1)[0].lower() if data else ''
+        timeout, gap = self.getReadDeadlines(name)
+        single = self.adaptive and name in self.single_packet_commands
+        if self.console.encoding:
+            data = self.encode_data(data, 'RCON')
+
+        self.console.verbose('RCON sending (%s:%s) %r', self.host[0], self.host[1], data)
+        if self.adaptive:
+            self.discardPending(sock)
+        start = time.time()
+        try:
+            await loop.sock_sendall(sock, self.getRconCommand(data))
+        except Exception as msg:
+            self.console.warning('RCON: error sending: %r', msg)
+            return ''
+
+        # read the reply until the server stops sending data
+        reply = ''
+        rtt = None
+        last = None
+        gaps = []
+        while True:
+            try:
+                d_bytes = await asyncio.wait_for(loop.sock_recv(sock, 4096), timeout if rtt is None else gap)
+            except asyncio.TimeoutError:
+                break
+            except Exception as msg:
+                self.console.warning('RCON: error reading: %r', msg)
+                break
+            now = time.time()
+            if rtt is None:
+                rtt = now - start
+            else:
+                gaps.append(now - last)
+            last = now
+            d = d_bytes.decode(self.console.encoding or 'utf-8', 'replace').replace(self.rconreplystring, '')
+            reply += d
+            if single and len(d) < self.adaptive_last_packet:
+                # short packet: the reply is complete
+                break
+
+        if rtt is not None:
+            self.latency.add(name, rtt, gaps)
+        self.console.verbose2('RCON: received %r' % reply)
+        return reply
 
     def writelines(self, lines):
         """
         Enqueue multiple RCON commands for later processing.
         :param lines: A list of RCON commands.
         """
-        self.queue.put(lines)
+        if self.cache:
+            for cmd in lines:
+                if cmd:
+                    self.cache.onCommand(cmd)
+        self.scheduler.put(lines)
+        if self._signal:
+            self._signal.set()
 
     def write(self, cmd, maxRetries=None, socketTimeout=None):
         """
@@ -277,31 +837,44 @@ class Rcon(object):
         :param maxRetries: How many times we have to retry the sending upon failure
         :param socketTimeout: The socket timeout value
         """
-        # intercept status request for caching construct
-        if (cmd == 'status' or cmd == 'PB_SV_PList') and self.status_cache:
-            if time.time() < self.status_cache_expired:
-                self.console.verbose2('Using Status: Cached %s' % cmd)
-                return self.status_cache_data
-            else:
-                with self.lock:
-                    data = self.sendRcon(cmd, maxRetries=maxRetries, socketTimeout=socketTimeout)
-                    if data:
-                        self.status_cache_data = data
-                        self.status_cache_expired = time.time() + self.status_cache_expire_time
-                        self.console.verbose2('Using Status: Fresh %s' % cmd)
-                    else:
-                        # if no data returned set the cached status to empty, but don't update the expired timer so next attempt will try 
-                        # to read a new value
-                        self.status_cache_data = ''
-                return self.status_cache_data
-        
+        cache = self.cache
+        if cache is None:
+            with self.lock:
+                data = self.sendRcon(cmd, maxRetries=maxRetries, socketTimeout=socketTimeout)
+            return data if data else ''
+
+        if not cache.getTTL(cmd):
+            cache.onCommand(cmd)
+            with self.lock:
+                data = self.sendRcon(cmd, maxRetries=maxRetries, socketTimeout=socketTimeout)
+            return data if data else ''
+
+        data = cache.get(cmd)
+        if data is not None:
+            self.console.verbose2('Using cached reply: %s' % cmd)
+            return data
+
         with self.lock:
-            data = self.sendRcon(cmd, maxRetries=maxRetries, socketTimeout=socketTimeout)
+            # another thread may have fetched the reply while we were waiting for the lock
+            data = cache.get(cmd, count=False)
+            if data is None:
+                # if no data is returned nothing is cached: the next attempt will try to read a new value
+                data = self.sendRcon(cmd, maxRetries=maxRetries, socketTimeout=socketTimeout)
+                cache.set(cmd, data)
         return data if data else ''
 
     def flush(self):
         pass
 
+    def dumpStats(self):
+        """
+        Log the RCON queue, latency and cache statistics.
+        """
+        self.scheduler.dumpStats()
+        self.latency.dumpStats(self.console)
+        if self.cache:
+            self.cache.dumpStats()
+
     def readNonBlocking(self, sock):
         """
         Read data from the socket (non blocking).
@@ -325,6 +898,90 @@ class Rcon(object):
 
         return data.strip()
 
+    def getReadDeadlines(self, name, socketTimeout=None):
+        """
+        Return how long to wait for the reply to a command.
+        :param name: The command name
+        :param socketTimeout: The socket timeout value (the maximum deadline)
+        :return: A tuple (seconds to wait for the first reply packet, seconds to wait for each following packet)
+        """
+        if socketTimeout is None:
+            socketTimeout = self.socket_timeout
+        if not self.adaptive:
+            return socketTimeout, socketTimeout
+
+        timeout = gap = socketTimeout
+        rtt = self.latency.getPercentile(99, name)
+        if rtt is None:
+            rtt = self.latency.getPercentile(99)
+        if rtt is not None:
+            timeout = min(socketTimeout, max(self.adaptive_min_timeout, rtt * 2))
+        delay = self.latency.getGapPercentile(99)
+        if delay is not None:
+            gap = min(socketTimeout, max(self.adaptive_min_gap, delay * 2))
+        return timeout, gap
+
+    def discardPending(self, sock):
+        """
+        Drop the data waiting in the socket.
+        :param sock: The socket to empty
+        """
+        readables, writeables, errors = select.select([sock], [], [], 0)
+        while readables:
+            d_bytes = sock.recv(4096)
+            self.console.verbose('RCON: discarding late reply %r', d_bytes[:80])
+            readables, writeables, errors = select.select([sock], [], [], 0)
+
+    def readReply(self, sock, size=4096, timeout=None, gap=None, name=None, single=False):
+        """
+        Read a reply from the socket, recording its latency.
+        :param sock: The socket from where to read data
+        :param size: The read size
+        :param timeout: How long to wait for the first reply packet
+        :param gap: How long to wait for each following reply packet
+        :param name: The command name (latency statistics)
+        :param single: Whether the command is known to reply with a single packet (see single_packet_commands)
+        """
+        if timeout is None:
+            timeout = self.socket_timeout
+        if gap is None:
+            gap = timeout
+        single = single and self.adaptive
+
+        start = time.time()
+        readables, writeables, errors = select.select([sock], [], [sock], timeout)
+        if not len(readables):
+            self.console.verbose('No readable socket')
+            return ''
+
+        last = time.time()
+        rtt = last - start
+        gaps = []
+        data = ''
+        while len(readables):
+            d_bytes = sock.recv(size)
+
+            if d_bytes:
+                # Decode bytes to string properly for Python 3
+                d = d_bytes.decode(self.console.encoding or 'utf-8', 'replace')
+                # remove rcon header
+                d = d.replace(self.rconreplystring, '')
+                data += d
+                if single and len(d) < self.adaptive_last_packet:
+                    # short packet: the reply is complete
+                    break
+
+            readables, writeables, errors = select.select([sock], [], [sock], gap)
+            if len(readables):
+                now = time.time()
+                gaps.append(now - last)
+                last = now
+                self.console.verbose('RCON: more data to read in socket')
+
+        if name is not None:
+            self.latency.add(name, rtt, gaps)
+        return data
+
     def readSocket(self, sock, size=4096, socketTimeout=None):
         """
         Read data from the socket.
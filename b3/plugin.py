@@ -23,7 +23,7 @@
 # ################################################################### #
 
 __author__ = 'ThorN, Courgette'
-__version__ = '1.13'
+__version__ = '1.15'
 
 
 import re
@@ -104,6 +104,23 @@ class Plugin(object):
     _default_messages = {}
     """:type: dict"""
 
+    # Whether this plugin must handle events in the main event handler thread when B3 dispatches events using plugin
+    # workers (b3/event_dispatch = workers). Set this to True if your plugin raises VetoEvent to stop other plugins
+    # from handling an event: plugins dispatched through workers cannot veto events.
+    dispatchInline = False
+    """:type: bool"""
+
+    # Name of the dispatch group this plugin belongs to when B3 dispatches events using plugin workers: plugins in
+    # the same group share the same worker(s). If no group is specified the plugin gets its own worker(s).
+    dispatchGroup = None
+    """:type: str"""
+
+    # Whether the event handlers of this plugin never block (no storage queries, no rcon queries, no sleeps, ...)
+    # and can thus be executed directly on the event loop when B3 runs with the asyncio runtime (b3/runtime = asyncio).
+    # Plugins which are not flagged are executed by the runtime workers.
+    asyncSafe = False
+    """:type: bool"""
+
     ################################## PLUGIN DEVELOPERS: END PLUGIN CUSTOMIZATION #####################################
 
     _enabled = True
@@ -188,7 +205,7 @@ class Plugin(object):
         if filename:
             self.bot('loading config %s for %s', filename, self.__class__.__name__)
             try:
-                self.config = b3.config.load(filename)
+                self.config = b3.config.load(filename, self.console.config)
             except b3.config.ConfigFileNotFound:
                 if self.requiresConfigFile:
                     self.critical('could not find config file %s', filename)
@@ -198,7 +215,7 @@ class Plugin(object):
                     return True
         elif self.config:
             self.bot('loading config %s for %s', self.config.fileName, self.__class__.__name__)
-            self.config = b3.config.load(self.config.fileName)
+            self.config = b3.config.load(self.config.fileName, self.console.config)
         else:
             if self.requiresConfigFile:
                 self.error('could not load config for %s', self.__class__.__name__)
@@ -278,7 +295,7 @@ class Plugin(object):
         def _get_path(value):
             """convert the given path using b3.getAbsolutePath"""
             self.verbose('trying to convert value to absolute path : %s', value)
-            return b3.getAbsolutePath(str(value), decode=True)
+            return b3.getAbsolutePath(str(value), decode=True, conf=self.console.config)
 
         def _get_template(value):
             """process the given value using b3.functions.vars2printf"""
@@ -23,13 +23,12 @@
 # ################################################################### #
 
 __author__ = 'ThorN, xlr8or, Bravo17, Courgette'
-__version__ = '3.3'
+__version__ = '3.4'
 
 import b3
 import re
 import traceback
 import sys
-import threading
 import b3.events
 import b3.plugin
 
@@ -85,6 +84,8 @@ class CensorPlugin(b3.plugin.Plugin):
 
     loadAfterPlugins = ['chatlogger']
 
+    dispatchInline = True  # we may veto chat events
+
     ####################################################################################################################
     #                                                                                                                  #
     #    STARTUP                                                                                                       #
@@ -315,8 +316,7 @@ class CensorPlugin(b3.plugin.Plugin):
 
         if was_penalized:
             # check again in 1 minute
-            t = threading.Timer(60, self.checkBadName, (client,))
-            t.start()
+            self.console.callLater(60, self.checkBadName, client)
             return
 
     def checkBadWord(self, text, client):
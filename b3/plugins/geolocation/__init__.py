@@ -23,7 +23,7 @@
 # ################################################################### #
 
 __author__ = 'Fenix'
-__version__ = '1.5'
+__version__ = '1.7'
 
 import b3
 import b3.clients
@@ -31,6 +31,7 @@ import b3.plugin
 import b3.events
 import threading
 
+from collections import OrderedDict
 from b3.plugins.geolocation.exceptions import GeolocalizationError
 from b3.plugins.geolocation.geolocators import FreeGeoIpGeolocator
 from b3.plugins.geolocation.geolocators import IpApiGeolocator
@@ -42,6 +43,12 @@ class GeolocationPlugin(b3.plugin.Plugin):
 
     requiresConfigFile = False
 
+    # locations retrieved so far, by ip address: kept at class level so that they are
+    # shared by all the game servers hosted by the same B3 process (supervisor mode)
+    _locations = OrderedDict()
+    _locationsLock = threading.Lock()
+    _locationsMaxSize = 4096
+
     def __init__(self, console, config=None):
         """
         Build the plugin object.
@@ -84,7 +91,12 @@ class GeolocationPlugin(b3.plugin.Plugin):
         """
         def _threaded_geolocate(client):
 
-            client.location = None
+            client.location = self.getCachedLocation(client.ip)
+            if client.location is not None:
+                self.debug('retrieved geolocation data for %s <@%s> from cache: %r', client.name, client.id,
+                           client.location)
+                self.console.queueEvent(self.console.getEvent('EVT_CLIENT_GEOLOCATION_SUCCESS', client=client))
+                return
 
             for geotool in self._geolocators:
 
@@ -100,6 +112,7 @@ class GeolocationPlugin(b3.plugin.Plugin):
                                client.name, client.id, geotool.__class__.__name__, e)
 
             if client.location is not None:
+                self.setCachedLocation(client.ip, client.location)
                 self.console.queueEvent(self.console.getEvent('EVT_CLIENT_GEOLOCATION_SUCCESS', client=client))
             else:
                 self.console.queueEvent(self.console.getEvent('EVT_CLIENT_GEOLOCATION_FAILURE', client=client))
@@ -108,6 +121,30 @@ class GeolocationPlugin(b3.plugin.Plugin):
         # and we ended up with NoneType object in client.location (so we have an attribute but it's not useful).
         # also make sure to launch geolocation only if we have a valid ip address.
         if not getattr(event.client, 'location', None) and event.client.ip:
-            t = threading.Thread(target=_threaded_geolocate, args=(event.client,))
-            t.daemon = True  # won't prevent B3 from exiting
-            t.start()
\ No newline at end of file
+            self.console.runInBackground(_threaded_geolocate, event.client)
+
+    ####################################################################################################################
+    #                                                                                                                  #
+    #   OTHER METHODS                                                                                                  #
+    #                                                                                                                  #
+    ####################################################################################################################
+
+    def getCachedLocation(self, ip):
+        """
+        Return the location previously retrieved for the given ip address.
+        :param ip: The ip address
+        :return: A Location object or None if the ip address was never geolocated
+        """
+        with self._locationsLock:
+            return self._locations.get(ip)
+
+    def setCachedLocation(self, ip, location):
+        """
+        Store the location retrieved for the given ip address.
+        :param ip: The ip address
+        :param location: The Location object
+        """
+        with self._locationsLock:
+            self._locations[ip] = location
+            while len(self._locations) > self._locationsMaxSize:
+                self._locations.popitem(last=False)
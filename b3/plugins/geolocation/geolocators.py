@@ -28,6 +28,7 @@ import re
 import os
 import os.path
 import requests
+import threading
 
 from b3.plugins.geolocation.exceptions import GeolocalizationError
 from b3.plugins.geolocation.lib.geoip import GeoIP
@@ -156,6 +157,11 @@ class MaxMindGeolocator(Geolocator):
     _path = None
     _geoip = None
 
+    # database handles shared by all the instances living in this process (several game servers can be hosted
+    # by the same B3 process): lookups seek the database file so they must be serialized
+    _handles = {}
+    _handlesLock = threading.Lock()
+
     def __init__(self, *args, **kwargs):
         """
         Object constructor.
@@ -170,7 +176,10 @@ class MaxMindGeolocator(Geolocator):
             if not os.path.isfile('/usr/local/share/GeoIP/GeoIP.dat'):
                 raise IOError('no MaxMind GeoIP.dat database available: put the database file in %s' % self._path)
             self._path = '/usr/local/share/GeoIP/GeoIP.dat'
-        self.geoip = GeoIP.open(self._path, GeoIP.GEOIP_STANDARD)
+        with self._handlesLock:
+            if self._path not in self._handles:
+                self._handles[self._path] = GeoIP.open(self._path, GeoIP.GEOIP_STANDARD)
+            self.geoip = self._handles[self._path]
 
     def getLocation(self, data):
         """
@@ -179,5 +188,6 @@ class MaxMindGeolocator(Geolocator):
         :raise GeolocalizationError: When we are not able to retrieve location information
         :return: A Location object initialized with location data
         """
-        country_id = self.geoip.id_by_addr(self._getIp(data))
+        with self._handlesLock:
+            country_id = self.geoip.id_by_addr(self._getIp(data))
         return Location(country=GeoIP.id_to_country_name(country_id), cc=GeoIP.id_to_country_code(country_id))
\ No newline at end of file
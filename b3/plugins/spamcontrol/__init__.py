@@ -42,6 +42,8 @@ class SpamcontrolPlugin(b3.plugin.Plugin):
     _modLevel = 20
     _falloffRate = 6.5
 
+    dispatchInline = True  # we may veto chat events
+
     ####################################################################################################################
     #                                                                                                                  #
     #    STARTUP                                                                                                       #
@@ -28,12 +28,11 @@ import b3.plugin
 import b3.cron
 import string
 import re
-import threading
 import time
 
 from ConfigParser import NoOptionError
 
-__version__ = '1.5'
+__version__ = '1.6'
 __author__ = 'ThorN, mindriot, Courgette, xlr8or, SGT, 82ndab-Bravo17, ozon, Fenix'
 
 
@@ -415,8 +414,7 @@ class TkPlugin(b3.plugin.Plugin):
                 self.console.say(self.getMessage('forgive_warning', {'name': event.client.exactName,
                                                                      'points': points, 'cid': event.client.cid}) + msg)
                 event.client.setvar(self, 'checkBan', True)
-                t = threading.Timer(30, self.checkTKBan, (event.client,))
-                t.start()
+                self.console.callLater(30, self.checkTKBan, event.client)
 
     ####################################################################################################################
     #                                                                                                                  #
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.0'
+
+import heapq
+import itertools
+import math
+import os
+import sys
+import threading
+import time
+
+from traceback import extract_tb
+
+REPLAY_FASTEST = 0.0  # as fast as possible
+REPLAY_REALTIME = 1.0
+
+
+def getSpeed(value):
+    """
+    Convert a replay speed given on the command line into a time compression factor.
+    :param value: 'max' (as fast as possible), 'realtime' or a factor (i.e: 10 for 10 times faster than real-time)
+    :raise ValueError: If the value is not a valid speed
+    """
+    value = str(value).strip().lower()
+    if value in ('max', 'fastest', '0'):
+        return REPLAY_FASTEST
+    if value in ('realtime', 'real-time'):
+        return REPLAY_REALTIME
+    speed = float(value.rstrip('x'))
+    if speed <= 0:
+        raise ValueError('invalid replay speed: %s' % value)
+    return speed
+
+
+class VirtualClock(object):
+    """
+    Simulated time used while replaying a game log.
+
+    The clock follows the game log time of the lines being replayed (Parser.logTime) instead of the wall clock:
+    Parser.time() and Cron.time() return the simulated time, cron tabs fire once per simulated second and the
+    calls scheduled with Parser.callLater fire when the simulated time reaches them. The speed tells how the
+    simulated time relates to the real time: 1 is real-time, N is N times faster and 0 lets the replay go as
+    fast as the plugins can keep up with (the clock waits for the event queue to be empty before moving on).
+    """
+    def __init__(self, console, speed=REPLAY_REALTIME, start=None):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param speed: The time compression factor (0 for as fast as possible)
+        :param start: The simulated timestamp of the first game log line (default: now)
+        """
+        self.console = console
+        self.speed = speed
+        self.start = int(start if start is not None else time.time())
+        self.now = float(self.start)
+        self._nextTick = self.start + 1
+        self._realStart = None
+        self._timers = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def time(self):
+        """
+        Return the current simulated timestamp.
+        """
+        return self.now
+
+    def elapsed(self):
+        """
+        Return the amount of simulated seconds since the replay started.
+        """
+        return self.now - self.start
+
+    def callLater(self, delay, func, *args):
+        """
+        Execute a function once the given amount of simulated seconds elapsed.
+        :param delay: The amount of simulated seconds to wait
+        :param func: The function to execute
+        """
+        with self._lock:
+            heapq.heappush(self._timers, (self.now + delay, next(self._sequence), func, args))
+
+    def advance(self, offset):
+        """
+        Move the clock forward, one simulated second at a time, running the cron tabs and the delayed
+        calls which are due in the meantime.
+        :param offset: The game log time of the line about to be parsed (seconds since the replay start)
+        """
+        if self._realStart is None:
+            self._realStart = time.time()
+
+        target = self.start + offset
+        while self.now < target and self.console.working:
+            step = min(target, math.floor(self.now) + 1)
+            self._pace(step)
+            self.now = step
+            self._fire()
+
+    def _pace(self, timestamp):
+        """
+        Wait until the given simulated timestamp can be reached according to the replay speed.
+        """
+        if self.speed:
+            delay = self._realStart + (timestamp - self.start) / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            # as fast as possible: let the plugins handle the events of the current second first
+            self.drain()
+
+    def drain(self, timeout=None):
+        """
+        Wait until the event queue is empty.
+        :param timeout: The maximum amount of (real) seconds to wait
+        """
+        queue = self.console.queue
+        limit = time.time() + timeout if timeout is not None else None
+        while queue is not None and queue.qsize() and self.console.working:
+            if limit is not None and time.time() >= limit:
+                break
+            time.sleep(0.001)
+
+    def _fire(self):
+        """
+        Run the cron tabs and the delayed calls which are due.
+        """
+        cron = self.console._cron
+        while self._nextTick <= self.now:
+            if cron is not None:
+                cron.runTabs(self._nextTick)
+            self._nextTick += 1
+
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0][0] > self.now:
+                    break
+                when, seq, func, args = heapq.heappop(self._timers)
+            try:
+                func(*args)
+            except Exception as msg:
+                self.console.error('Exception raised while executing delayed call %s: %s\n%s', func, msg,
+                                   extract_tb(sys.exc_info()[2]))
+
+
+class ReplayOutput(object):
+    """
+    Output used while replaying a game log: nothing is sent to the game server, the commands are only logged
+    and counted (the replies are always empty).
+    """
+    socket_timeout = 0
+
+    def __init__(self, console):
+        """
+        Object constructor.
+        :param console: The console instance
+        """
+        self.console = console
+        self.commands = 0
+        self._lock = threading.Lock()
+
+    def write(self, cmd, maxRetries=None, socketTimeout=None):
+        """
+        Log a command which would have been sent to the game server.
+        :param cmd: The command
+        """
+        with self._lock:
+            self.commands += 1
+        self.console.verbose('REPLAY RCON: %s', cmd)
+        return ''
+
+    def writelines(self, lines):
+        """
+        Log a sequence of commands which would have been sent to the game server.
+        :param lines: The commands
+        """
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class LogReplay(object):
+    """
+    Run the parser and the plugins against a recorded game log.
+    """
+    batchsize = 100
+
+    def __init__(self, console, path, speed=REPLAY_FASTEST):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param path: The path of the recorded game log
+        :param speed: The time compression factor (0 for as fast as possible)
+        """
+        self.console = console
+        self.path = path
+        self.clock = VirtualClock(console, speed)
+
+    def run(self):
+        """
+        Replay the whole game log, then let the plugins handle the events still queued.
+        """
+        console = self.console
+        started = time.time()
+        with console.getLogReader(self.path) as reader:
+            for lines in reader.batches(self.batchsize):
+                if not console.working:
+                    break
+                # the clock follows the game log time from processLines (lines_per_second throttling is ignored)
+                console.processLines(lines)
+
+            self.clock.drain(timeout=30)
+            elapsed = time.time() - started
+            simulated = self.clock.elapsed()
+            console.bot('Replay of %s complete: %s lines (%s parsed), %d simulated seconds in %0.1f seconds '
+                        '(x%0.1f), %s rcon commands', os.path.basename(self.path), reader.scanned, reader.decoded,
+                        simulated, elapsed, simulated / elapsed if elapsed else 0, console.output.commands)
+            console.screen.write('Replay complete  : %s lines in %0.1f sec (%d simulated sec)\n' %
+                                 (reader.scanned, elapsed, simulated))
+            console.screen.flush()
@@ -23,10 +23,12 @@
 # ################################################################### #
 
 __author__  = 'ThorN'
-__version__ = '1.8'
+__version__ = '1.11'
 
 import b3
 import b3.config
+import b3.replay
+import b3.supervisor
 import os
 import sys
 import argparse
@@ -84,6 +86,8 @@ def run_autorestart(args=None):
                 restart_num += 1
                 sys.stdout.write('restart requested (%s)\n' % restart_num)
                 sys.stdout.flush()
+                # restart right away (see server/log_checkpoint to resume the game log where it stopped)
+                continue
             elif status == 222:
                 sys.stdout.write('shutdown requested!\n')
                 sys.stdout.flush()
@@ -196,6 +200,31 @@ def run(options):
         input("press any key to continue...")
 
 
+def run_supervisor(options):
+    """
+    Run B3 in supervisor mode: host several game servers in this process.
+    :param options: command line options
+    """
+    configs = []
+    for path in options.supervise:
+        config = b3.getAbsolutePath(path, True)
+        if not os.path.isfile(config):
+            console_exit('ERROR: configuration file not found (%s).\n'
+                         'Please visit %s to create one.' % (config, B3_CONFIG_GENERATOR))
+
+        main_config = b3.config.MainConfig(b3.config.load(config))
+        analysis = main_config.analyze()
+        if analysis:
+            print('CRITICAL: invalid configuration file specified (%s):\n' % config)
+            for problem in analysis:
+                print("  >>> %s\n" % problem)
+            raise SystemExit(1)
+        configs.append(main_config)
+
+    # START B3
+    b3.supervisor.start(configs, options)
+
+
 def main():
     """
     Main execution.
@@ -206,6 +235,9 @@ def main():
     p.add_argument('-s', '--setup',  action='store_true', dest='setup', default=False, help='Setup main b3.ini config file')
     p.add_argument('-u', '--update', action='store_true', dest='update', default=False, help='Update B3 database to latest version')
     p.add_argument('-v', '--version', action='version', default=False, version=b3.getB3versionString(), help='Show B3 version and exit')
+    p.add_argument('-m', '--supervise', nargs='+', dest='supervise', default=None, metavar='b3.ini', help='Host several game servers (one config file each) in a single B3 process')
+    p.add_argument('-p', '--replay', dest='replay', default=None, metavar='games_mp.log', help='Run the parser and the plugins against a recorded game log instead of the game server (use a test database!)')
+    p.add_argument('--replay-speed', dest='replay_speed', default='max', metavar='SPEED', help='Replay speed: realtime, a factor (i.e: 10 for 10 times faster) or max (as fast as possible, default)')
     p.add_argument('-a', '--autorestart', action='store_true', dest='autorestart', default=False, help=argparse.SUPPRESS)
 
     (options, args) = p.parse_known_args()
@@ -223,7 +255,20 @@ def main():
         ## UPDATE => CONSOLE
         run_update(config=options.config)
 
-    if options.restart:
+    if options.replay:
+        ## REPLAY => CONSOLE (no autorestart: B3 exits once the game log has been replayed)
+        if not os.path.isfile(options.replay):
+            console_exit('ERROR: game log file not found (%s).' % options.replay)
+        try:
+            options.replay_speed = b3.replay.getSpeed(options.replay_speed)
+        except ValueError:
+            console_exit('ERROR: invalid replay speed (%s).' % options.replay_speed)
+        options.autorestart = False
+        run(options)
+    elif options.supervise:
+        ## SUPERVISOR => CONSOLE (parsers asking for a restart are restarted in process)
+        run_supervisor(options)
+    elif options.restart:
         ## AUTORESTART => CONSOLE
         if options.config:
             run_autorestart(['--config', options.config] + args)
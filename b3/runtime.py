@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.2'
+
+import asyncio
+import functools
+import sys
+import threading
+
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+
+import b3.dispatch
+
+from concurrent.futures import ThreadPoolExecutor
+from traceback import extract_tb
+
+RUNTIME_THREADS = 'threads'
+RUNTIME_ASYNCIO = 'asyncio'
+
+RUNTIMES = (RUNTIME_THREADS, RUNTIME_ASYNCIO)
+
+
+class Signal(object):
+    """
+    An asyncio event which can be set from any thread.
+    """
+    def __init__(self, runtime):
+        """
+        Object constructor.
+        :param runtime: The AsyncRuntime instance
+        """
+        self.runtime = runtime
+        self._event = asyncio.Event()
+
+    def set(self):
+        """
+        Wake up the coroutine waiting on this signal.
+        """
+        if self.runtime.inLoop():
+            self._event.set()
+        else:
+            self.runtime.loop.call_soon_threadsafe(self._event.set)
+
+    async def wait(self, timeout=None):
+        """
+        Wait for the signal to be set, then reset it.
+        :param timeout: The maximum amount of seconds to wait
+        :return: True if the signal has been set, False if the timeout expired
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._event.clear()
+        return True
+
+
+class AsyncEventDispatcher(b3.dispatch.EventDispatcher):
+    """
+    Dispatch events to plugins from the asyncio event loop.
+
+    Plugins flagged as asyncSafe (Plugin.asyncSafe) are executed on the event loop, every other plugin is
+    executed in the runtime executor. Handlers of an event are still called one after the other, in the order
+    they registered, so VetoEvent keeps working and events are handled in the order they were queued.
+    """
+    def __init__(self, console, runtime):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param runtime: The AsyncRuntime instance
+        """
+        b3.dispatch.EventDispatcher.__init__(self, console)
+        self.runtime = runtime
+
+    async def dispatchAsync(self, event):
+        """
+        Dispatch an event to all the handlers registered for it.
+        :param event: The event to dispatch
+        """
+        for hfunc in self.console._handlers[event.type]:
+            if not hfunc.isEnabled():
+                continue
+
+            if getattr(hfunc, 'asyncSafe', False):
+                proceed = self.callHandler(hfunc, event)
+            else:
+                proceed = await self.runtime.runBlocking(self.callHandler, hfunc, event)
+
+            if not proceed:
+                # event vetoed: stop here
+                break
+
+
+class AsyncRuntime(object):
+    """
+    Drive the game log tailer, the event dispatching, the cron scheduler and the rcon output queue from a
+    single asyncio event loop running in the main thread, instead of one thread each.
+
+    Plugin code is never trusted to be non blocking: event handlers, crontabs and delayed calls are executed
+    in a bounded thread pool (unless the plugin is flagged as asyncSafe) and the event loop only awaits them,
+    so a slow plugin delays the next event but never the game log reading nor the rcon output.
+
+    Game log lines are parsed in a dedicated reader thread: parsing sends rcon commands and waits for a free
+    slot in the event queue when it is full, which must never happen on the event loop that empties the queue.
+    """
+    def __init__(self, console, workers=4):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param workers: The maximum number of blocking calls running at the same time
+        """
+        self.console = console
+        self.workers = max(1, workers)
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='b3-runtime')
+        # one thread only: game log lines must be parsed in order
+        self.reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='b3-reader')
+        self._thread = None
+        self._slots = None
+        self._tasks = []
+        self._services = []
+        self._events = Signal(self)
+        self._log = Signal(self)
+        self._dispatcher = AsyncEventDispatcher(console, self)
+
+    def inLoop(self):
+        """
+        Return True if called from the event loop thread.
+        """
+        return self._thread is threading.current_thread()
+
+    ####################################################################################################################
+    #                                                                                                                  #
+    #   BLOCKING CALLS                                                                                                 #
+    #                                                                                                                  #
+    ####################################################################################################################
+
+    async def runBlocking(self, func, *args, **kwargs):
+        """
+        Run a blocking function in the executor and return its result.
+        :param func: The function to run
+        """
+        async with self._slots:
+            return await self.loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _runSafe(self, func, *args):
+        """
+        Run a blocking function in the executor, logging any exception it raises.
+        """
+        try:
+            await self.runBlocking(func, *args)
+        except Exception as msg:
+            self.console.error('Could not execute %s: %s: %s %s', getattr(func, '__name__', func),
+                               msg.__class__.__name__, msg, extract_tb(sys.exc_info()[2]))
+
+    def submit(self, func, *args):
+        """
+        Run a blocking function in the executor as soon as possible (can be called from any thread).
+        :param func: The function to run
+        """
+        asyncio.run_coroutine_threadsafe(self._runSafe(func, *args), self.loop)
+
+    def callLater(self, delay, func, *args):
+        """
+        Run a blocking function in the executor after the given delay (can be called from any thread).
+        :param delay: The amount of seconds to wait
+        :param func: The function to run
+        """
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, self.submit, func, *args)
+
+    def addService(self, coro_func, *args):
+        """
+        Run a coroutine alongside the core tasks, until the runtime stops.
+        :param coro_func: The coroutine function
+        """
+        if self._thread is None:
+            self._services.append((coro_func, args))
+        else:
+            self.loop.call_soon_threadsafe(self._startService, coro_func, args)
+
+    def _startService(self, coro_func, args):
+        self._tasks.append(self.loop.create_task(coro_func(*args)))
+
+    ####################################################################################################################
+    #                                                                                                                  #
+    #   CORE TASKS                                                                                                     #
+    #                                                                                                                  #
+    ####################################################################################################################
+
+    def notifyEvent(self):
+        """
+        Wake up the event handler task: called by the event queue whenever an event is queued.
+        """
+        self._events.set()
+
+    async def _waitLog(self, timeout):
+        """
+        Wait for new data in the game log or for the timeout to expire.
+        """
+        if self.console.tailer.fileno() is None:
+            await asyncio.sleep(timeout)
+        else:
+            await self._log.wait(timeout)
+
+    def _onLogReadable(self):
+        if self.console.tailer.consume():
+            self._log.set()
+
+    async def _tailLog(self):
+        """
+        Read and parse the game log.
+        """
+        console = self.console
+        fd = console.tailer.fileno()
+        if fd is not None:
+            self.loop.add_reader(fd, self._onLogReadable)
+        try:
+            while console.working:
+                if console._paused:
+                    if not console._pauseNotice:
+                        console.bot('PAUSED - not parsing any lines: B3 will be out of sync')
+                        console._pauseNotice = True
+                    await asyncio.sleep(console.delay)
+                    continue
+
+                lines = console.read()
+                if not lines:
+                    await self._waitLog(console._coalescer.timeout(console.delay) if console._coalescer
+                                        else console.delay)
+                else:
+                    throttle = await self.loop.run_in_executor(self.reader, console.processLines, lines)
+                    if throttle > 0:
+                        await asyncio.sleep(throttle)
+
+                if console._coalescer:
+                    # queues events as well: may wait for room in the event queue
+                    await self.loop.run_in_executor(self.reader, console._coalescer.flush)
+
+                console.checkpointLog()
+        finally:
+            if fd is not None:
+                self.loop.remove_reader(fd)
+
+    async def _handleEvents(self):
+        """
+        Dispatch queued events.
+        """
+        console = self.console
+        while console.working:
+            try:
+                item = console.queue.get(False)
+            except Queue.Empty:
+                await self._events.wait()
+                continue
+
+            event = console.checkEvent(*item)
+            if event is not None:
+                await self._dispatcher.dispatchAsync(event)
+
+        console.bot('Shutting down event handler')
+        # releasing lock if it was set by console.shutdown() for instance
+        if console.exiting.locked():
+            console.exiting.release()
+
+    async def _runCron(self, cron):
+        """
+        Run the cron scheduler.
+        """
+        self.console.info("Cron scheduler started")
+        nexttime = cron.getNextTime()
+        while not cron.isStopped() and self.console.working:
+            now = cron.time()
+            if now < nexttime:
+                await asyncio.sleep(nexttime - now + .1)
+
+            # Check if the time has changed by more than two minutes. This
+            # case arises when the system clock is changed. We must reset the timer.
+            if abs(cron.time() - nexttime) > 120:
+                nexttime = cron.getNextTime()
+
+            await self.runBlocking(cron.runTabs, nexttime)
+            nexttime += 1
+
+        self.console.info("Cron scheduler ended")
+
+    def startCron(self, cron):
+        """
+        Run the given cron scheduler on the event loop.
+        :param cron: The Cron instance
+        """
+        self.addService(self._runCron, cron)
+
+    ####################################################################################################################
+    #                                                                                                                  #
+    #   MAIN LOOP                                                                                                      #
+    #                                                                                                                  #
+    ####################################################################################################################
+
+    async def _main(self):
+        self._slots = asyncio.Semaphore(self.workers)
+        handler = self.loop.create_task(self._handleEvents())
+        for coro_func, args in self._services:
+            self._startService(coro_func, args)
+        del self._services[:]
+
+        try:
+            await self._tailLog()
+        finally:
+            # the game log is not read anymore: give the event handler a chance to complete the shutdown
+            self._events.set()
+            done, pending = await asyncio.wait([handler], timeout=10)
+            if pending:
+                handler.cancel()
+                if self.console.exiting.locked():
+                    self.console.exiting.release()
+
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def run(self):
+        """
+        Run the event loop in the current thread until B3 stops working.
+        """
+        self._thread = threading.current_thread()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.reader.shutdown(wait=False)
+            self.loop.close()
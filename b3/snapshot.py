@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.1'
+
+import sys
+import threading
+import time
+
+import b3.cron
+
+from traceback import extract_tb
+
+
+class ServerSnapshot(object):
+    """
+    Table of the players connected to the game server, shared by every component asking for it.
+
+    The game server is queried (RCON status) once per interval and the reply is parsed once into a table
+    mapping slots to player rows: getPlayerList, getPlayerScores and getPlayerPings read from this table
+    instead of sending their own status command. Consumers can subscribe to the differences between two
+    consecutive snapshots (slots joined or left, pings changed).
+    """
+    def __init__(self, console, reader, interval):
+        """
+        Object constructor.
+        :param console: The console implementation
+        :param reader: A function querying the game server: reader(maxRetries) returns a dict mapping slots to
+                       player rows (dicts having at least the ping and score keys) or None if the query failed
+        :param interval: The amount of seconds between two game server queries
+        """
+        self.console = console
+        self.reader = reader
+        self.interval = interval
+        self.players = {}
+        self.updated = 0
+        self._next = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._cronTab = None
+
+    def start(self):
+        """
+        Start polling the game server.
+        """
+        if self._cronTab is None:
+            self._cronTab = b3.cron.CronTab(self.poll, second='*')
+            self.console.cron.add(self._cronTab)
+
+    def stop(self):
+        """
+        Stop polling the game server.
+        """
+        if self._cronTab is not None:
+            self.console.cron.cancel(id(self._cronTab))
+            self._cronTab = None
+
+    def subscribe(self, callback):
+        """
+        Be notified of the differences between two consecutive snapshots.
+        The callback is called as callback(joined, left, pings) where joined and left are lists of slots and
+        pings is a dict mapping the slots whose ping changed to a tuple (old ping, new ping).
+        :param callback: The function to call
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Stop notifying the given callback.
+        :param callback: The function to remove
+        """
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def poll(self):
+        """
+        Refresh the snapshot if the polling interval elapsed (called every second by the cron).
+        """
+        if self.console.time() >= self._next:
+            self.refresh()
+
+    def refresh(self, maxRetries=None):
+        """
+        Query the game server and update the snapshot.
+        :param maxRetries: How many times the query has to be retried upon failure
+        :return: True if the snapshot has been updated, False otherwise
+        """
+        with self._lock:
+            self._next = self.console.time() + self.interval
+            players = self.reader(maxRetries)
+            if players is None:
+                # no reply: keep the previous table, the next poll will try again
+                return False
+            previous, self.players = self.players, players
+            self.updated = self.console.time()
+
+        if self._subscribers:
+            self._notify(previous, players)
+        return True
+
+    def _notify(self, previous, players):
+        """
+        Send the differences between two snapshots to the subscribers.
+        """
+        joined = []
+        pings = {}
+        for slot, row in players.items():
+            old = previous.get(slot)
+            if old is None or old.get('guid') != row.get('guid'):
+                joined.append(slot)
+            elif old.get('ping') != row.get('ping'):
+                pings[slot] = (old.get('ping'), row.get('ping'))
+        left = [slot for slot, row in previous.items()
+                if slot not in players or players[slot].get('guid') != row.get('guid')]
+
+        if joined or left or pings:
+            for callback in list(self._subscribers):
+                try:
+                    callback(joined, left, pings)
+                except Exception as msg:
+                    self.console.error('Snapshot subscriber %s failed: %s\n%s', callback, msg,
+                                       extract_tb(sys.exc_info()[2]))
+
+    def invalidate(self):
+        """
+        Mark the snapshot as out of date: the next call to get() queries the game server
+        (i.e. a client connected and is not in the table yet).
+        """
+        self.updated = 0
+        self._next = 0
+
+    def get(self, maxRetries=None):
+        """
+        Return the player table, querying the game server first if the snapshot is out of date
+        (no poll in the last two intervals).
+        :param maxRetries: How many times the query has to be retried upon failure
+        :return: A dict mapping slots to player rows (do not modify it)
+        """
+        if self.console.time() - self.updated > self.interval * 2:
+            self.refresh(maxRetries)
+        return self.players
@@ -17,7 +17,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
 
 __author__ = 'Courgette'
-__version__ = '1.2'
+__version__ = '1.5'
 
 PROTOCOLS = ('mysql', 'sqlite', 'postgresql')
 
@@ -41,7 +41,7 @@ class Storage(object):
     def getClient(self, client):
         raise NotImplementedError
     
-    def getClientsMatching(self, match):
+    def getClientsMatching(self, match, console=None):
         raise NotImplementedError
     
     def setClient(self, client):
@@ -88,6 +88,9 @@ class Storage(object):
     
     def numPenalties(self, client, type='Ban'):
         raise NotImplementedError
+
+    def getClientPenaltySummary(self, client):
+        raise NotImplementedError
     
     def getGroups(self):
         raise NotImplementedError
@@ -95,6 +98,15 @@ class Storage(object):
     def getGroup(self, group):
         raise NotImplementedError
 
+    def setGroup(self, group):
+        raise NotImplementedError
+
+    def getGroupRegistry(self):
+        raise NotImplementedError
+
+    def refreshGroups(self):
+        raise NotImplementedError
+
     def getTables(self):
         raise NotImplementedError
 
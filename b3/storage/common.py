@@ -23,21 +23,25 @@
 # ################################################################### #
 
 import b3
+import copy
 import os
 import re
 import sys
+import weakref
 try:
     import thread
 except ImportError:
     import _thread as thread
 
-from b3.clients import Client
+from b3.clients import ClientRecord
 from b3.clients import ClientBan
 from b3.clients import ClientKick
 from b3.clients import ClientNotice
 from b3.clients import ClientTempBan
 from b3.clients import ClientWarning
+from b3.clients import GroupRegistry
 from b3.clients import Penalty
+from b3.clients import PenaltySummary
 from b3.querybuilder import QueryBuilder
 from b3.storage import Storage
 from b3.storage.cursor import Cursor as DBCursor
@@ -56,6 +60,9 @@ class DatabaseStorage(Storage):
     dsn = None
     dsnDict = None
 
+    # seconds between two checks of a client penalties version stamp
+    penaltySummaryTTL = 60
+
     def __init__(self, dsn, dsnDict, console):
         """
         Object constructor.
@@ -68,6 +75,7 @@ class DatabaseStorage(Storage):
         self.console = console
         self.db = None
         self._lock = thread.allocate_lock()
+        self._penaltySummaries = weakref.WeakValueDictionary()
 
     ####################################################################################################################
     #                                                                                                                  #
@@ -154,9 +162,10 @@ class DatabaseStorage(Storage):
             return client
 
         except Exception:
-            # query failed, try local cache
-            if self.console.config.has_option('admins_cache', client.guid):
-                data = self.console.config.get('admins_cache', client.guid, True)
+            # query failed, try local cache (in the config of the game server the client belongs to)
+            config = getattr(client.console or self.console, 'config', None)
+            if config is not None and config.has_option('admins_cache', client.guid):
+                data = config.get('admins_cache', client.guid, True)
                 self.console.debug('pulling user form admins_cache %s' % data)
                 cid, name, level = data.split(',')
                 client.id = cid.strip()
@@ -166,10 +175,11 @@ class DatabaseStorage(Storage):
             else:
                 raise KeyError('no client matching guid %s in admins_cache' % client.guid)
 
-    def getClientsMatching(self, match):
+    def getClientsMatching(self, match, console=None):
         """
         Return a list of clients matching the given data:
         :param match: The data to match clients against.
+        :param console: The console the client records are bound to (the storage console by default)
         """
         self.console.debug('Storage: getClientsMatching %s' % match)
         cursor = self.query(QueryBuilder(self.db).SelectQuery('*', 'clients', match, 'time_edit DESC', 5))
@@ -177,10 +187,7 @@ class DatabaseStorage(Storage):
         clients = []
         while not cursor.EOF:
             g = cursor.getRow()
-            client = Client()
-            for k, v in g.items():
-                setattr(client, self.getVar(k), v)
-            clients.append(client)
+            clients.append(ClientRecord(console or self.console, **dict((self.getVar(k), v) for k, v in g.items())))
             cursor.moveNext()
 
         cursor.close()
@@ -402,6 +409,10 @@ class DatabaseStorage(Storage):
         if penalty.keyword and not re.match(r'^[a-z0-9]+$', penalty.keyword, re.I):
             penalty.keyword = ''
 
+        # keep the penalty as given (the reason is re-encoded below) for the client penalty summary
+        summary = self._penaltySummaries.get(int(penalty.clientId or 0))
+        saved = copy.copy(penalty) if summary is not None else None
+
         if penalty.reason:
             # decode the reason data, as the name may need it
             if hasattr(self.console, "encoding") and self.console.encoding:
@@ -420,6 +431,7 @@ class DatabaseStorage(Storage):
 
         self.console.debug('Storage: setClientPenalty data %s' % data)
 
+        added = not penalty.id
         if penalty.id:
             self.query(QueryBuilder(self.db).UpdateQuery(data, 'penalties', {'id': penalty.id}))
         else:
@@ -427,6 +439,19 @@ class DatabaseStorage(Storage):
             penalty.id = cursor.lastrowid
             cursor.close()
 
+        if saved is not None:
+            saved.id = penalty.id
+            disabled = 1 if penalty.inactive else 0
+            if added:
+                summary.advance(1, penalty.id, penalty.timeEdit, disabled)
+            elif summary.isActive(penalty.id):
+                # an active penalty has been edited (and maybe disabled)
+                summary.advance(0, 0, penalty.timeEdit, disabled)
+            else:
+                # the previous state of the penalty is unknown: check the storage on next read
+                summary.stamp = None
+            summary.update(saved)
+
         return penalty.id
 
     def getClientPenalty(self, penalty):
@@ -503,8 +528,18 @@ class DatabaseStorage(Storage):
         :param client: The client whose penalties we want to disable.
         :param type: The type of the penalties we want to disable.
         """
-        self.query(QueryBuilder(self.db).UpdateQuery({'inactive': 1}, 'penalties',
-                                                     {'type': type, 'client_id': client.id, 'inactive': 0}))
+        now = int(time())
+        cursor = self.query(QueryBuilder(self.db).UpdateQuery({'inactive': 1, 'time_edit': now}, 'penalties',
+                                                              {'type': type, 'client_id': client.id, 'inactive': 0}))
+        summary = self._penaltySummaries.get(int(client.id or 0))
+        if summary is not None:
+            summary.disable(type)
+            if cursor.rowcount >= 0:
+                summary.advance(0, 0, now, cursor.rowcount)
+            else:
+                # the amount of penalties disabled is unknown: check the storage on next read
+                summary.stamp = None
+        cursor.close()
 
     def numPenalties(self, client, type='Ban'):
         """
@@ -520,63 +555,151 @@ class DatabaseStorage(Storage):
         cursor.close()
         return value
 
-    _groups = None
+    def getClientPenaltyStamp(self, client):
+        """
+        Return the version stamp of the penalties of the given client: it changes whenever a penalty of the client
+        is added, edited or disabled, by this process or by any other one using the same database.
+        :param client: The client whose penalties version stamp we want to retrieve.
+        :return: A tuple (number of penalties, last penalty id, last edit time, number of inactive penalties)
+        """
+        cursor = self.query("""SELECT COUNT(id) total, MAX(id) last_id, MAX(time_edit) last_edit, """
+                            """SUM(inactive) disabled FROM penalties WHERE client_id = %s""" % int(client.id))
+        row = cursor.getOneRow() or {}
+        cursor.close()
+        return tuple(int(row.get(k) or 0) for k in ('total', 'last_id', 'last_edit', 'disabled'))
+
+    def getClientPenaltySummary(self, client):
+        """
+        Return the summary of the active bans and warnings of the given client.
+        The summary is loaded once, shared by all the objects representing the client, and updated in memory when
+        penalties are saved or disabled. Every penaltySummaryTTL seconds the penalties version stamp is checked and
+        the summary reloaded if the penalties changed (e.g. another B3 instance sharing the database warned the
+        client).
+        :param client: The client whose penalty summary we want to retrieve.
+        :return: A PenaltySummary instance
+        """
+        summary = self._penaltySummaries.get(int(client.id))
+        now = time()
+        if summary is not None and summary.stamp is not None and now - summary.checked < self.penaltySummaryTTL:
+            return summary
+
+        stamp = self.getClientPenaltyStamp(client)
+        if summary is not None and summary.stamp == stamp:
+            summary.checked = now
+            return summary
+
+        self.console.debug('Storage: getClientPenaltySummary %s' % client)
+        where = QueryBuilder(self.db).WhereClause({'type': PenaltySummary.TYPES, 'client_id': client.id,
+                                                   'inactive': 0})
+        where += ' AND (time_expire = -1 OR time_expire > %s)' % int(now)
+        cursor = self.query(QueryBuilder(self.db).SelectQuery('*', 'penalties', where, 'time_add DESC'))
+        penalties = []
+        while not cursor.EOF:
+            penalties.append(self._createPenaltyFromRow(cursor.getRow()))
+            cursor.moveNext()
+        cursor.close()
+
+        summary = PenaltySummary(client.id, penalties, stamp)
+        self._penaltySummaries[int(client.id)] = summary
+        return summary
+
+    _groupRegistry = None
+
+    def getGroupRegistry(self):
+        """
+        Return the registry of the client groups, loading it from the storage on first use.
+        The registry is shared by every parser using this storage: group lookups don't query the database.
+        """
+        registry = self._groupRegistry
+        if registry is None:
+            registry = self.refreshGroups()
+        return registry
+
+    def refreshGroups(self):
+        """
+        Reload the client groups from the storage (to be called when the groups table is changed by another
+        process). Clients notice the new registry and recompute their groups and level on next access.
+        :return: The new group registry.
+        """
+        cursor = self.query(QueryBuilder(self.db).SelectQuery('*', 'groups', None, 'level'))
+        groups = []
+        while not cursor.EOF:
+            row = cursor.getRow()
+            group = b3.clients.Group()
+            group.id = int(row['id'])
+            group.name = row['name']
+            group.keyword = row['keyword']
+            group.level = int(row['level'])
+            group.timeAdd = int(row['time_add'])
+            group.timeEdit = int(row['time_edit'])
+            groups.append(group)
+            cursor.moveNext()
+        cursor.close()
+
+        self._groupRegistry = GroupRegistry(groups)
+        self.console.debug('Storage: loaded %s client groups' % len(groups))
+        return self._groupRegistry
 
     def getGroups(self):
         """
         Return a list of available client groups.
         """
-        if not self._groups:
-            cursor = self.query(QueryBuilder(self.db).SelectQuery('*', 'groups', None, 'level'))
-            self._groups = []
-            while not cursor.EOF:
-                row = cursor.getRow()
-                group = b3.clients.Group()
-                group.id = int(row['id'])
-                group.name = row['name']
-                group.keyword = row['keyword']
-                group.level = int(row['level'])
-                group.timeAdd = int(row['time_add'])
-                group.timeEdit = int(row['time_edit'])
-                self._groups.append(group)
-                cursor.moveNext()
-            cursor.close()
-
-        return self._groups
+        return list(self.getGroupRegistry().groups)
 
     def getGroup(self, group):
         """
-        Return a group object fetching data from the storage layer.
+        Return a group object fetching data from the group registry.
         :param group: A group object with level or keyword filled.
         :return: The group instance given in input with all the fields set.
         """
+        registry = self.getGroupRegistry()
         if hasattr(group, 'keyword') and group.keyword:
-            query = QueryBuilder(self.db).SelectQuery('*', 'groups', dict(keyword=group.keyword), None, 1)
-            self.console.verbose2(query)
-            cursor = self.query(query)
-            row = cursor.getOneRow()
-            if not row:
-                raise KeyError('no group matching keyword: %s' % group.keyword)
-
+            found = registry.getByKeyword(group.keyword)
         elif hasattr(group, 'level') and group.level >= 0:
-            query = QueryBuilder(self.db).SelectQuery('*', 'groups', dict(level=group.level), None, 1)
-            self.console.verbose2(query)
-            cursor = self.query(query)
-            row = cursor.getOneRow()
-            if not row:
-                raise KeyError('no group matching level: %s' % group.level)
+            found = registry.getByLevel(group.level)
         else:
             raise KeyError("cannot find Group as no keyword/level provided")
 
-        group.id = int(row['id'])
-        group.name = row['name']
-        group.keyword = row['keyword']
-        group.level = int(row['level'])
-        group.timeAdd = int(row['time_add'])
-        group.timeEdit = int(row['time_edit'])
+        group.id = found.id
+        group.name = found.name
+        group.keyword = found.keyword
+        group.level = found.level
+        group.timeAdd = found.timeAdd
+        group.timeEdit = found.timeEdit
 
         return group
 
+    def setGroup(self, group):
+        """
+        Insert/update a group in the storage and reload the group registry.
+        :param group: The group to be saved.
+        :return: The ID of the group stored into the database.
+        """
+        self.console.debug('Storage: setGroup %s' % group)
+        data = {
+            'name': group.name,
+            'keyword': group.keyword,
+            'level': group.level,
+            'time_add': group.timeAdd,
+            'time_edit': group.timeEdit,
+        }
+
+        try:
+            self.getGroupRegistry().getById(group.id or None)
+        except KeyError:
+            # group ids are bits of the clients group_bits: keep the given one if any
+            if group.id:
+                data['id'] = group.id
+            cursor = self.query(QueryBuilder(self.db).InsertQuery(data, 'groups'))
+            if not group.id:
+                group.id = cursor.lastrowid
+            cursor.close()
+        else:
+            self.query(QueryBuilder(self.db).UpdateQuery(data, 'groups', {'id': group.id}))
+
+        self.refreshGroups()
+        return group.id
+
     def truncateTable(self, table):
         """
         Empty a database table (or a collection of tables)
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.1'
+
+import copy
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+import b3
+import b3.config
+import b3.storage
+
+from b3.functions import splitDSN
+
+EXIT_RESTART = 221
+EXIT_DIE = 222
+
+
+class ServerInstance(object):
+    """
+    A game server managed by the supervisor: one parser instance running in its own thread.
+    """
+    def __init__(self, supervisor, config):
+        """
+        Object constructor.
+        :param supervisor: The Supervisor instance
+        :param config: The main configuration file of this game server (b3.config.MainConfig)
+        """
+        self.supervisor = supervisor
+        self.config = config
+        self.name = os.path.basename(config.fileName)
+        self.console = None
+        self.thread = None
+        self.exitcode = None
+        self.restarts = 0
+
+    def create(self):
+        """
+        Create the parser instance of this game server.
+        """
+        stdout, stderr = sys.stdout, sys.stderr
+        try:
+            parser = b3.loadParser(self.config.get('b3', 'parser'))
+            self.console = parser(self.config, self.supervisor.getOptions(self.name))
+        finally:
+            # every parser redirects the standard streams to its own log file: restore
+            # them so that the next parser writes its startup messages on the screen
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def start(self):
+        """
+        Start the parser in a separate thread.
+        """
+        self.exitcode = None
+        self.thread = threading.Thread(target=self.run, name='b3-%s' % self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """
+        Parser thread: run the parser until it exits and store its exit status.
+        """
+        try:
+            self.console.start()
+            self.exitcode = 0
+        except SystemExit as e:
+            self.exitcode = e.code or 0
+        except Exception as msg:
+            self.console.error('Unhandled exception: %s', msg, exc_info=msg)
+            self.exitcode = 223
+
+    def isAlive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+class StorageConsole(object):
+    """
+    Neutral console of a storage shared by several parsers: the storage is not bound to the first game server
+    using it. Storage messages are written in the log of every game server sharing the storage, tagged with the
+    logger name (b3.storage), and client objects built by the storage are bound to the console of the caller
+    (see Storage.getClientsMatching).
+    """
+    config = None
+    encoding = None
+    storage = None
+
+    def __init__(self):
+        """
+        Object constructor.
+        """
+        self.log = logging.getLogger('b3.storage')
+        self.log.propagate = False
+        self.screen = sys.stdout
+        self._consoles = []
+
+    def addConsole(self, console):
+        """
+        Write the storage messages in the log of the given console as well.
+        :param console: A console sharing the storage
+        """
+        if console in self._consoles:
+            return
+        self._consoles.append(console)
+        for handler in console.log.handlers:
+            self.log.addHandler(handler)
+        self.log.setLevel(min(c.log.getEffectiveLevel() for c in self._consoles))
+
+    def time(self):
+        return int(time.time())
+
+    def debug(self, msg, *args, **kwargs):
+        self.log.debug(msg, *args, **kwargs)
+
+    def bot(self, msg, *args, **kwargs):
+        self.log.bot(msg, *args, **kwargs)
+
+    def verbose(self, msg, *args, **kwargs):
+        self.log.verbose(msg, *args, **kwargs)
+
+    def verbose2(self, msg, *args, **kwargs):
+        self.log.verbose2(msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log.info(msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log.warning(msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.log.error(msg, *args, **kwargs)
+
+    def critical(self, msg, *args, **kwargs):
+        # logs and raises SystemExit: the storage can't be used (i.e. missing database tables)
+        self.log.critical(msg, *args, **kwargs)
+
+
+class Supervisor(object):
+    """
+    Host several game servers in a single B3 process.
+
+    Every game server gets its own parser instance, with its own plugin instances, clients and events, running
+    in its own thread. Storage instances (and thus database connections and the groups cache they hold) are shared
+    by all the parsers using the same database. Caches kept at plugin class level (i.e: geolocation, vpnblocker)
+    are naturally shared since all the plugins are loaded once in the same interpreter.
+    """
+    def __init__(self, configs, options):
+        """
+        Object constructor.
+        :param configs: The list of main configuration files (b3.config.MainConfig), one per game server
+        :param options: The command line options
+        """
+        self.options = options
+        self.servers = [ServerInstance(self, config) for config in configs]
+        self.working = True
+        self._storages = {}
+        self._lock = threading.Lock()
+
+    def getOptions(self, server=None):
+        """
+        Return the command line options to give to each parser.
+        :param server: The name of the game server the parser is created for (names its logger)
+        """
+        options = copy.copy(self.options)
+        options.supervisor = self
+        options.server = server
+        return options
+
+    def getStorage(self, dsn, console):
+        """
+        Return the storage instance shared by all the parsers using the given database, connecting it if needed.
+        :param dsn: The database connection string
+        :param console: The console instance requesting the storage
+        :raise AttributeError: If we don't manage to setup a valid storage module
+        :raise ImportError: If the system misses the necessary libraries needed to setup the storage module
+        """
+        with self._lock:
+            storage = self._storages.get(dsn)
+            if storage is None:
+                # bound to a neutral console rather than to the first game server using it
+                neutral = StorageConsole()
+                neutral.addConsole(console)
+                storage = self._storages[dsn] = b3.storage.getStorage(dsn=dsn, dsnDict=splitDSN(dsn), console=neutral)
+                neutral.storage = storage
+                storage.connect()
+            else:
+                storage.console.addConsole(console)
+                console.bot('Using storage shared with other game servers')
+            return storage
+
+    def start(self):
+        """
+        Create and start all the parsers, then wait for them to exit.
+        """
+        for server in self.servers:
+            sys.stdout.write('Starting server  : %s\n' % server.name)
+            sys.stdout.flush()
+            server.create()
+
+        b3.console = self.servers[0].console
+
+        def termSignalHandler(signum, frame):
+            """
+            Define the signal handler so to handle B3 shutdown properly.
+            """
+            self.shutdown()
+            raise SystemExit(EXIT_DIE)
+
+        try:
+            signal.signal(signal.SIGTERM, termSignalHandler)
+        except Exception:
+            pass
+
+        for server in self.servers:
+            server.start()
+
+        try:
+            self.supervise()
+        except KeyboardInterrupt:
+            self.shutdown()
+            print('Goodbye')
+        finally:
+            self.shutdownStorages()
+
+    def supervise(self):
+        """
+        Watch the parser threads: restart the parsers asking for a restart, until all of them stopped.
+        """
+        while self.working:
+            alive = 0
+            for server in self.servers:
+                if server.isAlive():
+                    alive += 1
+                elif server.exitcode == EXIT_RESTART:
+                    server.restarts += 1
+                    sys.stdout.write('Restarting server: %s (%s)\n' % (server.name, server.restarts))
+                    sys.stdout.flush()
+                    try:
+                        server.create()
+                        server.start()
+                        alive += 1
+                    except (Exception, SystemExit):
+                        traceback.print_exc()
+                        server.exitcode = 223
+                elif server.exitcode is not None:
+                    sys.stdout.write('Server %s exited with status: %s\n' % (server.name, server.exitcode))
+                    sys.stdout.flush()
+                    # report only once
+                    server.exitcode = None
+                    server.thread = None
+
+            if not alive:
+                break
+
+            time.sleep(1)
+
+    def shutdown(self):
+        """
+        Shutdown all the parsers.
+        """
+        self.working = False
+        for server in self.servers:
+            if server.console and server.isAlive():
+                server.console.bot('Supervisor shutting down')
+                server.console.shutdown()
+
+    def shutdownStorages(self):
+        """
+        Close the shared storage connections.
+        """
+        for storage in list(self._storages.values()):
+            storage.shutdown()
+        self._storages.clear()
+
+
+def start(configs, options):
+    """
+    Start B3 in supervisor mode.
+    :param configs: The list of main configuration files (b3.config.MainConfig), one per game server
+    :param options: The command line options
+    """
+    sys.stdout.write('Starting B3      : %s (supervisor mode, %s servers)\n' % (b3.getB3versionString(), len(configs)))
+    sys.stdout.flush()
+    # process wide fallback only: the parsers and their plugins resolve @conf paths against their own main config
+    b3.confdir = os.path.dirname(configs[0].fileName)
+    Supervisor(configs, options).start()
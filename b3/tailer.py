@@ -0,0 +1,712 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.5'
+
+import collections
+import errno
+import json
+import os
+import re
+import select
+import socket
+import struct
+import sys
+import time
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+
+TAILER_AUTO = 'auto'
+TAILER_INOTIFY = 'inotify'
+TAILER_POLL = 'poll'
+TAILER_UDP = 'udp'
+
+TAILERS = (TAILER_AUTO, TAILER_INOTIFY, TAILER_POLL)
+
+
+class Tailer(object):
+    """
+    Follow the game log file and return the lines appended to it in batches.
+    The file is identified by its inode: when the inode behind the log path changes
+    (log rotation) or the file shrinks below our read position (truncation) the
+    tailer reopens/rewinds the file and keeps following the new content.
+    Lines are only returned once terminated: a line the game server is still writing is kept aside
+    until the rest of it shows up. The base class polls the file (see wait()).
+    """
+    name = None
+
+    console = None
+    file = None
+    path = None
+    inode = None
+    _partial = ''
+
+    def __init__(self, console, path, seek=True):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param path: The path of the game log file
+        :param seek: Whether to start reading from the end of the file
+        """
+        self.console = console
+        self.path = path
+        self.open(seek)
+
+    def open(self, seek=True):
+        """
+        Open the game log file.
+        :param seek: Whether to move the read position at the end of the file
+        """
+        self.file = open(self.path, 'r')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self._partial = ''
+        if seek:
+            self.file.seek(0, os.SEEK_END)
+
+    def _closeFile(self):
+        """
+        Close the game log file handle.
+        """
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        """
+        Release the game log file.
+        """
+        self._closeFile()
+
+    def tell(self):
+        """
+        Return the current read position in the game log file (the start of the unterminated line if any).
+        """
+        if self._partial:
+            return self.file.tell() - len(self._partial.encode(self.file.encoding or 'utf-8', 'replace'))
+        return self.file.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Move the read position in the game log file.
+        :param offset: The offset
+        :param whence: The reference position (os.SEEK_SET, os.SEEK_CUR, os.SEEK_END)
+        """
+        self.file.seek(offset, whence)
+        self._partial = ''
+
+    def fileno(self):
+        """
+        Return the file descriptor to watch for game log changes, or None if the tailer needs to poll.
+        """
+        return None
+
+    def consume(self):
+        """
+        Consume the notifications pending on the descriptor returned by fileno().
+        :return: True if new data is likely to be available in the game log
+        """
+        return True
+
+    def size(self):
+        """
+        Return the current size of the game log file.
+        """
+        return os.fstat(self.file.fileno()).st_size
+
+    def resume(self, inode, offset):
+        """
+        Move the read position to a previously checkpointed offset.
+        :param inode: The inode of the game log file when the checkpoint was taken
+        :param offset: The checkpointed read position
+        :return: True if the read position has been restored, False if the checkpoint does not match the file
+        """
+        if inode != self.inode or offset > self.size():
+            return False
+        self.seek(offset, os.SEEK_SET)
+        return True
+
+    def _readlines(self):
+        """
+        Read all the complete lines available in the game log file.
+        The trailing unterminated line (if any) is kept aside and completed by the next read.
+        """
+        if sys.platform == 'darwin':
+            # readlines() is not reliable on darwin once it hit EOF
+            lines = []
+            line = self.file.readline()
+            while line:
+                lines.append(line)
+                line = self.file.readline()
+        else:
+            lines = self.file.readlines()
+
+        if not lines:
+            return lines
+
+        if self._partial:
+            lines[0] = self._partial + lines[0]
+            self._partial = ''
+
+        if not lines[-1].endswith('\n'):
+            # the game server is halfway through writing this line
+            self._partial = lines.pop()
+
+        return lines
+
+    def check(self):
+        """
+        Detect rotation or truncation of the game log file.
+        :return: True if the file has been reopened or rewinded, False otherwise
+        """
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            # the file is being rotated: keep reading from the old handle until it shows up again
+            return False
+
+        if inode != self.inode:
+            self.console.debug('Tailer: game log inode changed (%s -> %s): the log has been rotated, '
+                               'B3 will now follow the new file' % (self.inode, inode))
+            if self._partial:
+                self.console.debug('Tailer: discarding unterminated line of the old game log: %r' % self._partial)
+            self._closeFile()
+            self.open(seek=False)
+            return True
+
+        size = os.fstat(self.file.fileno()).st_size
+        if self.file.tell() > size:
+            self.console.debug('Tailer: game log is suddenly smaller than it was before (%s bytes, now %s), '
+                               'the log was probably emptied: B3 will now read it from the beginning' %
+                               (self.file.tell(), size))
+            self.seek(0, os.SEEK_SET)
+            return True
+
+        return False
+
+    def read(self):
+        """
+        Return the batch of lines appended to the game log since the last call.
+        """
+        lines = self._readlines()
+        if not lines and self.check():
+            # drain what has been written on the new file so far
+            lines = self._readlines()
+        return lines
+
+    def wait(self, timeout):
+        """
+        Block until new data is likely to be available or the timeout expires.
+        Without change notifications we can only sleep until the next poll.
+        :param timeout: The maximum amount of seconds to wait
+        """
+        time.sleep(timeout)
+
+
+class LogCheckpoint(object):
+    """
+    Store the game log read position (inode and offset) on disk, so that B3 can resume reading
+    the game log where it stopped instead of skipping what has been written while it was down.
+    """
+    def __init__(self, path):
+        """
+        Object constructor.
+        :param path: The path of the checkpoint file
+        """
+        self.path = path
+
+    def load(self):
+        """
+        Load the checkpoint.
+        :return: A dict with keys inode, offset and time or None if there is no valid checkpoint
+        """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            return dict(inode=int(data['inode']), offset=int(data['offset']), time=float(data['time']))
+        except (IOError, OSError, ValueError, TypeError, KeyError):
+            return None
+
+    def save(self, inode, offset):
+        """
+        Store the checkpoint (atomically: a crash never leaves a truncated checkpoint file behind).
+        :param inode: The inode of the game log file
+        :param offset: The read position in the game log file
+        """
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as f:
+            json.dump(dict(inode=inode, offset=offset, time=time.time()), f)
+        os.replace(tmp, self.path)
+
+
+class PollingTailer(Tailer):
+    """
+    Portable tailer: simply sleeps between consecutive reads (see Tailer.wait).
+    """
+    name = TAILER_POLL
+
+
+########################################################################################################################
+#                                                                                                                      #
+#   INOTIFY SUPPORT (LINUX ONLY)                                                                                       #
+#                                                                                                                      #
+########################################################################################################################
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+_INOTIFY_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_INOTIFY_ROTATE = IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_Q_OVERFLOW
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _load_libc():
+    """
+    Load the C library exposing the inotify API.
+    :return: The library handle or None if inotify is not available
+    """
+    if ctypes is None or not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    """
+    Return True if the inotify API can be used on this system.
+    """
+    return _libc is not None
+
+
+class InotifyTailer(Tailer):
+    """
+    Linux tailer: sleeps on an inotify descriptor watching the game log directory, so that
+    it wakes up as soon as the game server appends data, rotates or truncates the log.
+    """
+    name = TAILER_INOTIFY
+
+    _fd = None
+    _filename = None
+    _rotated = False
+
+    def __init__(self, console, path, seek=True):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param path: The path of the game log file
+        :param seek: Whether to start reading from the end of the file
+        :raise OSError: If the inotify descriptor cannot be initialized
+        """
+        self._filename = os.fsencode(os.path.basename(path))
+        self._fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, 'inotify_init1: %s' % os.strerror(err))
+        # watch the directory rather than the file: this way we keep being notified after a rotation
+        directory = os.path.dirname(os.path.abspath(path))
+        if _libc.inotify_add_watch(self._fd, os.fsencode(directory), _INOTIFY_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            self._fd = None
+            raise OSError(err, 'inotify_add_watch %s: %s' % (directory, os.strerror(err)))
+        Tailer.__init__(self, console, path, seek)
+
+    def close(self):
+        """
+        Release the game log file and the inotify descriptor.
+        """
+        self._closeFile()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def fileno(self):
+        """
+        Return the inotify descriptor.
+        """
+        return self._fd
+
+    def consume(self):
+        """
+        Consume the pending inotify events.
+        :return: True if at least one event concerns the game log file
+        """
+        return self._drain()
+
+    def _drain(self):
+        """
+        Consume pending inotify events.
+        :return: True if at least one event concerns the game log file
+        """
+        relevant = False
+        while True:
+            try:
+                buf = os.read(self._fd, 4096)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not buf:
+                break
+            pos = 0
+            while pos + _INOTIFY_EVENT.size <= len(buf):
+                wd, mask, cookie, length = _INOTIFY_EVENT.unpack_from(buf, pos)
+                name = buf[pos + _INOTIFY_EVENT.size:pos + _INOTIFY_EVENT.size + length].rstrip(b'\0')
+                pos += _INOTIFY_EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    self._rotated = relevant = True
+                elif name == self._filename:
+                    relevant = True
+                    if mask & _INOTIFY_ROTATE:
+                        self._rotated = True
+        return relevant
+
+    def read(self):
+        """
+        Return the batch of lines appended to the game log since the last call.
+        """
+        lines = self._readlines()
+        if self._rotated:
+            self._rotated = False
+            if self.check():
+                lines += self._readlines()
+        elif not lines:
+            # we may have missed a truncation (no inotify event is generated for ftruncate on some filesystems)
+            size = os.fstat(self.file.fileno()).st_size
+            if self.file.tell() > size and self.check():
+                lines = self._readlines()
+        return lines
+
+    def wait(self, timeout):
+        """
+        Block until the game log directory reports a change on the game log or the timeout expires.
+        :param timeout: The maximum amount of seconds to wait
+        """
+        end = time.time() + timeout
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return
+            try:
+                readables, writeables, errors = select.select([self._fd], [], [], remaining)
+            except (OSError, select.error) as e:
+                if getattr(e, 'errno', None) == errno.EINTR:
+                    continue
+                raise
+            if not readables or self._drain():
+                return
+
+
+########################################################################################################################
+#                                                                                                                      #
+#   UDP LOG STREAMS                                                                                                    #
+#                                                                                                                      #
+########################################################################################################################
+
+# Source style log datagram: \xff\xff\xff\xff + header + log line(s) + [\n] + [\x00] where header is one of:
+#   RL            standard log line
+#   S<secret>L    log line sent by a server using sv_logsecret
+#   RLS<seq>      log line carrying a sequence number: no game server sends it, only custom senders such as
+#                 b3/tools/emulator.py do (it is what makes reordering possible)
+_reUdpHeader = re.compile(br'^\xff\xff\xff\xff(?:RLS(?P<seq>[0-9]+)|RL|S(?P<secret>[0-9]+)L) ?', re.DOTALL)
+
+
+class UdpTailer(object):
+    """
+    Receive game log lines streamed by the game server over UDP (logaddress_add / g_logSync style streams).
+
+    The socket is non blocking: every read() drains the datagrams received so far and returns their lines.
+    Game servers don't number their datagrams (RL and S<secret>L headers): those are released in arrival order,
+    out of order datagrams can't be detected and a datagram identical to one received from the same source less
+    than reorder_window seconds before is discarded as a duplicate. Only the datagrams carrying a sequence number
+    (RLS<seq> header, sent by custom senders such as b3/tools/emulator.py) are released in sequence order:
+    duplicates are discarded and a missing datagram is waited for at most reorder_window seconds before the stream
+    moves on.
+    """
+    name = TAILER_UDP
+
+    file = None
+    inode = None
+
+    def __init__(self, console, host, port, secret=None, sources=None, reorder_window=0.05, stats_interval=60):
+        """
+        Object constructor.
+        :param console: The console instance
+        :param host: The address to listen on
+        :param port: The UDP port to listen on
+        :param secret: The log secret the game server signs datagrams with (sv_logsecret)
+        :param sources: A list of ip addresses allowed to send log datagrams (None to accept any)
+        :param reorder_window: The maximum amount of seconds a missing datagram is waited for (and a duplicate
+                               datagram without sequence number is detected within)
+        :param stats_interval: How often (in seconds) packet statistics are logged
+        """
+        self.console = console
+        self.secret = secret
+        self.sources = set(sources) if sources else None
+        self.reorder_window = reorder_window
+        self.stats_interval = stats_interval
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.socket.bind((host, port))
+        self.socket.setblocking(False)
+        self.path = 'udp://%s:%s' % self.socket.getsockname()
+        self._lines = []
+        self._pending = {}
+        self._nextSeq = None
+        self._recent = collections.OrderedDict()  # (source, datagram) -> arrival time of the unsequenced datagrams
+        self._statsStart = time.time()
+        self._stats = dict(packets=0, lines=0, duplicates=0, reordered=0, lost=0, invalid=0)
+        self._rate = 0.0
+
+    def fileno(self):
+        """
+        Return the socket descriptor.
+        """
+        return self.socket.fileno()
+
+    def consume(self):
+        """
+        Receive the pending datagrams.
+        :return: True if new lines are available
+        """
+        self._receive()
+        return bool(self._lines)
+
+    def close(self):
+        """
+        Release the socket.
+        """
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+
+    def tell(self):
+        return 0
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Discard the lines received so far (only seeking to the end of the stream makes sense).
+        """
+        self._receive()
+        self._lines = []
+
+    def packetsPerSecond(self):
+        """
+        Return the rate of datagrams received over the last statistics interval.
+        """
+        return self._rate
+
+    def _receive(self):
+        """
+        Drain the socket.
+        """
+        while True:
+            try:
+                data, address = self.socket.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                break
+            except socket.error as e:
+                if e.args and e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    break
+                raise
+
+            self._stats['packets'] += 1
+            if self.sources is not None and address[0] not in self.sources:
+                self._stats['invalid'] += 1
+                continue
+
+            m = _reUdpHeader.match(data)
+            if not m or (self.secret is not None and m.group('secret') != self.secret):
+                self._stats['invalid'] += 1
+                continue
+
+            payload = data[m.end():].rstrip(b'\x00')
+            lines = [x.decode(self.console.encoding or 'latin-1', 'replace')
+                     for x in payload.split(b'\n') if x.strip()]
+            seq = m.group('seq')
+            if seq is not None:
+                self._reorder(int(seq), lines)
+            elif not self._duplicate(address, data):
+                self._lines.extend(lines)
+
+        self._release()
+
+    def _duplicate(self, address, data):
+        """
+        Tell whether a datagram without sequence number is a copy of one received from the same source less than
+        reorder_window seconds ago: a game server doesn't log the very same lines twice within such a short time,
+        the network does duplicate datagrams.
+        """
+        if not self.reorder_window:
+            return False
+
+        now = time.time()
+        while self._recent:
+            key, received = next(iter(self._recent.items()))
+            if now - received < self.reorder_window:
+                break
+            del self._recent[key]
+
+        key = (address, data)
+        if key in self._recent:
+            self._stats['duplicates'] += 1
+            return True
+        self._recent[key] = now
+        return False
+
+    def _reorder(self, seq, lines):
+        """
+        Queue a sequenced datagram in the reorder buffer.
+        """
+        if self._nextSeq is None or seq < self._nextSeq - 1000:
+            # first datagram or the game server restarted its sequence
+            self._nextSeq = seq
+            self._pending.clear()
+
+        if seq < self._nextSeq or seq in self._pending:
+            self._stats['duplicates'] += 1
+            return
+
+        if seq != self._nextSeq:
+            self._stats['reordered'] += 1
+        self._pending[seq] = (time.time(), lines)
+
+    def _release(self):
+        """
+        Move in order datagrams from the reorder buffer to the lines buffer.
+        """
+        while self._pending:
+            if self._nextSeq in self._pending:
+                self._lines.extend(self._pending.pop(self._nextSeq)[1])
+                self._nextSeq += 1
+                continue
+
+            oldest = min(self._pending)
+            if time.time() - self._pending[oldest][0] < self.reorder_window:
+                # give the missing datagram(s) a chance to show up
+                break
+
+            self._stats['lost'] += oldest - self._nextSeq
+            self._nextSeq = oldest
+
+    def _dumpStats(self):
+        """
+        Compute the packets/sec rate and log the stream statistics.
+        """
+        now = time.time()
+        elapsed = now - self._statsStart
+        if elapsed < self.stats_interval:
+            return
+        self._rate = self._stats['packets'] / elapsed
+        self.console.debug('UDP log %s: %.1f packets/sec, %s lines, %s duplicates, %s reordered, %s lost, %s invalid',
+                           self.path, self._rate, self._stats['lines'], self._stats['duplicates'],
+                           self._stats['reordered'], self._stats['lost'], self._stats['invalid'])
+        self._statsStart = now
+        for k in self._stats:
+            self._stats[k] = 0
+
+    def read(self):
+        """
+        Return the batch of lines received since the last call.
+        """
+        self._receive()
+        lines, self._lines = self._lines, []
+        self._stats['lines'] += len(lines)
+        self._dumpStats()
+        return lines
+
+    def wait(self, timeout):
+        """
+        Block until a datagram is received or the timeout expires.
+        :param timeout: The maximum amount of seconds to wait
+        """
+        if self._pending:
+            # wake up in time to release datagrams waiting for a missing one
+            timeout = min(timeout, self.reorder_window)
+        try:
+            select.select([self.socket], [], [], timeout)
+        except (OSError, select.error) as e:
+            if getattr(e, 'errno', None) != errno.EINTR:
+                raise
+
+
+def getUdpTailer(console, url, secret=None, sources=None, reorder_window=0.05):
+    """
+    Return a tailer receiving the game log from an UDP stream.
+    :param console: The console instance
+    :param url: The stream url (udp://host:port)
+    :param secret: The log secret the game server signs datagrams with
+    :param sources: A list of ip addresses allowed to send log datagrams
+    :param reorder_window: The maximum amount of seconds a missing datagram is waited for
+    :raise ValueError: If the url is not valid
+    """
+    m = re.match(r'^udp://(?P<host>[^:/]*):(?P<port>[0-9]+)/?$', url)
+    if not m:
+        raise ValueError('invalid UDP game log url: %s (expected udp://host:port)' % url)
+    return UdpTailer(console, m.group('host') or '0.0.0.0', int(m.group('port')), secret=secret, sources=sources,
+                     reorder_window=reorder_window)
+
+
+def getTailer(console, path, seek=True, kind=TAILER_AUTO):
+    """
+    Return a tailer instance following the given game log file.
+    :param console: The console instance
+    :param path: The path of the game log file
+    :param seek: Whether to start reading from the end of the file
+    :param kind: The tailer implementation to use (auto, inotify, poll)
+    """
+    if kind not in TAILERS:
+        console.warning('Invalid log tailer specified: %s: falling back to %s' % (kind, TAILER_AUTO))
+        kind = TAILER_AUTO
+
+    if kind in (TAILER_AUTO, TAILER_INOTIFY):
+        if inotify_available():
+            try:
+                return InotifyTailer(console, path, seek)
+            except OSError as e:
+                console.warning('Could not setup inotify log tailer: %s: falling back to polling' % e)
+        elif kind == TAILER_INOTIFY:
+            console.warning('Inotify is not available on this system: falling back to polling')
+
+    return PollingTailer(console, path, seek)
@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+
+"""
+Local game server emulator used to load test B3 without a real game server.
+
+The emulator answers the q3 RCON protocol over UDP (status, say, tell, kick, clientkick, dumpuser, cvars, map)
+and appends game log lines (kills, damage, chat, item pickups, connections) for N simulated players at a
+configurable rate, either to a game log file or to an UDP log stream (game_log: udp://...). Some chat lines
+are B3 commands: the delay between the log line and the RCON reply B3 sends to the player is measured.
+
+    python -m b3.tools.emulator --game q3 --log /tmp/games.log --rcon-port 27960 --password secret \\
+                                --players 16 --rate 50 --duration 60
+
+Then point the B3 configuration to it (server/public_ip: 127.0.0.1, server/port: 27960, server/rcon_password,
+server/game_log) and start B3.
+"""
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.0'
+
+import argparse
+import collections
+import random
+import re
+import socket
+import sys
+import threading
+import time
+
+GAME_Q3 = 'q3'
+GAME_COD = 'cod'
+GAME_COD4 = 'cod4'
+
+GAMES = (GAME_Q3, GAME_COD, GAME_COD4)
+
+RCON_HEADER = b'\xff\xff\xff\xff'
+RCON_REPLY = RCON_HEADER + b'print\n'
+RCON_CHUNK = 1008  # the engine splits RCON replies in packets of at most 1008 characters
+
+_reRcon = re.compile(br'^\xff\xff\xff\xffrcon\s+(?:"(?P<qpassword>[^"]*)"|(?P<password>\S+))\s*(?P<command>.*?)\s*$',
+                     re.DOTALL)
+
+NAMES = ('Sarge', 'Jondah', 'Grunt', 'Visor', 'Major', 'Doom', 'Bitterman', 'Klesk', 'Hunter', 'Orbb', 'Slash',
+         'Xaero', 'Ranger', 'Mynx', 'Lucy', 'Razor', 'Keel', 'Tankjr', 'Uriel', 'Wrack')
+CHAT = ('gg', 'nice shot', 'lol', 'where is the rail?', 'rematch?', 'lag...', 'brb', 'ty')
+COMMANDS = ('!help', '!time', '!register', '!regulars')
+Q3_WEAPONS = (('MOD_SHOTGUN', 3), ('MOD_ROCKET', 5), ('MOD_ROCKET_SPLASH', 5), ('MOD_PLASMA', 8),
+              ('MOD_RAILGUN', 10), ('MOD_LIGHTNING', 11), ('MOD_MACHINEGUN', 2))
+COD_WEAPONS = ('mp44_mp', 'kar98k_mp', 'm1garand_mp', 'thompson_mp', 'bar_mp', 'mp40_mp')
+COD_MODS = (('MOD_RIFLE_BULLET', 'torso_upper'), ('MOD_HEAD_SHOT', 'head'), ('MOD_PISTOL_BULLET', 'left_leg_upper'),
+            ('MOD_GRENADE_SPLASH', 'none'))
+Q3_ITEMS = ('weapon_rocketlauncher', 'weapon_plasmagun', 'weapon_railgun', 'item_armor_body', 'item_health_large')
+
+
+class Player(object):
+    """
+    A simulated player.
+    """
+    def __init__(self, game, slot):
+        """
+        Object constructor.
+        :param game: The game flavour
+        :param slot: The player slot number
+        """
+        self.slot = slot
+        self.name = '%s%s' % (random.choice(NAMES), slot)
+        if game == GAME_COD:
+            self.guid = str(random.randint(100000, 999999))
+        else:
+            self.guid = '%032X' % random.getrandbits(128) if game == GAME_Q3 else '%032x' % random.getrandbits(128)
+        self.ip = '10.%s.%s.%s' % (random.randint(0, 255), random.randint(0, 255), random.randint(1, 254))
+        self.port = random.randint(1024, 65000)
+        self.team = random.choice(('axis', 'allies')) if game != GAME_Q3 else random.choice(('1', '2'))
+        self.score = 0
+        self.ping = random.randint(20, 120)
+
+
+class GameEmulator(object):
+    """
+    Emulate a game server: RCON over UDP and a game log written at a given event rate.
+    """
+    def __init__(self, game=GAME_Q3, log=None, host='127.0.0.1', port=27960, password='', players=16, rate=20.0,
+                 commands=0.02, mapname=None):
+        """
+        Object constructor.
+        :param game: The game flavour (q3, cod, cod4)
+        :param log: The game log file path or udp://host:port to stream it
+        :param host: The address where to listen for RCON packets
+        :param port: The port where to listen for RCON packets
+        :param password: The RCON password
+        :param players: The number of simulated players
+        :param rate: The number of game log events written per second
+        :param commands: The fraction of game log events which are B3 commands typed by players
+        :param mapname: The current map name
+        """
+        self.game = game
+        self.log = log
+        self.password = password
+        self.rate = rate
+        self.commands = commands
+        self.maxplayers = players
+        self.mapname = mapname or ('q3dm17' if game == GAME_Q3 else 'mp_carentan')
+        self.players = {}
+        self.cvars = {'sv_hostname': 'B3 emulator', 'g_gametype': '0' if game == GAME_Q3 else 'tdm',
+                      'mapname': self.mapname, 'sv_maxclients': str(max(players, 16)), 'g_logsync': '1',
+                      'sv_maprotation': 'gametype tdm map mp_carentan map mp_dawnville map mp_harbor'}
+        self.lines = 0
+        self.requests = collections.Counter()
+        self.latencies = []
+        self._pending = collections.defaultdict(collections.deque)  # slot => times of the commands typed
+        self._lock = threading.RLock()
+        self._start = time.time()
+        self._stop = threading.Event()
+        self._logfile = None
+        self._logsock = None
+        self._logaddr = None
+        self._sequence = 0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.address = self.socket.getsockname()
+
+    ####################################################################################################################
+    #                                                                                                                  #
+    #   GAME LOG                                                                                                       #
+    #                                                                                                                  #
+    ####################################################################################################################
+
+    def openLog(self):
+        """
+        Open the game log file (or the UDP log stream).
+        """
+        if not self.log:
+            return
+        if self.log.startswith('udp://'):
+            host, port = self.log[6:].rsplit(':', 1)
+            self._logsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._logaddr = (host, int(port))
+        else:
+            self._logfile = open(self.log, 'a', encoding='latin-1')
+
+    def writeLog(self, *lines):
+        """
+        Append lines to the game log.
+        :param lines: The log lines (without timestamp)
+        """
+        elapsed = int(time.time() - self._start)
+        stamp = '%3d:%02d ' % (elapsed // 60, elapsed % 60)
+        data = ''.join('%s%s\n' % (stamp, line) for line in lines)
+        with self._lock:
+            self.lines += len(lines)
+            if self._logfile:
+                self._logfile.write(data)
+                self._logfile.flush()
+            elif self._logsock:
+                self._sequence += 1
+                self._logsock.sendto(RCON_HEADER + b'RLS%d ' % self._sequence + data.encode('latin-1', 'replace'),
+                                     self._logaddr)
+
+    def initGame(self):
+        """
+        Log a new game start.
+        """
+        if self.game == GAME_Q3:
+            self.writeLog('InitGame: \\sv_hostname\\%s\\g_gametype\\%s\\mapname\\%s' % (
+                self.cvars['sv_hostname'], self.cvars['g_gametype'], self.mapname))
+        else:
+            self.writeLog('InitGame: \\g_gametype\\%s\\gamename\\Call of Duty\\mapname\\%s\\sv_hostname\\%s' % (
+                self.cvars['g_gametype'], self.mapname, self.cvars['sv_hostname']))
+
+    def connect(self):
+        """
+        Connect a new player on the first free slot.
+        """
+        with self._lock:
+            slot = 0
+            while slot in self.players:
+                slot += 1
+            player = self.players[slot] = Player(self.game, slot)
+
+        if self.game == GAME_Q3:
+            self.writeLog('ClientConnect: %s' % slot,
+                          'ClientUserinfoChanged: %s n\\%s\\t\\%s\\model\\sarge\\hmodel\\sarge\\c1\\4\\c2\\5' % (
+                              slot, player.name, player.team),
+                          'ClientBegin: %s' % slot)
+        else:
+            self.writeLog('J;%s;%s;%s' % (player.guid, slot, player.name))
+
+    def disconnect(self, slot):
+        """
+        Disconnect a player.
+        :param slot: The player slot number
+        """
+        with self._lock:
+            player = self.players.pop(slot, None)
+            self._pending.pop(slot, None)
+        if player is None:
+            return
+        if self.game == GAME_Q3:
+            self.writeLog('ClientDisconnect: %s' % slot)
+        else:
+            self.writeLog('Q;%s;%s;%s' % (player.guid, slot, player.name))
+
+    def _event(self):
+        """
+        Log a random game event.
+        """
+        with self._lock:
+            players = list(self.players.values())
+        if len(players) < 2:
+            self.connect()
+            return
+
+        killer, victim = random.sample(players, 2)
+        roll = random.random()
+        if roll < self.commands:
+            # a B3 command: the reply (RCON tell to this player) is timed
+            with self._lock:
+                self._pending[killer.slot].append(time.time())
+            self._say(killer, random.choice(COMMANDS))
+        elif roll < 0.10:
+            self._say(killer, random.choice(CHAT))
+        elif roll < 0.12:
+            # connection churn
+            self.disconnect(victim.slot)
+            self.connect()
+        elif self.game == GAME_Q3:
+            if roll < 0.40:
+                self.writeLog('Item: %s %s' % (killer.slot, random.choice(Q3_ITEMS)))
+            else:
+                mod, weapon = random.choice(Q3_WEAPONS)
+                killer.score += 1
+                self.writeLog('Kill: %s %s %s: %s killed %s by %s' % (killer.slot, victim.slot, weapon, killer.name,
+                                                                      victim.name, mod))
+        else:
+            mod, location = random.choice(COD_MODS)
+            action = 'D' if roll < 0.70 else 'K'
+            if action == 'K':
+                killer.score += 1
+            self.writeLog('%s;%s;%s;%s;%s;%s;%s;%s;%s;%s;%s;%s;%s' % (
+                action, victim.guid, victim.slot, victim.team, victim.name, killer.guid, killer.slot, killer.team,
+                killer.name, random.choice(COD_WEAPONS), random.randint(10, 100), mod, location))
+
+    def _say(self, player, text):
+        if self.game == GAME_Q3:
+            self.writeLog('say: %s: %s' % (player.name, text))
+        else:
+            self.writeLog('say;%s;%s;%s;%s' % (player.guid, player.slot, player.name, text))
+
+    def runLog(self):
+        """
+        Write game log events at the configured rate until stopped.
+        """
+        self.openLog()
+        self.initGame()
+        for i in range(self.maxplayers):
+            self.connect()
+
+        interval = 1.0 / self.rate if self.rate > 0 else 1.0
+        nexttime = time.time()
+        while not self._stop.is_set():
+            nexttime += interval
+            self._event()
+            delay = nexttime - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+
+    ####################################################################################################################
+    #                                                                                                                  #
+    #   RCON                                                                                                           #
+    #                                                                                                                  #
+    ####################################################################################################################
+
+    def reply(self, address, text):
+        """
+        Send a RCON reply, split in packets like the engine does.
+        :param address: The address of the RCON client
+        :param text: The reply
+        """
+        chunk = ''
+        for line in text.splitlines(True):
+            if chunk and len(chunk) + len(line) > RCON_CHUNK - 1:
+                self.socket.sendto(RCON_REPLY + chunk.encode('latin-1', 'replace'), address)
+                chunk = ''
+            chunk += line
+        self.socket.sendto(RCON_REPLY + chunk.encode('latin-1', 'replace'), address)
+
+    def getStatus(self):
+        """
+        Return the reply to the status command.
+        """
+        with self._lock:
+            players = sorted(self.players.values(), key=lambda p: p.slot)
+        if self.game == GAME_Q3:
+            lines = ['map: %s' % self.mapname,
+                     'num score ping name            lastmsg address               qport rate',
+                     '--- ----- ---- --------------- ------- --------------------- ----- -----']
+            for p in players:
+                lines.append('%3d %5d %4d %-15s %7d %-21s %5d %5d' % (p.slot, p.score, p.ping, p.name + '^7', 0,
+                                                                      p.ip, p.port, 25000))
+        else:
+            lines = ['map: %s' % self.mapname,
+                     'num score ping guid                             name            lastmsg address               '
+                     'qport rate',
+                     '--- ----- ---- -------------------------------- --------------- ------- ---------------------'
+                     ' ----- -----']
+            for p in players:
+                lines.append('%3d %5d %4d %s %-15s %7d %-21s %5d %5d' % (p.slot, p.score, p.ping, p.guid,
+                                                                         p.name + '^7', 0, '%s:%s' % (p.ip, p.port),
+                                                                         p.port, 25000))
+        return '\n'.join(lines) + '\n\n'
+
+    def getUserInfo(self, slot):
+        """
+        Return the reply to the dumpuser command.
+        :param slot: The player slot number
+        """
+        with self._lock:
+            player = self.players.get(slot)
+        if player is None:
+            return 'Player %s is not on the server\n' % slot
+        return ('userinfo\n--------\nip                  %s:%s\nname                %s\nrate                25000\n'
+                'cl_guid             %s\nteam                %s\n' % (player.ip, player.port, player.name,
+                                                                      player.guid, player.team))
+
+    def getPlayer(self, token):
+        """
+        Return the player matching a slot number or a name.
+        :param token: The slot number or the player name
+        """
+        with self._lock:
+            if token.isdigit():
+                return self.players.get(int(token))
+            for player in self.players.values():
+                if player.name.lower() == token.lower():
+                    return player
+        return None
+
+    def execute(self, command):
+        """
+        Execute a RCON command.
+        :param command: The command
+        :return: The command reply
+        """
+        parts = command.split(None, 2)
+        if not parts:
+            return ''
+        name = parts[0].lower()
+        self.requests[name] += 1
+
+        if name == 'status':
+            return self.getStatus()
+        elif name in ('say', 'bigtext'):
+            return ''
+        elif name == 'tell' and len(parts) > 1:
+            # time the reply to the oldest B3 command typed by this player
+            if parts[1].isdigit():
+                with self._lock:
+                    pending = self._pending.get(int(parts[1]))
+                    if pending:
+                        self.latencies.append(time.time() - pending.popleft())
+            return ''
+        elif name in ('kick', 'clientkick', 'banclient', 'banaddr', 'banid', 'tempban', 'tempbanclient', 'permban'):
+            player = self.getPlayer(parts[1]) if len(parts) > 1 else None
+            if player is None:
+                return 'Player %s is not on the server\n' % (parts[1] if len(parts) > 1 else '')
+            self.disconnect(player.slot)
+            return ''
+        elif name == 'dumpuser' and len(parts) > 1:
+            return self.getUserInfo(int(parts[1])) if parts[1].isdigit() else 'Bad slot number: %s\n' % parts[1]
+        elif name in ('set', 'seta', 'sets', 'setu') and len(parts) > 1:
+            self.cvars[parts[1].lower()] = parts[2].strip('"') if len(parts) > 2 else ''
+            return ''
+        elif name in ('map', 'devmap') and len(parts) > 1:
+            self.changeMap(parts[1])
+            return ''
+        elif name == 'map_rotate':
+            self.changeMap(self.mapname)
+            return ''
+        elif name in self.cvars:
+            return '"%s" is:"%s^7" default:"%s^7"\n' % (name, self.cvars[name], self.cvars[name])
+        return 'Unknown command "%s"\n' % parts[0]
+
+    def changeMap(self, mapname):
+        """
+        Load a new map.
+        :param mapname: The map name
+        """
+        self.writeLog('ShutdownGame:')
+        self.mapname = self.cvars['mapname'] = mapname
+        self.initGame()
+
+    def runRcon(self):
+        """
+        Answer RCON packets until stopped.
+        """
+        self.socket.settimeout(0.2)
+        while not self._stop.is_set():
+            try:
+                data, address = self.socket.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+
+            m = _reRcon.match(data)
+            if not m:
+                continue
+            password = m.group('qpassword') if m.group('qpassword') is not None else m.group('password')
+            if password.decode('latin-1') != self.password:
+                self.reply(address, 'Bad rconpassword.\n')
+                continue
+            self.reply(address, self.execute(m.group('command').decode('latin-1', 'replace')))
+
+    ####################################################################################################################
+    #                                                                                                                  #
+    #   MAIN                                                                                                           #
+    #                                                                                                                  #
+    ####################################################################################################################
+
+    def start(self):
+        """
+        Start emulating the game server.
+        """
+        for target in (self.runRcon, self.runLog):
+            t = threading.Thread(target=target, name='emulator-%s' % target.__name__)
+            t.daemon = True
+            t.start()
+
+    def stop(self):
+        """
+        Stop emulating the game server.
+        """
+        self._stop.set()
+        if self._logfile:
+            self._logfile.close()
+
+    def getReport(self):
+        """
+        Return a summary of the emulator activity.
+        """
+        elapsed = time.time() - self._start
+        lines = ['%s log lines in %0.1f sec (%0.1f lines/sec), %s players' % (self.lines, elapsed,
+                                                                            self.lines / elapsed, len(self.players)),
+                 'rcon requests: %s' % ', '.join('%s=%s' % x for x in self.requests.most_common())]
+        latencies = sorted(self.latencies)
+        if latencies:
+            def pct(p):
+                return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))] * 1000
+            lines.append('log line to rcon reply: %s replies, p50 %0.1f ms, p90 %0.1f ms, p99 %0.1f ms, max %0.1f ms'
+                         % (len(latencies), pct(50), pct(90), pct(99), latencies[-1] * 1000))
+        pending = sum(len(x) for x in self._pending.values())
+        if pending:
+            lines.append('commands without reply: %s' % pending)
+        return '\n'.join(lines)
+
+
+def main(args=None):
+    """
+    Run the emulator from the command line.
+    """
+    p = argparse.ArgumentParser(description='Emulate a q3/cod game server (RCON and game log) to load test B3')
+    p.add_argument('-g', '--game', dest='game', choices=GAMES, default=GAME_Q3, help='game flavour (default: q3)')
+    p.add_argument('-l', '--log', dest='log', default=None,
+                   help='game log file to append to, or udp://host:port to stream it (default: no game log)')
+    p.add_argument('--host', dest='host', default='127.0.0.1', help='address to listen on for RCON')
+    p.add_argument('-p', '--rcon-port', dest='port', type=int, default=27960, help='port to listen on for RCON')
+    p.add_argument('-w', '--password', dest='password', default='', help='RCON password')
+    p.add_argument('-n', '--players', dest='players', type=int, default=16, help='number of simulated players')
+    p.add_argument('-r', '--rate', dest='rate', type=float, default=20.0, help='game log events per second')
+    p.add_argument('-c', '--commands', dest='commands', type=float, default=0.02,
+                   help='fraction of the game log events which are B3 commands typed by players')
+    p.add_argument('-d', '--duration', dest='duration', type=float, default=0,
+                   help='seconds to run for (default: until interrupted)')
+    p.add_argument('-i', '--report', dest='report', type=float, default=10,
+                   help='seconds between two activity reports')
+    options = p.parse_args(args)
+
+    emulator = GameEmulator(options.game, options.log, options.host, options.port, options.password,
+                            options.players, options.rate, options.commands)
+    print('Emulating a %s game server: rcon on %s:%s, game log: %s' % (options.game, emulator.address[0],
+                                                                       emulator.address[1], options.log or 'none'))
+    emulator.start()
+    start = time.time()
+    try:
+        while not options.duration or time.time() - start < options.duration:
+            time.sleep(min(options.report, options.duration - (time.time() - start)) if options.duration
+                       else options.report)
+            print(emulator.getReport())
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+    print(emulator.getReport())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# ################################################################### #
+#                                                                     #
+#  BigBrotherBot(B3) (www.bigbrotherbot.net)                          #
+#  Copyright (C) 2005 Michael "ThorN" Thornton                        #
+#                                                                     #
+#  This program is free software; you can redistribute it and/or      #
+#  modify it under the terms of the GNU General Public License        #
+#  as published by the Free Software Foundation; either version 2     #
+#  of the License, or (at your option) any later version.             #
+#                                                                     #
+#  This program is distributed in the hope that it will be useful,    #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of     #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the       #
+#  GNU General Public License for more details.                       #
+#                                                                     #
+#  You should have received a copy of the GNU General Public License  #
+#  along with this program; if not, write to the Free Software        #
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA      #
+#  02110-1301, USA.                                                   #
+#                                                                     #
+# ################################################################### #
+
+__author__ = 'ThorN, Courgette'
+__version__ = '1.0'
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+B3_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+CONFIG = """<configuration>
+  <settings name="b3">
+    <set name="bot_name">b3</set>
+    <set name="bot_prefix">^0(^2b3^0)^7:</set>
+    <set name="time_format">%%I:%%M%%p %%Z %%m/%%d/%%y</set>
+    <set name="time_zone">UTC</set>
+    <set name="log_level">9</set>
+    <set name="logfile">%(dir)s/b3.log</set>
+    <set name="parser">q3</set>
+    <set name="database">sqlite://%(dir)s/b3.db</set>
+  </settings>
+  <settings name="server">
+    <set name="rcon_password">replay</set>
+    <set name="port">27960</set>
+    <set name="public_ip">127.0.0.1</set>
+    <set name="rcon_ip">127.0.0.1</set>
+    <set name="delay">0.33</set>
+    <set name="lines_per_second">0</set>
+    <set name="game_log">%(dir)s/games.log</set>
+  </settings>
+  <settings name="plugins">
+    <set name="external_dir">@b3/extplugins</set>
+  </settings>
+  <plugins>
+    <plugin name="admin" config="@b3/conf/plugin_admin.ini"/>
+  </plugins>
+</configuration>
+"""
+
+GAME_LOG = r"""  0:00 InitGame: \sv_hostname\B3 replay\g_gametype\0\mapname\q3dm17
+  0:00 ClientConnect: 0
+  0:00 ClientUserinfoChanged: 0 n\Keel\t\2\model\sarge\hmodel\sarge\c1\4\c2\5
+  0:00 ClientBegin: 0
+  0:01 ClientConnect: 1
+  0:01 ClientUserinfoChanged: 1 n\Lucy\t\1\model\sarge\hmodel\sarge\c1\4\c2\5
+  0:01 ClientBegin: 1
+  0:02 say: Keel: hello
+  0:03 say: Lucy: !help
+  0:04 Kill: 0 1 10: Keel killed Lucy by MOD_RAILGUN
+  0:05 ClientDisconnect: 1
+  0:06 ShutdownGame:
+"""
+
+
+class Test_replay(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'b3.xml'), 'w') as f:
+            f.write(CONFIG % {'dir': self.dir})
+        with open(os.path.join(self.dir, 'games.log'), 'w') as f:
+            f.write(GAME_LOG)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_replay_exits(self):
+        # B3 must shut down by itself once the whole game log has been replayed
+        process = subprocess.Popen([sys.executable, 'b3_run.py', '-c', os.path.join(self.dir, 'b3.xml'),
+                                    '--replay', os.path.join(self.dir, 'games.log')],
+                                   cwd=B3_ROOT, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        try:
+            output, _ = process.communicate(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            self.fail('B3 did not exit after replaying the game log')
+        output = output.decode('utf-8', 'replace')
+        self.assertEqual(0, process.returncode, output)
+        self.assertIn('Replay complete', output)
+
+
+if __name__ == '__main__':
+    unittest.main()